@@ -8,8 +8,9 @@
 # lrvic - https://github.com/lrvick/raspi-hd44780/blob/master/hd44780.py
 # LiquidCrystal - https://github.com/arduino/Arduino/blob/master/libraries/LiquidCrystal/LiquidCrystal.cpp
 
-from Adafruit_I2C import Adafruit_I2C
-from time import sleep
+from Adafruit_I2C import Adafruit_I2C, I2CError, PRIORITY_DISPLAY
+from button_input import ButtonInput # Formerly defined here
+from time import sleep, time
 
 class Adafruit_CharLCDPlate(Adafruit_I2C):
 
@@ -20,6 +21,9 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
     MCP23017_IOCON_BANK0    = 0x0A  # IOCON when Bank 0 active
     MCP23017_IOCON_BANK1    = 0x15  # IOCON when Bank 1 active
     # These are register addresses when in Bank 1 only:
+    MCP23017_GPINTENA       = 0x02
+    MCP23017_INTCONA        = 0x04
+    MCP23017_INTCAPA        = 0x08
     MCP23017_GPIOA          = 0x09
     MCP23017_IODIRB         = 0x10
     MCP23017_GPIOB          = 0x19
@@ -30,6 +34,7 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
     DOWN                    = 2
     UP                      = 3
     LEFT                    = 4
+    BUTTONS                 = 0b00011111
 
     # LED colors
     OFF                     = 0x00
@@ -72,17 +77,62 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
     LCD_MOVERIGHT   = 0x04
     LCD_MOVELEFT    = 0x00
 
+    # LCD timing strategies for slow instructions (see write())
+    TIMING_POLLED   = 0  # Read the busy flag before the next write
+    TIMING_DEADLINE = 1  # Wait out the datasheet time instead
+    LCD_SLOW_TIME   = 0.002 # Clear / home: 1.52 mS at the nominal
+                            # oscillator, with margin for a slow one
+
 
     # ----------------------------------------------------------------------
     # Constructor
 
-    def __init__(self, busnum=-1, addr=0x20, debug=False):
+    def __init__(self, busnum=-1, addr=0x20, debug=False,
+                 timing=TIMING_POLLED, clock=time, sleep=sleep):
+
+        # LCD writes give way to reads (buttons, other devices) between
+        # blocks when the bus is shared
+        self.i2c = Adafruit_I2C(addr, busnum, debug, PRIORITY_DISPLAY)
 
-        self.i2c = Adafruit_I2C(addr, busnum, debug)
+        # Timing strategy, its time source and counters for each path
+        self.timing         = timing
+        self.clock          = clock
+        self.sleep          = sleep
+        self.readyAt        = None # Deadline mode: LCD free again at
+        self.polls          = 0    # Busy flag polls
+        self.pollLoops      = 0    # Busy flag reads in those polls
+        self.deadlineWaits  = 0    # Deadline waits that had to sleep
+        self.deadlinePassed = 0    # Deadlines already over when checked
+        self.waitTime       = 0.0  # Total seconds slept on deadlines
 
         # I2C is relatively slow.  MCP output port states are cached
         # so we don't need to constantly poll-and-change bit states.
-        self.porta, self.portb, self.ddrb = 0, 0, 0b00010000
+        # The LCD state is unknown on startup, so the first write waits.
+        self.porta, self.portb, self.ddrb = 0, 0, self.D7_INPUT
+        if timing == self.TIMING_DEADLINE:
+            self.ddrb    = 0
+            self.readyAt = clock() + self.LCD_SLOW_TIME
+
+        # Write-combining state; see transmit()
+        self.pending = bytearray() # PORTB bytes not yet sent
+        self.strobed = False       # pending holds LCD strobes (E pulses)
+        self.dirty   = 0           # DIRTY_* flags
+        self.held    = False       # Buffer until flush()
+
+        # Transfers (i2c.transaction calls: one I2C_RDWR ioctl each, or
+        # the smbus calls standing in for it) and payload bytes sent to
+        # the plate, for profiling
+        self.txcount, self.txbytes = 0, 0
+        self.txerrors = 0     # Transfers lost, see lost()
+        self.desynced = False # LCD to be resynced before the next send
+
+        # Edge source wired to INTA when interrupt-on-change is enabled
+        self.intsource = None
+
+        # Shadow copy of DDRAM for render(); see resetShadow()
+        self.numlines = 2
+        self.shift    = 0 # Display shift, DDRAM column shown leftmost
+        self.resetShadow()
 
         # Set MCP23017 IOCON register to Bank 0 with sequential operation.
         # If chip is already set for Bank 0, this will just write to OLATB,
@@ -136,14 +186,14 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
                                self.LCD_CURSOROFF |
                                self.LCD_BLINKOFF)
 
-        self.write(0x33) # Init
-        self.write(0x32) # Init
-        self.write(0x28) # 2 line 5x8 matrix
-        self.write(self.LCD_CLEARDISPLAY)
-        self.write(self.LCD_CURSORSHIFT    | self.displayshift)
-        self.write(self.LCD_ENTRYMODESET   | self.displaymode)
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
-        self.write(self.LCD_RETURNHOME)
+        self.send(0x33) # Init
+        self.send(0x32) # Init
+        self.send(0x28) # 2 line 5x8 matrix
+        self.send(self.LCD_CLEARDISPLAY)
+        self.send(self.LCD_CURSORSHIFT    | self.displayshift)
+        self.send(self.LCD_ENTRYMODESET   | self.displaymode)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_RETURNHOME)
 
 
     # ----------------------------------------------------------------------
@@ -179,79 +229,247 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
     # instruction has been issued (e.g. screen clear), as well as on
     # startup, and polling will then occur before more commands or data
     # are issued.
+    #
+    # Polling costs at least four transactions to wait about 1.5 mS.  In
+    # TIMING_DEADLINE mode the instruction is sent right away and the
+    # time it is due to finish is recorded instead; D7 stays an output.
+    # Data can still be queued meanwhile, only transmit() waits, and
+    # only for what is left of the deadline, so other work done between
+    # the two costs nothing.  readyIn() tells callers how long is left.
 
     pollables = ( LCD_CLEARDISPLAY, LCD_RETURNHOME )
 
-    # Write byte, list or string value to LCD
+    # Precomputed PORTB sequences: strobes[bitmask][byte] is the 4-byte
+    # out4() result as a str, for each combination of the RS (data) bit
+    # and the blue backlight bit.  Filled in once after the class body.
+    strobes = None
+
+    @classmethod
+    def buildStrobes(cls):
+        res = {}
+        for bitmask in (0b00000000, 0b00000001, 0b10000000, 0b10000001):
+            res[bitmask] = tuple(
+              str(bytearray(cls.out4.im_func(cls, bitmask, v)))
+              for v in range(256))
+        return res
+
+    # Port state write-combining.  The plate stays in Bank 1 byte mode:
+    # strobe sequences rely on the address pointer staying on GPIOB,
+    # which Bank 0 byte mode (pointer toggles between the A/B pair) and
+    # sequential mode (pointer walks on) both break, and GPIOA, GPIOB and
+    # IODIRB are not adjacent in any layout that allows that.  Instead,
+    # PORTB bytes (LCD strobes and the blue backlight bit) are appended
+    # to one pending stream and GPIOA / IODIRB changes are only marked
+    # dirty; transmit() then sends GPIOA, the stream and the direction
+    # change that has to follow it, each at most once, as one combined
+    # transfer.  With I2C_RDWR that is a single ioctl however long the
+    # stream; on smbus the stream goes out in 32-byte blocks.
+
+    D7_INPUT    = 0b00000010 # IODIRB bit of LCD D7 (PB1), the busy flag
+    DIRTY_PORTA = 0b01
+    DIRTY_DDRB  = 0b10
+
+    def hold(self):
+        """ Combine port writes until flush().  Returns True if writes
+        were already being held (i.e. someone else will flush) """
+        held, self.held = self.held, True
+        return held
+
+
+    def flush(self):
+        """ Send everything held back by hold() """
+        self.held = False
+        self.transmit()
+
+
+    # A transfer that carries strobes is not retried: bytes that reached
+    # the LCD before the failure would be clocked in twice.
+
+    def transmit(self):
+        i2c, messages = self.i2c, []
+        if self.dirty & self.DIRTY_PORTA:
+            messages.append(i2c.msgWrite(self.MCP23017_GPIOA, (self.porta,)))
+            self.txbytes += 1
+        data = self.pending
+        if data:
+            # Only strobes reach the LCD; the blue backlight bit alone
+            # doesn't have to wait for it
+            if self.readyAt is not None and self.strobed:
+                self.waitReady()
+            messages.append(i2c.msgWrite(self.MCP23017_GPIOB, data))
+            self.txbytes += len(data)
+            self.pending = bytearray()
+        if self.dirty & self.DIRTY_DDRB:
+            messages.append(i2c.msgWrite(self.MCP23017_IODIRB, (self.ddrb,)))
+            self.txbytes += 1
+        retries = 0 if self.strobed else None
+        self.dirty, self.strobed = 0, False
+        if messages:
+            try:
+                i2c.transaction(messages, retries)
+            except I2CError:
+                self.lost()
+                return
+            self.txcount += 1
+
+
+    # A transfer failed (after the error policy's retries, if any; see
+    # the bus stats).  Some of it may have reached the plate, so nothing
+    # it holds is known any more: the port A and direction registers go
+    # out again (D7 as an output, no busy polling on a confused LCD),
+    # the LCD is resynced before the next send (a partial strobe stream
+    # can leave it half way through a byte) and the next render() homes
+    # the display and redraws in full.
+    def lost(self):
+        self.txerrors += 1
+        self.resetShadow(False)
+        self.shift    = None
+        self.desynced = True
+        self.ddrb    &= ~self.D7_INPUT & 0xFF
+        self.dirty   |= self.DIRTY_PORTA | self.DIRTY_DDRB
+
+
+    # Back to a known 4-bit state from any nibble phase: three 0x3
+    # nibbles select 8-bit mode whatever came before, 0x2 returns to
+    # 4-bit, then the function set and modes go out as in __init__.  The
+    # direction register goes first so D7 carries the stream, and an
+    # instruction mangled by the loss gets the slow instruction time to
+    # finish.  The sequence is queued in front of the caller's send().
+    def resync(self):
+        self.desynced = False
+        self.transmit()
+        self.readyAt  = self.clock() + self.LCD_SLOW_TIME
+        held, self.held = self.held, True
+        for value in (0x33, 0x32, 0x28,
+                      self.LCD_DISPLAYCONTROL | self.displaycontrol,
+                      self.LCD_ENTRYMODESET   | self.displaymode):
+            self.send(value)
+        self.held = held
+
+
+    # Write byte, list or string value to LCD.  The DDRAM shadow can't
+    # follow raw writes, so the next render() redraws in full.
     def write(self, value, char_mode=False):
         """ Send command/data to LCD """
+        self.resetShadow(False)
+        self.send(value, char_mode)
+
+
+    # write() for the driver's own methods, which keep the shadow right
+    def send(self, value, char_mode=False):
 
         # If pin D7 is in input state, poll LCD busy flag until clear.
-        if self.ddrb & 0b00010000:
-            lo = (self.portb & 0b00000001) | 0b01000000
-            hi = lo | 0b00100000 # E=1 (strobe)
-            self.i2c.bus.write_byte_data(
-              self.i2c.address, self.MCP23017_GPIOB, lo)
-            while True:
-                # Strobe high (enable)
-                self.i2c.bus.write_byte(self.i2c.address, hi)
-                # First nybble contains busy state
-                bits = self.i2c.bus.read_byte(self.i2c.address)
-                # Strobe low, high, low.  Second nybble (A3) is ignored.
-                self.i2c.bus.write_i2c_block_data(
-                  self.i2c.address, self.MCP23017_GPIOB, [lo, hi, lo])
-                if (bits & 0b00000010) == 0: break # D7=0, not busy
-            self.portb = lo
-
-            # Polling complete, change D7 pin to output
-            self.ddrb &= 0b11101111
-            self.i2c.bus.write_byte_data(self.i2c.address,
-              self.MCP23017_IODIRB, self.ddrb)
+        if self.ddrb & self.D7_INPUT:
+            self.transmit() # The instruction being waited on goes first
+            self.pollBusy()
+
+        if self.desynced: self.resync()
 
         bitmask = self.portb & 0b00000001   # Mask out PORTB LCD control bits
         if char_mode: bitmask |= 0b10000000 # Set data bit if not a command
+        table = self.strobes[bitmask]
 
-        # If string or list, iterate through multiple write ops
+        # Look up the 4 PORTB bytes per value (high 4 data bits with
+        # strobe set and unset, then the same for the low 4 bits) and
+        # append them to the pending stream.  A string is walked as a
+        # bytearray so no per-character objects are created.
         if isinstance(value, str):
-            last = len(value) - 1 # Last character in string
-            data = []             # Start with blank list
-            for i, v in enumerate(value): # For each character...
-                # Append 4 bytes to list representing PORTB over time.
-                # First the high 4 data bits with strobe (enable) set
-                # and unset, then same with low 4 data bits (strobe 1/0).
-                data.extend(self.out4(bitmask, ord(v)))
-                # I2C block data write is limited to 32 bytes max.
-                # If limit reached, write data so far and clear.
-                # Also do this on last byte if not otherwise handled.
-                if (len(data) >= 32) or (i == last):
-                    self.i2c.bus.write_i2c_block_data(
-                      self.i2c.address, self.MCP23017_GPIOB, data)
-                    self.portb = data[-1] # Save state of last byte out
-                    data       = []       # Clear list for next iteration
+            self.pending += ''.join(map(table.__getitem__, bytearray(value)))
         elif isinstance(value, list):
-            # Same as above, but for list instead of string
-            last = len(value) - 1
-            data = []
-            for i, v in enumerate(value):
-                data.extend(self.out4(bitmask, v))
-                if (len(data) >= 32) or (i == last):
-                    self.i2c.bus.write_i2c_block_data(
-                      self.i2c.address, self.MCP23017_GPIOB, data)
-                    self.portb = data[-1]
-                    data       = []
+            self.pending += ''.join(map(table.__getitem__, value))
         else:
-            # Single byte
-            data = self.out4(bitmask, value)
-            self.i2c.bus.write_i2c_block_data(
-              self.i2c.address, self.MCP23017_GPIOB, data)
-            self.portb = data[-1]
+            self.pending += table[value]
+        if self.pending:
+            self.portb   = self.pending[-1] # State of last byte out
+            self.strobed = True
 
         # If a poll-worthy instruction was issued, reconfigure D7
         # pin as input to indicate need for polling on next call.
         if (not char_mode) and (value in self.pollables):
-            self.ddrb |= 0b00010000
-            self.i2c.bus.write_byte_data(self.i2c.address,
-              self.MCP23017_IODIRB, self.ddrb)
+            if self.timing == self.TIMING_DEADLINE:
+                self.transmit()
+                self.readyAt = self.clock() + self.LCD_SLOW_TIME
+            else:
+                self.ddrb  |= self.D7_INPUT
+                self.dirty |= self.DIRTY_DDRB
+
+        if not self.held:
+            self.transmit()
+
+
+    # Busy flag read: RW=1, E high presents the high nibble (busy flag on
+    # D7) while GPIOB is read.  The address pointer stays on GPIOB in
+    # byte mode, so the read follows the block write that raised E, and
+    # finishing the nibble pair plus raising E for the next read is one
+    # more block: one combined transfer per iteration (an smbus block
+    # write and read_byte without I2C_RDWR).  None of these transfers
+    # are retried (see transmit()).
+    def pollBusy(self):
+        # The read relies on the register pointer the write before it
+        # left, so no other thread may get at the plate in between
+        with self.i2c.bus.hold():
+            try:
+                self.pollBusyHeld()
+            except I2CError:
+                self.lost() # Stops polling too
+
+
+    def pollBusyHeld(self):
+        i2c   = self.i2c
+        GPIOB = self.MCP23017_GPIOB
+        lo    = (self.portb & 0b00000001) | 0b01000000
+        hi    = lo | 0b00100000 # E=1 (strobe)
+        read  = i2c.msgRead(1)
+        i2c.transaction([i2c.msgWrite(GPIOB, (lo, hi)), read], 0)
+        self.txcount += 1
+        self.txbytes += 2
+        self.polls   += 1
+        while True:
+            self.pollLoops += 1
+            if (read.data[0] & self.D7_INPUT) == 0: break # D7=0, not busy
+            # Strobe low, high (second nybble, ignored), low, high
+            read = i2c.msgRead(1)
+            i2c.transaction([i2c.msgWrite(GPIOB, (lo, hi, lo, hi)), read], 0)
+            self.txcount += 1
+            self.txbytes += 4
+        self.portb = lo
+
+        # Polling complete, finish the nybble and change D7 pin to output
+        self.ddrb &= ~self.D7_INPUT & 0xFF
+        i2c.transaction([i2c.msgWrite(GPIOB, (lo, hi, lo)),
+                         i2c.msgWrite(self.MCP23017_IODIRB, (self.ddrb,))], 0)
+        self.txcount += 1
+        self.txbytes += 4
+
+
+    def waitReady(self):
+        remaining    = self.readyAt - self.clock()
+        self.readyAt = None
+        if remaining > 0:
+            self.deadlineWaits += 1
+            self.waitTime      += remaining
+            self.sleep(remaining)
+        else:
+            self.deadlinePassed += 1
+
+
+    def readyIn(self):
+        """ Seconds until the LCD takes data again, 0 if it already does """
+        if self.readyAt is None: return 0
+        return max(0, self.readyAt - self.clock())
+
+
+    def setTiming(self, timing):
+        """ Switch between TIMING_POLLED and TIMING_DEADLINE """
+        if timing == self.timing: return
+        self.transmit()
+        if timing == self.TIMING_DEADLINE and self.ddrb & self.D7_INPUT:
+            # A slow instruction was never confirmed, allow its full time
+            self.ddrb   &= ~self.D7_INPUT & 0xFF
+            self.dirty  |= self.DIRTY_DDRB
+            self.readyAt = self.clock() + self.LCD_SLOW_TIME
+            self.transmit()
+        self.timing = timing
 
 
     # ----------------------------------------------------------------------
@@ -263,11 +481,94 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
         self.clear()
 
 
+    # ----------------------------------------------------------------------
+    # Shadow framebuffer
+
+    # Each display line has 40 bytes of DDRAM (20 per row on 4-line
+    # displays, where rows 2/3 continue rows 0/1).  render() keeps a
+    # copy of what the controller holds and only sends the cells that
+    # differ, positioning with SETDDRAMADDR instead of the slow
+    # RETURNHOME / CLEARDISPLAY instructions.  Anything the shadow can't
+    # follow (message(), write(), scrolling or a changed entry mode, which
+    # moves the address counter differently) marks it unknown, and the
+    # next render() redraws in full.
+
+    DDRAM_WIDTH = 40
+    RENDER_GAP  = 2 # Unchanged cells worth resending to avoid an address set
+
+    def resetShadow(self, valid=True):
+        width       = self.DDRAM_WIDTH if self.numlines <= 2 else 20
+        self.shadow = [bytearray(' ' * width) for r in range(self.numlines)]
+        # Per-cell flag: shadow cell matches the controller
+        self.known  = [bytearray(chr(valid) * width)
+                       for r in range(self.numlines)]
+        # DDRAM address counter, if known
+        self.ddramAddr = 0 if valid else None
+
+
+    def render(self, rows, shift=0):
+        """ Draw list of row strings, sending only changed cells.
+        Rows may be up to DDRAM_WIDTH long; shift selects the DDRAM column
+        shown at the left edge (see setDisplayShift). """
+        held = self.hold() # The whole frame goes out as one stream
+        for r, text in enumerate(rows[:self.numlines]):
+            shadow = self.shadow[r]
+            known  = self.known[r]
+            text   = bytearray(str(text)[:len(shadow)])
+            n      = len(text)
+            col    = 0
+            while col < n:
+                if known[col] and text[col] == shadow[col]:
+                    col += 1
+                    continue
+                # Extend the run across short unchanged gaps
+                start = end = col
+                col  += 1
+                while col < n:
+                    if not known[col] or text[col] != shadow[col]:
+                        end = col
+                    elif col - end > self.RENDER_GAP:
+                        break
+                    col += 1
+                addr = self.row_offsets[r] + start
+                if addr != self.ddramAddr:
+                    self.send(self.LCD_SETDDRAMADDR | addr)
+                self.send(str(text[start:end + 1]), True)
+                shadow[start:end + 1] = text[start:end + 1]
+                known[start:end + 1]  = '\x01' * (end + 1 - start)
+                self.ddramAddr = addr + end + 1 - start
+        self.setDisplayShift(shift)
+        if not held: self.flush()
+
+
+    # Hardware marquee.  The HD44780 can move the visible window over the
+    # 40-column DDRAM line with a single CURSORSHIFT instruction, and the
+    # window wraps around at the end of the line.  Loading a line into
+    # DDRAM once and then stepping the shift scrolls it for one command
+    # per step.  Both lines always shift together.
+    def setDisplayShift(self, shift):
+        """ Move the display window so DDRAM column shift is leftmost """
+        if self.shift is None: self.home() # Unknown since a lost transfer
+        width = self.DDRAM_WIDTH
+        steps = (shift - self.shift) % width
+        if steps == 0: return
+        if steps <= width // 2:
+            cmd = self.LCD_DISPLAYMOVE | self.LCD_MOVELEFT
+        else:
+            cmd   = self.LCD_DISPLAYMOVE | self.LCD_MOVERIGHT
+            steps = width - steps
+        self.displayshift = cmd
+        self.shift        = shift % width
+        # Shift instructions are fast, several go out in one block write
+        self.send([self.LCD_CURSORSHIFT | cmd] * steps)
+
+
     # Puts the MCP23017 back in Bank 0 + sequential write mode so
     # that other code using the 'classic' library can still work.
     # Any code using this newer version of the library should
     # consider adding an atexit() handler that calls this.
     def stop(self):
+        self.flush()
         self.porta = 0b11000000  # Turn off LEDs on the way out
         self.portb = 0b00000001
         sleep(0.0015)
@@ -299,130 +600,163 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
             self.portb ]) # OLATB
 
 
+    # State the driver tracks is updated before the instruction goes
+    # out, so a transfer lost on the way (see lost()) leaves it unknown
+
     def clear(self):
-        self.write(self.LCD_CLEARDISPLAY)
+        self.resetShadow()
+        self.shift = 0
+        self.send(self.LCD_CLEARDISPLAY)
 
 
     def home(self):
-        self.write(self.LCD_RETURNHOME)
+        self.ddramAddr = 0
+        self.shift     = 0
+        self.send(self.LCD_RETURNHOME)
 
 
     row_offsets = ( 0x00, 0x40, 0x14, 0x54 )
     def setCursor(self, col, row):
         if row > self.numlines: row = self.numlines - 1
         elif row < 0:           row = 0
-        self.write(self.LCD_SETDDRAMADDR | (col + self.row_offsets[row]))
+        self.ddramAddr = col + self.row_offsets[row]
+        self.send(self.LCD_SETDDRAMADDR | self.ddramAddr)
 
 
     def display(self):
         """ Turn the display on (quickly) """
         self.displaycontrol |= self.LCD_DISPLAYON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def noDisplay(self):
         """ Turn the display off (quickly) """
         self.displaycontrol &= ~self.LCD_DISPLAYON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def cursor(self):
         """ Underline cursor on """
         self.displaycontrol |= self.LCD_CURSORON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def noCursor(self):
         """ Underline cursor off """
         self.displaycontrol &= ~self.LCD_CURSORON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def ToggleCursor(self):
         """ Toggles the underline cursor On/Off """
         self.displaycontrol ^= self.LCD_CURSORON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def blink(self):
         """ Turn on the blinking cursor """
         self.displaycontrol |= self.LCD_BLINKON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def noBlink(self):
         """ Turn off the blinking cursor """
         self.displaycontrol &= ~self.LCD_BLINKON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def ToggleBlink(self):
         """ Toggles the blinking cursor """
         self.displaycontrol ^= self.LCD_BLINKON
-        self.write(self.LCD_DISPLAYCONTROL | self.displaycontrol)
+        self.send(self.LCD_DISPLAYCONTROL | self.displaycontrol)
 
 
     def scrollDisplayLeft(self):
         """ These commands scroll the display without changing the RAM """
         self.displayshift = self.LCD_DISPLAYMOVE | self.LCD_MOVELEFT
-        self.write(self.LCD_CURSORSHIFT | self.displayshift)
+        self.resetShadow(False)
+        if self.shift is not None:
+            self.shift = (self.shift + 1) % self.DDRAM_WIDTH
+        self.send(self.LCD_CURSORSHIFT | self.displayshift)
 
 
     def scrollDisplayRight(self):
         """ These commands scroll the display without changing the RAM """
         self.displayshift = self.LCD_DISPLAYMOVE | self.LCD_MOVERIGHT
-        self.write(self.LCD_CURSORSHIFT | self.displayshift)
+        self.resetShadow(False)
+        if self.shift is not None:
+            self.shift = (self.shift - 1) % self.DDRAM_WIDTH
+        self.send(self.LCD_CURSORSHIFT | self.displayshift)
 
 
     def leftToRight(self):
         """ This is for text that flows left to right """
         self.displaymode |= self.LCD_ENTRYLEFT
-        self.write(self.LCD_ENTRYMODESET | self.displaymode)
+        self.resetShadow(False)
+        self.send(self.LCD_ENTRYMODESET | self.displaymode)
 
 
     def rightToLeft(self):
         """ This is for text that flows right to left """
         self.displaymode &= ~self.LCD_ENTRYLEFT
-        self.write(self.LCD_ENTRYMODESET | self.displaymode)
+        self.resetShadow(False)
+        self.send(self.LCD_ENTRYMODESET | self.displaymode)
 
 
     def autoscroll(self):
         """ This will 'right justify' text from the cursor """
         self.displaymode |= self.LCD_ENTRYSHIFTINCREMENT
-        self.write(self.LCD_ENTRYMODESET | self.displaymode)
+        self.resetShadow(False)
+        self.send(self.LCD_ENTRYMODESET | self.displaymode)
 
 
     def noAutoscroll(self):
         """ This will 'left justify' text from the cursor """
         self.displaymode &= ~self.LCD_ENTRYSHIFTINCREMENT
-        self.write(self.LCD_ENTRYMODESET | self.displaymode)
+        self.resetShadow(False)
+        self.send(self.LCD_ENTRYMODESET | self.displaymode)
 
 
     def createChar(self, location, bitmap):
-        self.write(self.LCD_SETCGRAMADDR | ((location & 7) << 3))
-        self.write(bitmap, True)
-        self.write(self.LCD_SETDDRAMADDR)
+        held = self.hold()
+        self.ddramAddr = 0
+        self.send(self.LCD_SETCGRAMADDR | ((location & 7) << 3))
+        self.send(bitmap, True)
+        self.send(self.LCD_SETDDRAMADDR)
+        if not held: self.flush()
 
 
     def message(self, text):
         """ Send string to LCD. Newline wraps to second line"""
+        self.resetShadow(False)          # Bypasses render()
         lines = str(text).split('\n')    # Split at newline(s)
+        held  = self.hold()              # Combine into one stream
         for i, line in enumerate(lines): # For each substring...
             if i > 0:                    # If newline(s),
-                self.write(0xC0)         #  set DDRAM address to 2nd line
-            self.write(line, True)       # Issue substring
+                self.send(0xC0)         #  set DDRAM address to 2nd line
+            self.send(line, True)       # Issue substring
+        if not held: self.flush()
 
 
     def backlight(self, color):
-        c          = ~color
-        self.porta = (self.porta & 0b00111111) | ((c & 0b011) << 6)
-        self.portb = (self.portb & 0b11111110) | ((c & 0b100) >> 2)
-        # Has to be done as two writes because sequential operation is off.
-        self.i2c.bus.write_byte_data(
-          self.i2c.address, self.MCP23017_GPIOA, self.porta)
-        self.i2c.bus.write_byte_data(
-          self.i2c.address, self.MCP23017_GPIOB, self.portb)
-
+        c     = ~color
+        porta = (self.porta & 0b00111111) | ((c & 0b011) << 6)
+        portb = (self.portb & 0b11111110) | ((c & 0b100) >> 2)
+        # GPIOA and GPIOB can't share a write with sequential operation
+        # off, but the blue bit rides along with any pending LCD data.
+        if porta != self.porta:
+            self.porta  = porta
+            self.dirty |= self.DIRTY_PORTA
+        if portb != self.portb:
+            self.portb = portb
+            self.pending.append(portb)
+        if not self.held:
+            self.transmit()
+
+
+    # Button reads go through the I2C error policy: a read that keeps
+    # failing repeats the last good state (never all-pressed, as the
+    # old -1 did), or raises I2CError if there is none yet.
 
     # Read state of single button
     def buttonPressed(self, b):
@@ -431,11 +765,53 @@ class Adafruit_CharLCDPlate(Adafruit_I2C):
 
     # Read and return bitmask of combined button state
     def buttons(self):
-        return self.i2c.readU8(self.MCP23017_GPIOA) & 0b11111
+        return self.i2c.readU8(self.MCP23017_GPIOA) & self.BUTTONS
 
 
     # ----------------------------------------------------------------------
-    # Test code
+    # Interrupt-on-change input
+
+    # With interrupts enabled the MCP23017 pulls INTA low whenever a
+    # button changes state and latches port A in INTCAPA.  Instead of
+    # polling GPIOA, callers block on an edge source wired to INTA (see
+    # gpio_edge) and only touch the bus when the line fires.  Reading
+    # INTCAPA releases the line again.
+    def enableInterrupts(self, source, pins=BUTTONS):
+        self.intsource = source
+        # INTCON=0: compare against previous pin value, so both press
+        # and release raise an interrupt
+        self.i2c.bus.write_byte_data(
+          self.i2c.address, self.MCP23017_INTCONA, 0)
+        self.i2c.bus.write_byte_data(
+          self.i2c.address, self.MCP23017_GPINTENA, pins)
+        # Drop anything latched before the source was armed
+        self.i2c.bus.read_byte_data(
+          self.i2c.address, self.MCP23017_INTCAPA)
+
+
+    def disableInterrupts(self):
+        self.i2c.bus.write_byte_data(
+          self.i2c.address, self.MCP23017_GPINTENA, 0)
+        self.intsource = None
+
+
+    # Read button bitmask latched by the last interrupt (clears it)
+    def interruptButtons(self):
+        return self.i2c.readU8(self.MCP23017_INTCAPA) & self.BUTTONS
+
+
+    def waitButtons(self, timeout=None):
+        """ Block until a button changes state or timeout (seconds)
+        expires.  Returns the latched button bitmask, None on timeout """
+        if self.intsource.wait(timeout):
+            return self.interruptButtons()
+        return None
+
+Adafruit_CharLCDPlate.strobes = Adafruit_CharLCDPlate.buildStrobes()
+
+
+# ----------------------------------------------------------------------
+# Test code
 
 if __name__ == '__main__':
 
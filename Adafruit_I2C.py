@@ -1,6 +1,348 @@
 #!/usr/bin/python
 
-import smbus
+import smbus, threading, heapq, errno
+import i2c_rdwr
+from time import time, sleep
+
+# Bus priorities, lower goes first
+PRIORITY_INPUT   = 0 # Short reads someone is waiting on (buttons)
+PRIORITY_NORMAL  = 1
+PRIORITY_DISPLAY = 2 # Long LCD block writes
+
+# ===========================================================================
+# I2CBus Class
+# ===========================================================================
+
+class DeviceStats :
+  "Bus use by one device address"
+
+  def __init__(self):
+    self.transactions = 0
+    self.bytes        = 0
+    self.errors       = 0
+    self.busy         = 0.0 # Seconds on the bus
+    self.wait         = 0.0 # Seconds queued for it
+    self.retries      = 0   # Register accesses tried again (ErrorPolicy)
+    self.failures     = 0   # ... that failed for good
+    self.stale        = 0   # Reads answered with the last good value
+    self.recoveries   = 0   # Bus handle reopened on its behalf
+
+class BusHold :
+  "Context manager keeping the bus across several transactions"
+
+  def __init__(self, bus, priority):
+    self.bus      = bus
+    self.priority = priority
+
+  def __enter__(self):
+    self.bus.acquire(self.priority)
+    return self
+
+  def __exit__(self, *exc):
+    self.bus.release()
+    return False
+
+class I2CError(IOError) :
+  """ A register access or transaction that still failed once the
+  device's ErrorPolicy gave up; errno is that of the last underlying
+  IOError.  reg is None for a transaction starting with a read. """
+
+  def __init__(self, address, reg, cause, attempts):
+    where = "0x%02X" % address
+    if reg is not None:
+      where += " reg 0x%02X" % reg
+    IOError.__init__(self, getattr(cause, 'errno', None),
+      "%s: %s (%d attempts)" %
+      (where, getattr(cause, 'strerror', None) or cause, attempts))
+    self.address  = address
+    self.reg      = reg
+    self.cause    = cause
+    self.attempts = attempts
+
+class ErrorPolicy :
+  """ What Adafruit_I2C register accesses and transactions do about an
+  IOError (a NACK or arbitration loss on a noisy bus).  The access is tried again up to
+  retries times, sleeping backoff seconds before the first retry and
+  twice as long before each further one, as long as the retry would
+  still start within budget seconds of the first attempt; after the
+  recoverAfter-th failure in a row the bus handle is reopened before
+  retrying.  A read that fails for good returns the register's last good
+  value if stale is set and there is one, so a glitch repeats the
+  previous input state instead of inventing one; otherwise (and for
+  writes) it raises I2CError.  Nothing is printed; see DeviceStats. """
+
+  def __init__(self, retries=3, backoff=0.0002, budget=0.005,
+               recoverAfter=2, stale=True, sleep=sleep, clock=time):
+    self.retries      = retries
+    self.backoff      = backoff
+    self.budget       = budget
+    self.recoverAfter = recoverAfter
+    self.stale        = stale
+    self.sleep        = sleep
+    self.clock        = clock
+
+class I2CBus :
+  """ One shared smbus handle per bus number, handed out by get().  Each
+  transaction takes the bus lock; when it is contended the waiter with
+  the lowest priority number goes next (first come, first served within
+  a priority), so a button read queued behind a long LCD frame goes in
+  between two of its 32-byte blocks, also when transaction() falls back
+  to smbus.  hold() keeps the bus for sequences that must not be
+  interleaved (the LCD busy flag poll).
+  transaction() sends a list of i2c_rdwr messages as one I2C_RDWR ioctl
+  where the adapter supports it, else as the equivalent smbus calls
+  (clear useRDWR before opening to always use smbus).  reopen() swaps
+  the smbus handle when errors persist.  Totals over all
+  buses are class attributes; stats holds per-device
+  use, busy time over elapsed time is the device's bus utilisation. """
+
+  buses        = {}
+  busesLock    = threading.Lock()
+  useRDWR      = True
+  transactions = 0
+  bytes        = 0
+  errors       = 0
+  recoveries   = 0
+
+  @classmethod
+  def get(cls, busnum):
+    with cls.busesLock:
+      bus = cls.buses.get(busnum)
+      if bus is None:
+        bus = cls.buses[busnum] = cls(busnum)
+      return bus
+
+  def __init__(self, busnum):
+    self.busnum  = busnum
+    self.smbus   = smbus.SMBus(busnum)
+    self.rdwr    = None
+    if self.useRDWR:
+      try:
+        self.rdwr = i2c_rdwr.RDWRBus(busnum)
+      except (IOError, OSError):
+        pass # No device node or no plain I2C: smbus only
+    self.cond    = threading.Condition(threading.Lock())
+    self.owner   = None
+    self.depth   = 0
+    self.waiters = [] # Heap of (priority, arrival)
+    self.arrival = 0
+    self.stats   = {} # Address -> DeviceStats
+    self.started = time()
+
+  def acquire(self, priority=PRIORITY_NORMAL):
+    "Takes the bus (reentrant); returns the seconds spent waiting"
+    me = threading.current_thread()
+    with self.cond:
+      if self.owner is me:
+        self.depth += 1
+        return 0.0
+      if self.owner is None and not self.waiters:
+        self.owner = me
+        self.depth = 1
+        return 0.0
+      start = time()
+      self.arrival += 1
+      entry = (priority, self.arrival)
+      heapq.heappush(self.waiters, entry)
+      while self.owner is not None or self.waiters[0] != entry:
+        self.cond.wait()
+      heapq.heappop(self.waiters)
+      self.owner = me
+      self.depth = 1
+      return time() - start
+
+  def release(self):
+    with self.cond:
+      self.depth -= 1
+      if self.depth == 0:
+        self.owner = None
+        if self.waiters:
+          self.cond.notify_all()
+
+  def hold(self, priority=PRIORITY_NORMAL):
+    return BusHold(self, priority)
+
+  def transfer(self, addr, priority, nbytes, func, *args):
+    "Runs one smbus call under the bus lock, accounting it to addr"
+    wait   = self.acquire(priority)
+    start  = time()
+    failed = False
+    try:
+      return func(*args)
+    except IOError:
+      failed = True
+      raise
+    finally:
+      stats = self.account(addr, wait, start, nbytes)
+      if failed:
+        stats.errors  += 1
+        I2CBus.errors += 1
+      self.release()
+
+  def transaction(self, messages, priority=PRIORITY_NORMAL):
+    "Sends i2c_rdwr messages, filling in the reads; returns the messages"
+    if self.rdwr is not None:
+      nbytes = sum(len(message.data) for message in messages)
+      try:
+        self.transfer(messages[0].addr, priority, nbytes, self.rdwr.transfer,
+          messages)
+        return messages
+      except IOError, err:
+        # Some adapters take I2C_RDWR but not every combination (too
+        # many messages for their quirks); those go back to smbus
+        if err.errno not in (errno.EOPNOTSUPP, errno.ENOTSUP):
+          raise
+        self.rdwr.close()
+        self.rdwr = None
+    self.smbusTransfer(messages, priority)
+    return messages
+
+  def smbusTransfer(self, messages, priority):
+    # A register address followed by a read becomes one register read.
+    # Writes longer than a block are split, each part going to the same
+    # register again (right for a device that keeps the pointer, like
+    # the plate's MCP23017 in byte mode).  The bus is only held across
+    # a write and a bare read after it, which picks up the register
+    # pointer the write left; anything else may be overtaken between
+    # two smbus calls, as it would be between two transactions.
+    i = 0
+    while i < len(messages):
+      message = messages[i]
+      addr, data = message.addr, message.data
+      after = messages[i + 1] if i + 1 < len(messages) else None
+      follows = after is not None and after.read and after.addr == addr
+      if message.read:
+        self.smbusRead(message, priority)
+      elif len(data) == 1 and follows:
+        length = len(after.data)
+        if length == 1:
+          after.data[0] = self.transfer(addr, priority, 1,
+            self.smbus.read_byte_data, addr, data[0])
+        else:
+          after.data[:] = bytearray(self.transfer(addr, priority, length,
+            self.smbus.read_i2c_block_data, addr, data[0], length))
+        i += 1
+      elif follows:
+        with self.hold(priority):
+          self.smbusWrite(message, priority)
+          self.smbusRead(after, priority)
+        i += 1
+      else:
+        self.smbusWrite(message, priority)
+      i += 1
+
+  def smbusRead(self, message, priority):
+    # From wherever the device's register pointer is
+    addr, data = message.addr, message.data
+    for j in range(len(data)):
+      data[j] = self.transfer(addr, priority, 1, self.smbus.read_byte, addr)
+
+  def smbusWrite(self, message, priority):
+    addr, data = message.addr, message.data
+    if len(data) == 1:
+      self.transfer(addr, priority, 1, self.smbus.write_byte, addr, data[0])
+    elif len(data) == 2:
+      self.transfer(addr, priority, 1, self.smbus.write_byte_data, addr,
+        data[0], data[1])
+    else:
+      for j in xrange(1, len(data), 32):
+        block = list(data[j:j + 32])
+        self.transfer(addr, priority, len(block),
+          self.smbus.write_i2c_block_data, addr, data[0], block)
+
+  def account(self, addr, wait, start, nbytes):
+    # Runs with the bus held, so the adds don't race
+    stats = self.device(addr)
+    stats.transactions  += 1
+    stats.bytes         += nbytes
+    stats.busy          += time() - start
+    stats.wait          += wait
+    I2CBus.transactions += 1
+    I2CBus.bytes        += nbytes
+    return stats
+
+  def device(self, addr):
+    "addr's DeviceStats"
+    stats = self.stats.get(addr)
+    if stats is None:
+      stats = self.stats[addr] = DeviceStats()
+    return stats
+
+  def reopen(self):
+    """ Swaps in a fresh smbus handle, for errors that outlast a retry
+    (the adapter may have been reset under the old one).  The old handle
+    closes once nothing uses it: a transfer queued for the bus may
+    already hold one of its methods. """
+    with self.hold(PRIORITY_INPUT):
+      self.smbus = smbus.SMBus(self.busnum)
+      I2CBus.recoveries += 1
+
+  def utilisation(self):
+    "Address -> fraction of the time since the bus was opened spent on it"
+    elapsed = time() - self.started
+    return dict((addr, stats.busy / elapsed if elapsed > 0 else 0.0)
+                for addr, stats in self.stats.items())
+
+class I2CHandle :
+  """ smbus-compatible view of a shared I2CBus for one device.  Writes go
+  at the device's priority, reads (short, usually waited on) at
+  readPriority. """
+
+  def __init__(self, bus, priority=PRIORITY_NORMAL,
+               readPriority=PRIORITY_INPUT):
+    self.bus          = bus
+    self.priority     = priority
+    self.readPriority = min(priority, readPriority)
+
+  def hold(self, priority=None):
+    return self.bus.hold(self.priority if priority is None else priority)
+
+  def transaction(self, messages):
+    "See I2CBus.transaction; reads only go at readPriority"
+    for message in messages:
+      if not message.read:
+        return self.bus.transaction(messages, self.priority)
+    return self.bus.transaction(messages, self.readPriority)
+
+  def write_quick(self, addr):
+    return self.bus.transfer(addr, self.priority, 0,
+      self.bus.smbus.write_quick, addr)
+
+  def read_byte(self, addr):
+    return self.bus.transfer(addr, self.readPriority, 1,
+      self.bus.smbus.read_byte, addr)
+
+  def write_byte(self, addr, val):
+    return self.bus.transfer(addr, self.priority, 1,
+      self.bus.smbus.write_byte, addr, val)
+
+  def read_byte_data(self, addr, reg):
+    return self.bus.transfer(addr, self.readPriority, 1,
+      self.bus.smbus.read_byte_data, addr, reg)
+
+  def write_byte_data(self, addr, reg, val):
+    return self.bus.transfer(addr, self.priority, 1,
+      self.bus.smbus.write_byte_data, addr, reg, val)
+
+  def read_word_data(self, addr, reg):
+    return self.bus.transfer(addr, self.readPriority, 2,
+      self.bus.smbus.read_word_data, addr, reg)
+
+  def write_word_data(self, addr, reg, val):
+    return self.bus.transfer(addr, self.priority, 2,
+      self.bus.smbus.write_word_data, addr, reg, val)
+
+  def read_i2c_block_data(self, addr, reg, length=32):
+    return self.bus.transfer(addr, self.readPriority, length,
+      self.bus.smbus.read_i2c_block_data, addr, reg, length)
+
+  def write_i2c_block_data(self, addr, reg, vals):
+    return self.bus.transfer(addr, self.priority, len(vals),
+      self.bus.smbus.write_i2c_block_data, addr, reg, vals)
+
+  def __getattr__(self, name):
+    # Anything else (pec, ...) goes straight to the shared handle
+    return getattr(self.bus.smbus, name)
 
 # ===========================================================================
 # Adafruit_I2C Class
@@ -8,6 +350,8 @@ import smbus
 
 class Adafruit_I2C :
 
+  busNumber = None # Detected once, /proc/cpuinfo doesn't change
+
   @staticmethod
   def getPiRevision():
     "Gets the version number of the Raspberry Pi board"
@@ -24,17 +368,25 @@ class Adafruit_I2C :
   @staticmethod
   def getPiI2CBusNumber():
     # Gets the I2C bus number /dev/i2c#
-    return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
+    if Adafruit_I2C.busNumber is None:
+      Adafruit_I2C.busNumber = 1 if Adafruit_I2C.getPiRevision() > 1 else 0
+    return Adafruit_I2C.busNumber
  
-  def __init__(self, address, busnum=-1, debug=False):
+  def __init__(self, address, busnum=-1, debug=False,
+               priority=PRIORITY_NORMAL, policy=None):
     self.address = address
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
     # Alternatively, you can hard-code the bus version below:
-    # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
-    # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    self.bus = smbus.SMBus(
-      busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
+    # self.bus = I2CHandle(I2CBus.get(0)); # Force I2C0 (early 256MB Pi's)
+    # self.bus = I2CHandle(I2CBus.get(1)); # Force I2C1 (512MB Pi's)
+    # Devices on the same bus share one handle and take turns on it.
+    self.bus = I2CHandle(I2CBus.get(
+      busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber()), priority)
     self.debug = debug
+    # Failed accesses are retried and counted, not printed; reads that
+    # still fail raise I2CError or repeat the last good value
+    self.policy   = policy or ErrorPolicy()
+    self.lastRead = {} # (reg, size) -> last value read
 
   def reverseByteOrder(self, data):
     "Reverses the byte order of an int (16-bit) or long (32-bit) value"
@@ -46,96 +398,142 @@ class Adafruit_I2C :
       data >>= 8
     return val
 
+  # Messages for transaction(), addressed to this device
+  def msgWrite(self, reg, values=()):
+    "Register address and the bytes written from there"
+    data = bytearray([reg])
+    data.extend(values)
+    return i2c_rdwr.Message(self.address, False, data)
+
+  def msgRead(self, length):
+    "Reads from wherever the register pointer is"
+    return i2c_rdwr.read(self.address, length)
+
+  def transaction(self, messages, retries=None):
+    """ Sends a list of msgWrite() / msgRead() messages back to back,
+    in one I2C_RDWR ioctl when the adapter can; returns them with the
+    reads filled in (message.data).  A failed transaction is retried as
+    a whole under the error policy, then raises I2CError.  Part of it
+    may have gone out before the failure, so streams that must not be
+    replayed pass retries=0 (fail on the first error). """
+    first = messages[0]
+    reg   = None if first.read else first.data[0]
+    if retries is None:
+      retries = self.policy.retries
+    return self.attempt(retries, reg, self.bus.transaction, (messages,))
+
   def errMsg(self):
     print "Error accessing 0x%02X: Check your I2C address" % self.address
     return -1
 
+  def access(self, reg, func, *args):
+    "Runs one smbus call for reg under the error policy"
+    return self.attempt(self.policy.retries, reg, func, args)
+
+  def attempt(self, retries, reg, func, args):
+    "access() with the number of retries given"
+    policy   = self.policy
+    attempts = 0
+    while True:
+      try:
+        return func(*args)
+      except IOError, err:
+        attempts += 1
+        bus   = self.bus.bus
+        stats = bus.device(self.address)
+        if attempts == 1:
+          deadline = policy.clock() + policy.budget
+          delay    = policy.backoff
+        if (attempts > retries or
+            policy.clock() + delay > deadline):
+          stats.failures += 1
+          error = I2CError(self.address, reg, err, attempts)
+          if self.debug:
+            print "I2C: %s" % error
+          raise error
+        stats.retries += 1
+        if attempts == policy.recoverAfter:
+          bus.reopen()
+          stats.recoveries += 1
+        policy.sleep(delay)
+        delay *= 2
+
+  def read(self, reg, size, func, *args):
+    "A register read under the policy, falling back to the stale value"
+    key = (reg, size)
+    try:
+      result = self.access(reg, func, *args)
+    except I2CError:
+      if not self.policy.stale or key not in self.lastRead:
+        raise
+      self.bus.bus.device(self.address).stale += 1
+      return self.lastRead[key]
+    self.lastRead[key] = result
+    return result
+
   def write8(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
-    try:
-      self.bus.write_byte_data(self.address, reg, value)
-      if self.debug:
-        print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
-    except IOError, err:
-      return self.errMsg()
+    self.access(reg, self.bus.write_byte_data, self.address, reg, value)
+    if self.debug:
+      print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
 
   def write16(self, reg, value):
     "Writes a 16-bit value to the specified register/address pair"
-    try:
-      self.bus.write_word_data(self.address, reg, value)
-      if self.debug:
-        print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
-         (value, reg, reg+1))
-    except IOError, err:
-      return self.errMsg()
+    self.access(reg, self.bus.write_word_data, self.address, reg, value)
+    if self.debug:
+      print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
+       (value, reg, reg+1))
 
   def writeList(self, reg, list):
     "Writes an array of bytes using I2C format"
-    try:
-      if self.debug:
-        print "I2C: Writing list to register 0x%02X:" % reg
-        print list
-      self.bus.write_i2c_block_data(self.address, reg, list)
-    except IOError, err:
-      return self.errMsg()
+    if self.debug:
+      print "I2C: Writing list to register 0x%02X:" % reg
+      print list
+    self.access(reg, self.bus.write_i2c_block_data, self.address, reg, list)
 
   def readList(self, reg, length):
     "Read a list of bytes from the I2C device"
-    try:
-      results = self.bus.read_i2c_block_data(self.address, reg, length)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
-         (self.address, reg))
-        print results
-      return results
-    except IOError, err:
-      return self.errMsg()
+    results = self.read(reg, length, self.bus.read_i2c_block_data,
+      self.address, reg, length)
+    if self.debug:
+      print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
+       (self.address, reg))
+      print results
+    return results
 
   def readU8(self, reg):
     "Read an unsigned byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.read(reg, 1, self.bus.read_byte_data, self.address, reg)
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readS8(self, reg):
     "Reads a signed byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if result > 127: result -= 256
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.read(reg, 1, self.bus.read_byte_data, self.address, reg)
+    if result > 127: result -= 256
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readU16(self, reg):
     "Reads an unsigned 16-bit value from the I2C device"
-    try:
-      result = self.bus.read_word_data(self.address, reg)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" %
-         (self.address, result & 0xFFFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.read(reg, 2, self.bus.read_word_data, self.address, reg)
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" %
+       (self.address, result & 0xFFFF, reg))
+    return result
 
   def readS16(self, reg):
     "Reads a signed 16-bit value from the I2C device"
-    try:
-      result = self.bus.read_word_data(self.address, reg)
-      if result > 32767: result -= 65536
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" %
-         (self.address, result & 0xFFFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.read(reg, 2, self.bus.read_word_data, self.address, reg)
+    if result > 32767: result -= 65536
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" %
+       (self.address, result & 0xFFFF, reg))
+    return result
 
 
 if __name__ == '__main__':
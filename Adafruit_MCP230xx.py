@@ -21,6 +21,8 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import threading, traceback
+from time import time, sleep
 from Adafruit_I2C import Adafruit_I2C
 
 class Adafruit_MCP230XX(Adafruit_I2C):
@@ -30,6 +32,10 @@ class Adafruit_MCP230XX(Adafruit_I2C):
 
     MCP23017_IODIRA = 0x00
     MCP23017_IODIRB = 0x01
+    MCP23017_IPOLA  = 0x02
+    MCP23017_IPOLB  = 0x03
+    MCP23017_GPINTENA = 0x04
+    MCP23017_INTCONA  = 0x08
     MCP23017_GPPUA  = 0x0C
     MCP23017_GPPUB  = 0x0D
     MCP23017_GPIOA  = 0x12
@@ -37,51 +43,114 @@ class Adafruit_MCP230XX(Adafruit_I2C):
     MCP23017_OLATA  = 0x14
     MCP23017_OLATB  = 0x15
     MCP23008_IODIR  = 0x00
+    MCP23008_IPOL   = 0x01
+    MCP23008_GPINTEN = 0x02
+    MCP23008_INTCON  = 0x04
     MCP23008_GPIO   = 0x09
     MCP23008_GPPU   = 0x06
     MCP23008_OLAT   = 0x0A
 
+    # The configuration registers are cached in the attributes below;
+    # changes only mark them dirty, and flush() writes each dirty one
+    # once, both ports of an MCP23017 in one 16-bit write (Bank 0
+    # sequential mode puts the B register right after the A one).
+    # Between hold() and flush() any number of pin changes cost one
+    # transaction per register.
+    DIRTY_IODIR = 0b0001
+    DIRTY_IPOL  = 0b0010
+    DIRTY_GPPU  = 0b0100
+    DIRTY_OLAT  = 0b1000
+    REGISTERS   = (
+      # Dirty flag, cache attribute, MCP23008 register, MCP23017 port A
+      (DIRTY_IODIR, 'direction',   MCP23008_IODIR, MCP23017_IODIRA),
+      (DIRTY_IPOL,  'polarity',    MCP23008_IPOL,  MCP23017_IPOLA),
+      (DIRTY_GPPU,  'pullups',     MCP23008_GPPU,  MCP23017_GPPUA),
+      (DIRTY_OLAT,  'outputvalue', MCP23008_OLAT,  MCP23017_OLATA))
+
 
     def __init__(self, address, num_gpios=8, busnum=-1, debug=False):
 
         assert 0 < num_gpios < 17, "Number of GPIOs must be between 1 and 16"
 
-        self.i2c       = Adafruit_I2C(address, busnum, debug)
-        self.num_gpios = num_gpios
-        self.pullups   = 0
+        self.i2c        = Adafruit_I2C(address, busnum, debug)
+        self.num_gpios  = num_gpios
+        self.pins       = (1 << num_gpios) - 1
+        self.pullups    = 0
+        self.polarity   = 0
+        self.inputvalue = 0     # GPIO as of the last readAll()
+        self.held       = False # Buffer until flush()
 
         # Set default pin values -- all inputs with pull-ups disabled.
         # Current OLAT (output) value is polled, not set.
+        self.direction = 0xFF if num_gpios <= 8 else 0xFFFF
+        self.dirty     = self.DIRTY_IODIR | self.DIRTY_IPOL | self.DIRTY_GPPU
+        self.flush()
         if num_gpios <= 8:
-            self.direction = 0xFF
-            self.i2c.write8(self.MCP23008_IODIR, self.direction)
-            self.i2c.write8(self.MCP23008_GPPU , self.pullups)
             self.outputvalue = self.i2c.readU8(self.MCP23008_OLAT)
         else:
-            self.direction = 0xFFFF
-            self.i2c.write16(self.MCP23017_IODIRA, self.direction)
-            self.i2c.write16(self.MCP23017_GPPUA , self.pullups)
             self.outputvalue = self.i2c.readU16(self.MCP23017_OLATA)
 
 
+    def hold(self):
+        """ Combine register writes until flush().  Returns True if writes
+        were already being held (i.e. someone else will flush) """
+        held, self.held = self.held, True
+        return held
+
+
+    def flush(self):
+        """ Write every register changed since hold() """
+        self.held = False
+        for flag, attr, reg8, reg16 in self.REGISTERS:
+            if self.dirty & flag:
+                if self.num_gpios <= 8:
+                    self.i2c.write8(reg8, getattr(self, attr))
+                else:
+                    self.i2c.write16(reg16, getattr(self, attr))
+                self.dirty &= ~flag
+
+
+    def update(self, attr, flag, mask, on):
+        # Set or clear the mask bits of a cached register
+        assert 0 <= mask <= self.pins, "Pin mask 0x%X is invalid, must be within 0x%X" % (mask, self.pins)
+        value = getattr(self, attr)
+        if on: new = value |  mask
+        else:  new = value & ~mask
+        if new != value:
+            setattr(self, attr, new)
+            self.dirty |= flag
+        if not self.held:
+            self.flush()
+        return new
+
+
+    # Set all pins in mask to either INPUT or OUTPUT mode
+    def configMask(self, mask, mode):
+        return self.update('direction', self.DIRTY_IODIR, mask,
+                           mode == self.INPUT)
+
+
+    # Enable pull-up resistors on all pins in mask
+    def pullupMask(self, mask, enable):
+        return self.update('pullups', self.DIRTY_GPPU, mask, enable)
+
+
+    # Invert the input value of all pins in mask
+    def polarityMask(self, mask, invert):
+        return self.update('polarity', self.DIRTY_IPOL, mask, invert)
+
+
+    # Write value to all output pins in mask
+    def outputMask(self, mask, value):
+        return self.update('outputvalue', self.DIRTY_OLAT, mask, value)
+
+
     # Set single pin to either INPUT or OUTPUT mode
     def config(self, pin, mode):
 
         assert 0 <= pin < self.num_gpios, "Pin number %s is invalid, must be between 0 and %s" % (pin, self.num_gpios-1)
 
-        if mode is self.INPUT: self.direction |=  (1 << pin)
-        else:                  self.direction &= ~(1 << pin)
-
-        if self.num_gpios <= 8:
-            self.i2c.write8(self.MCP23008_IODIR, self.direction)
-        elif pin < 8:
-            # Replace low bits (IODIRA)
-            self.i2c.write8(self.MCP23017_IODIRA, self.direction & 0xFF)
-        else:
-            # Replace high bits (IODIRB)
-            self.i2c.write8(self.MCP23017_IODIRB, self.direction >> 8)
-
-        return self.direction
+        return self.configMask(1 << pin, mode)
 
 
     # Enable pull-up resistor on single input pin
@@ -91,29 +160,29 @@ class Adafruit_MCP230XX(Adafruit_I2C):
         if check:
             assert (self.direction & (1 << pin)) != 0, "Pin %s not set to input" % pin
 
-        if enable: self.pullups |=  (1 << pin)
-        else:      self.pullups &= ~(1 << pin)
+        return self.pullupMask(1 << pin, enable)
+
 
+    # Read every pin in one transaction; input(pin, cached=True) then
+    # answers from this snapshot without touching the bus
+    def readAll(self):
         if self.num_gpios <= 8:
-            self.i2c.write8(self.MCP23008_GPPU, self.pullups)
-        elif pin < 8:
-            # Replace low bits (GPPUA)
-            self.i2c.write8(self.MCP23017_GPPUA, self.pullups & 0xFF)
+            self.inputvalue = self.i2c.readU8(self.MCP23008_GPIO)
         else:
-            # Replace high bits (GPPUB)
-            self.i2c.write8(self.MCP23017_GPPUB, self.pullups >> 8)
-
-        return self.pullups
+            self.inputvalue = self.i2c.readU16(self.MCP23017_GPIOA)
+        return self.inputvalue
 
 
     # Read value from single input pin
-    def input(self, pin, check=True):
+    def input(self, pin, check=True, cached=False):
 
         assert 0 <= pin < self.num_gpios, "Pin number %s is invalid, must be between 0 and %s" % (pin, self.num_gpios-1)
         if check:
             assert (self.direction & (1 << pin)) != 0, "Pin %s not set to input" % pin
 
-        if self.num_gpios <= 8:
+        if cached:
+            return (self.inputvalue >> pin) & 1
+        elif self.num_gpios <= 8:
             value = self.i2c.readU8(self.MCP23008_GPIO)
             return (value >> pin) & 1
         elif pin < 8:
@@ -131,22 +200,20 @@ class Adafruit_MCP230XX(Adafruit_I2C):
         assert 0 <= pin < self.num_gpios, "Pin number %s is invalid, must be between 0 and %s" % (pin, self.num_gpios-1)
         # assert self.direction & (1 << pin) == 0, "Pin %s not set to output" % pin
 
-        if value: new = self.outputvalue |  (1 << pin)
-        else:     new = self.outputvalue & ~(1 << pin)
-
-        # Only write if pin value has changed:
-        if new is not self.outputvalue:
-            self.outputvalue = new
-            if self.num_gpios <= 8:
-                self.i2c.write8(self.MCP23008_OLAT, new)
-            elif pin < 8:
-                # Write to low bits (OLATA)
-                self.i2c.write8(self.MCP23017_OLATA, new & 0xFF)
-            else:
-                # Write to high bits (OLATB)
-                self.i2c.write8(self.MCP23017_OLATB, new >> 8)
+        # Only written if the pin value has changed
+        return self.outputMask(1 << pin, value)
 
-        return new
+
+    # Raise INT on any change of the pins in mask (INTCON=0: compare
+    # against the previous value); reading GPIO releases it again.  On
+    # the MCP23017 port B pins drive INTB unless IOCON.MIRROR is set.
+    def enableInterrupts(self, mask):
+        if self.num_gpios <= 8:
+            self.i2c.write8(self.MCP23008_INTCON, 0)
+            self.i2c.write8(self.MCP23008_GPINTEN, mask)
+        else:
+            self.i2c.write16(self.MCP23017_INTCONA, 0)
+            self.i2c.write16(self.MCP23017_GPINTENA, mask)
 
 
 # The following two methods (inputAll and outputAll) neither assert
@@ -168,6 +235,7 @@ class Adafruit_MCP230XX(Adafruit_I2C):
     # Write contiguous value to all output pins
     def outputAll(self, value):
       self.outputvalue = value
+      self.dirty      &= ~self.DIRTY_OLAT
       if self.num_gpios <= 8:
         self.i2c.bus.write_byte_data(self.i2c.address,
          self.MCP23008_OLAT, value)
@@ -176,16 +244,143 @@ class Adafruit_MCP230XX(Adafruit_I2C):
          self.MCP23017_OLATA, value)
 
 
+# Edge detection for MCP230XX_GPIO.  One thread per chip samples all
+# pins with a single readAll() (one transaction however many pins are
+# watched) every interval seconds, or when an edge source wired to the
+# chip's INT line fires (see gpio_edge), and dispatches the changes.
+# The thread runs only while some pin is watched.
+
+class EdgeWatch(object):
+
+    def __init__(self, edge, bouncetime):
+        self.edge      = edge
+        self.bounce    = bouncetime or 0.0 # Seconds
+        self.callbacks = []
+        self.detected  = False
+        self.last      = None              # Time of the last edge
+
+
+class EdgeSampler(object):
+
+    RISING  = 31 # Same values as RPi.GPIO
+    FALLING = 32
+    BOTH    = 33
+
+    def __init__(self, chip, interval=0.01, intsource=None):
+        self.chip      = chip
+        self.interval  = interval
+        self.intsource = intsource
+        self.cond      = threading.Condition()
+        self.watches   = {}   # Pin -> EdgeWatch
+        self.value     = None # Last sample, edges are relative to it
+        self.thread    = None
+
+    def watch(self, pin, edge, bouncetime=None):
+        with self.cond:
+            if pin in self.watches:
+                raise RuntimeError("Conflicting edge detection already enabled for pin %s" % pin)
+            watch = self.watches[pin] = EdgeWatch(edge, bouncetime)
+            try:
+                self.changed()
+            except:
+                del self.watches[pin]
+                raise
+        return watch
+
+    def unwatch(self, pin):
+        with self.cond:
+            if self.watches.pop(pin, None) is not None:
+                self.changed()
+
+    def changed(self):
+        # Called with cond held.  A starting thread's baseline is read
+        # here, before interrupts are enabled, so the first edge after
+        # watch() is already dispatched (the thread only samples after
+        # an interrupt or a full interval).
+        starting = self.watches and self.thread is None
+        if starting:
+            self.value = self.chip.readAll()
+        if self.intsource is not None:
+            mask = 0
+            for pin in self.watches:
+                mask |= 1 << pin
+            self.chip.enableInterrupts(mask)
+        if starting:
+            self.thread = threading.Thread(target=self.run,
+                                           name='mcp230xx-edges')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.watches:
+                    self.thread = None
+                    return
+            if self.intsource is None:
+                sleep(self.interval)
+            elif not self.intsource.wait(self.interval):
+                continue
+            try:
+                self.sample()
+            except IOError:
+                pass # A failed read (see ErrorPolicy) just misses a sample
+
+    def sample(self):
+        value = self.chip.readAll()
+        now   = time()
+        calls = []
+        with self.cond:
+            last, self.value = self.value, value
+            changed = last ^ value
+            for pin, watch in self.watches.items():
+                bit = 1 << pin
+                if not changed & bit:
+                    continue
+                if (watch.edge != self.BOTH and
+                    (watch.edge == self.RISING) != bool(value & bit)):
+                    continue
+                if watch.last is not None and now - watch.last < watch.bounce:
+                    continue
+                watch.last     = now
+                watch.detected = True
+                calls.extend((callback, pin) for callback in watch.callbacks)
+            self.cond.notify_all()
+        for callback, pin in calls:
+            try:
+                callback(pin)
+            except Exception:
+                traceback.print_exc() # Keep sampling for the other pins
+
+    def waitDetected(self, watch, timeout=None):
+        "Blocks until watch sees an edge, True if so, False on timeout"
+        deadline = None if timeout is None else time() + timeout
+        with self.cond:
+            while not watch.detected:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+
 # RPi.GPIO compatible interface for MCP23017 and MCP23008
 
 class MCP230XX_GPIO(object):
-    OUT   = 0
-    IN    = 1
-    BCM   = 0
-    BOARD = 0
-
-    def __init__(self, busnum, address, num_gpios):
-        self.chip = Adafruit_MCP230XX(busnum, address, num_gpios)
+    OUT     = 0
+    IN      = 1
+    BCM     = 0
+    BOARD   = 0
+    RISING  = EdgeSampler.RISING
+    FALLING = EdgeSampler.FALLING
+    BOTH    = EdgeSampler.BOTH
+
+    # interval: seconds between samples for edge detection; intsource
+    # (a gpio_edge source on the chip's INT line) samples on interrupt
+    def __init__(self, busnum, address, num_gpios, interval=0.01,
+                 intsource=None):
+        self.chip    = Adafruit_MCP230XX(address, num_gpios, busnum)
+        self.sampler = EdgeSampler(self.chip, interval, intsource)
     def setmode(self, mode):
         pass # do nothing
     def setup(self, pin, mode):
@@ -197,6 +392,48 @@ class MCP230XX_GPIO(object):
     def pullup(self, pin, value):
         self.chip.pullup(pin, value)
 
+    def checkInput(self, pin, edge):
+        assert 0 <= pin < self.chip.num_gpios, "Pin number %s is invalid, must be between 0 and %s" % (pin, self.chip.num_gpios-1)
+        assert edge in (self.RISING, self.FALLING, self.BOTH), "Edge %s is invalid" % edge
+        if not self.chip.direction & (1 << pin):
+            raise RuntimeError("You must setup() pin %s as an input first" % pin)
+
+    # Times are in milliseconds, as in RPi.GPIO
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.checkInput(pin, edge)
+        watch = self.sampler.watch(pin, edge, bouncetime and bouncetime / 1000.0)
+        if callback is not None:
+            watch.callbacks.append(callback)
+    def add_event_callback(self, pin, callback):
+        watch = self.sampler.watches.get(pin)
+        if watch is None:
+            raise RuntimeError("Add event detection using add_event_detect first before adding a callback")
+        watch.callbacks.append(callback)
+    def remove_event_detect(self, pin):
+        self.sampler.unwatch(pin)
+    def event_detected(self, pin):
+        "True once for each pin that saw its edge since the last call"
+        with self.sampler.cond:
+            watch = self.sampler.watches.get(pin)
+            if watch is None or not watch.detected:
+                return False
+            watch.detected = False
+            return True
+    def wait_for_edge(self, pin, edge, bouncetime=None, timeout=None):
+        "Returns pin once the edge is seen, None on timeout"
+        self.checkInput(pin, edge)
+        watch = self.sampler.watch(pin, edge, bouncetime and bouncetime / 1000.0)
+        try:
+            seconds = None if timeout is None else timeout / 1000.0
+            if self.sampler.waitDetected(watch, seconds):
+                return pin
+            return None
+        finally:
+            self.sampler.unwatch(pin)
+    def cleanup(self):
+        for pin in list(self.sampler.watches):
+            self.sampler.unwatch(pin)
+
 
 if __name__ == '__main__':
 
@@ -206,11 +443,9 @@ if __name__ == '__main__':
     # ****************************************************
     mcp = Adafruit_MCP230XX(address=0x20, num_gpios=16)
     
-    # Set pins 0, 1, 2 as outputs
-    mcp.config(0, mcp.OUTPUT)
-    mcp.config(1, mcp.OUTPUT)
-    mcp.config(2, mcp.OUTPUT)
-    
+    # Set pins 0, 1, 2 as outputs (one write)
+    mcp.configMask(0b0111, mcp.OUTPUT)
+
     # Set pin 3 to input with the pullup resistor enabled
     mcp.pullup(3, True)
 
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+# Display / input backends for the radio.  Each is registered by name and
+# only imports what it drives (smbus for the plate, pygame for the debug
+# window) when it is opened, so a configuration that doesn't use one
+# never pays for loading it.  Backends take full rows of text and return
+# button state as FLAG_* bits.
+#
+# Others can be plugged in with register(name, 'module.Class').
+
+#----------------------------------------------------------------------
+
+import os, select, sys
+from time import time
+
+#----------------------------------------------------------------------
+
+BACKEND_PLATE = 'plate'
+BACKEND_PYGAME = 'pygame'
+BACKEND_TERMINAL = 'terminal'
+BACKEND_NULL = 'null'
+
+FLAG_SELECT = 1
+FLAG_LEFT = 2
+FLAG_RIGHT = 4
+FLAG_UP = 8
+FLAG_DOWN = 16
+
+# Backlight colours, same bits as Adafruit_CharLCDPlate's
+COLOR_OFF = 0x00
+COLOR_RED = 0x01
+COLOR_ON = 0x07
+
+PYGAME_COLORS = {
+  COLOR_ON: (64, 64, 64),
+  COLOR_RED: (64, 0, 0)
+}
+PYGAME_COLOR_OFF = (0, 0, 0)
+PYGAME_OPTIONS = ('size', 'caption', 'font_name', 'font_size', 'headless',
+                  'dump_dir')
+
+TERMINAL_HOLD = 0.6 # Key counts as held this long, bridging auto-repeat
+TERMINAL_KEYS = {
+  '\x1b[A': FLAG_UP,
+  '\x1b[B': FLAG_DOWN,
+  '\x1b[C': FLAG_RIGHT,
+  '\x1b[D': FLAG_LEFT,
+  ' ': FLAG_SELECT,
+  '\n': FLAG_SELECT
+}
+TERMINAL_QUIT = 'q'
+TERM_CLEAR_LINE = '\r\x1b[K'
+TERM_UP = '\x1b[%dA'
+TERM_DIM = '\x1b[2m'
+TERM_RESET = '\x1b[0m'
+
+#----------------------------------------------------------------------
+
+class Backend(object):
+  """ Does nothing; also the interface.  hardware_scroll backends take
+  MARQUEE_WIDTH rows plus the column to show leftmost. """
+
+  hardware_scroll = False
+  has_input = False
+  intsource = None # Edge source for interrupt-driven input, if any
+
+  def __init__(self, options):
+    self.options = options
+
+  def open(self):
+    pass
+
+  def close(self):
+    pass
+
+  def write(self, rows, shift=0):
+    pass
+
+  def set_backlight(self, color):
+    pass
+
+  def get_input(self):
+    return 0
+
+  def interrupt_input(self):
+    return 0
+
+#----------------------------------------------------------------------
+
+class PlateBackend(Backend):
+  "Adafruit RGB LCD plate"
+
+  hardware_scroll = True
+  has_input = True
+
+  def open(self):
+    from Adafruit_CharLCDPlate import Adafruit_CharLCDPlate
+    options = self.options
+    lcd = Adafruit_CharLCDPlate(timing=Adafruit_CharLCDPlate.TIMING_DEADLINE)
+    lcd.begin(options.get('cols', 16), options.get('rows', 2))
+    self.lcd = lcd
+    self.bits = ((1 << lcd.SELECT, FLAG_SELECT), (1 << lcd.LEFT, FLAG_LEFT),
+                 (1 << lcd.RIGHT, FLAG_RIGHT), (1 << lcd.UP, FLAG_UP),
+                 (1 << lcd.DOWN, FLAG_DOWN))
+    pin = options.get('int_gpio')
+    if pin is not None:
+      from gpio_edge import GPIOEdgeSource
+      try:
+        lcd.enableInterrupts(GPIOEdgeSource(pin))
+        self.intsource = lcd.intsource
+      except (IOError, OSError):
+        pass
+
+  # Puts the plate back to its reset state (LEDs off, interrupts off)
+  # before the edge source goes; a bus that is gone by now is no reason
+  # to skip the other displays
+  def close(self):
+    try:
+      self.lcd.stop()
+    except IOError:
+      pass
+    source = self.intsource
+    if source is not None:
+      self.lcd.intsource = self.intsource = None
+      source.close()
+
+  def to_flags(self, buttons):
+    res = 0
+    for bit, flag in self.bits:
+      if buttons & bit:
+        res |= flag
+    return res
+
+  def write(self, rows, shift=0):
+    self.lcd.render(rows, shift)
+
+  def set_backlight(self, color):
+    self.lcd.backlight(color)
+
+  def get_input(self):
+    return self.to_flags(self.lcd.buttons())
+
+  def interrupt_input(self):
+    return self.to_flags(self.lcd.interruptButtons())
+
+#----------------------------------------------------------------------
+
+class PygameBackend(Backend):
+  "Debug window, see debug_display"
+
+  has_input = True
+
+  def open(self):
+    import pygame
+    from debug_display import DebugDisplay
+    options = self.options
+    self.pygame = pygame
+    self.color = PYGAME_COLORS[COLOR_ON]
+    self.display = DebugDisplay(**dict(
+      (key, options[key]) for key in PYGAME_OPTIONS if key in options))
+    self.keys = ((pygame.K_SPACE, FLAG_SELECT), (pygame.K_RETURN, FLAG_SELECT),
+                 (pygame.K_LEFT, FLAG_LEFT), (pygame.K_RIGHT, FLAG_RIGHT),
+                 (pygame.K_UP, FLAG_UP), (pygame.K_DOWN, FLAG_DOWN))
+
+  def close(self):
+    self.display.close()
+
+  def write(self, rows, shift=0):
+    self.display.draw(rows, self.color)
+
+  def set_backlight(self, color):
+    self.color = PYGAME_COLORS.get(color, PYGAME_COLOR_OFF)
+
+  def get_input(self):
+    pygame = self.pygame
+    for event in pygame.event.get():
+      if event.type == pygame.QUIT:
+        pygame.quit()
+        sys.exit()
+    pressed = pygame.key.get_pressed()
+    if pressed[pygame.K_q] == 1:
+      sys.exit()
+    res = 0
+    for key, flag in self.keys:
+      if pressed[key] == 1:
+        res |= flag
+    return res
+
+#----------------------------------------------------------------------
+
+class TerminalBackend(Backend):
+  """ Draws the rows in place on a terminal; arrow keys, space / enter
+  and q for input when stdin is a tty """
+
+  has_input = True
+
+  def __init__(self, options):
+    Backend.__init__(self, options)
+    self.output = options.get('output', sys.stdout)
+    self.input = options.get('input', sys.stdin)
+    self.drawn = None
+    self.dim = False
+    self.saved = None
+    self.seen = { } # Flag -> time its key was last read
+
+  def open(self):
+    if self.input.isatty():
+      import termios, tty
+      fd = self.input.fileno()
+      self.saved = termios.tcgetattr(fd)
+      tty.setcbreak(fd)
+
+  def close(self):
+    if self.saved is not None:
+      import termios
+      termios.tcsetattr(self.input.fileno(), termios.TCSADRAIN, self.saved)
+      self.saved = None
+    if self.drawn:
+      self.output.write('\n' * len(self.drawn))
+      self.output.flush()
+
+  def write(self, rows, shift=0):
+    rows = list(rows)
+    if rows == self.drawn:
+      return
+    style = TERM_DIM if self.dim else ''
+    text = '\n'.join(TERM_CLEAR_LINE + style + '|' + row + '|' + TERM_RESET
+                     for row in rows)
+    if len(rows) > 1:
+      text += TERM_UP % (len(rows) - 1)
+    self.output.write(text + '\r')
+    self.output.flush()
+    self.drawn = rows
+
+  def set_backlight(self, color):
+    self.dim = color == COLOR_OFF
+    self.drawn = None # Redraw in the new style
+
+  def get_input(self):
+    if self.saved is None:
+      return 0
+    fd = self.input.fileno()
+    now = time()
+    while select.select([fd], [ ], [ ], 0)[0]:
+      keys = os.read(fd, 64)
+      if not keys:
+        break
+      if TERMINAL_QUIT in keys:
+        sys.exit()
+      for key, flag in TERMINAL_KEYS.items():
+        if key in keys:
+          self.seen[flag] = now
+    res = 0
+    for flag, when in self.seen.items():
+      if now - when < TERMINAL_HOLD:
+        res |= flag
+    return res
+
+#----------------------------------------------------------------------
+
+REGISTRY = { }
+
+def register(name, factory):
+  "factory: a Backend class, or 'module.Class' to import on first use"
+  REGISTRY[name] = factory
+
+def create(name, options):
+  factory = REGISTRY.get(name)
+  if factory is None:
+    raise ValueError('Unknown backend: %s' % name)
+  if isinstance(factory, basestring):
+    module, attr = factory.rsplit('.', 1)
+    factory = getattr(__import__(module, fromlist=[attr]), attr)
+  return factory(options)
+
+register(BACKEND_PLATE, PlateBackend)
+register(BACKEND_PYGAME, PygameBackend)
+register(BACKEND_TERMINAL, TerminalBackend)
+register(BACKEND_NULL, Backend)
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+# Startup timing.  Phases and marks are stamped in seconds since the
+# process started (taken from /proc, so interpreter start-up and module
+# imports are included) and printed as a report once the radio is up,
+# together with peak RSS and which optional heavy modules got loaded.
+# Phases may run on several threads at once.  Milestones are marks that
+# are also reported as time since power-on (kernel boot), which is what
+# a user waiting for the radio to play actually sees.
+
+#----------------------------------------------------------------------
+
+import os, resource, sys, threading
+from time import time
+
+#----------------------------------------------------------------------
+
+PROC_SELF_STAT = '/proc/self/stat'
+PROC_UPTIME = '/proc/uptime'
+STAT_STARTTIME = 19 # Field 22, counted from the state field after comm
+HEAVY_MODULES = ('pygame', 'smbus')
+
+#----------------------------------------------------------------------
+
+def process_start():
+  """ (wall clock time the process started, seconds from kernel boot to
+  then), or None where /proc can't tell """
+  try:
+    with open(PROC_SELF_STAT) as infile:
+      stat = infile.read()
+    with open(PROC_UPTIME) as infile:
+      uptime = float(infile.read().split()[0])
+    # comm may contain spaces, so split after its closing paren
+    fields = stat[stat.rindex(')') + 2:].split()
+    started = int(fields[STAT_STARTTIME]) / float(os.sysconf('SC_CLK_TCK'))
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+  return time() - (uptime - started), started
+
+#----------------------------------------------------------------------
+
+class Phase(object):
+  "Context manager recording one phase"
+
+  def __init__(self, report, name):
+    self.report = report
+    self.name = name
+
+  def __enter__(self):
+    self.begin = self.report.now()
+    return self
+
+  def __exit__(self, *exc):
+    self.report.add(self.name, self.begin, self.report.now())
+    return False
+
+#----------------------------------------------------------------------
+
+class BootReport(object):
+
+  def __init__(self, start=None, clock=time, booted=None):
+    self.clock = clock
+    if start is None:
+      start, booted = process_start() or (clock(), None)
+    self.start = start
+    self.booted = booted # Process start in seconds since kernel boot
+    self.lock = threading.Lock()
+    self.events = [ ] # (name, begin, end); marks have begin == end
+    self.milestones = [ ]
+
+  def now(self):
+    return self.clock() - self.start
+
+  def add(self, name, begin, end):
+    with self.lock:
+      self.events.append((name, begin, end))
+
+  def mark(self, name):
+    when = self.now()
+    self.add(name, when, when)
+    return when
+
+  def milestone(self, name):
+    when = self.mark(name)
+    with self.lock:
+      self.milestones.append((name, when))
+    return when
+
+  def phase(self, name):
+    return Phase(self, name)
+
+  def lines(self):
+    with self.lock:
+      events = sorted(self.events, key=lambda event: event[1])
+      milestones = list(self.milestones)
+    res = [ ]
+    for name, begin, end in events:
+      if end == begin:
+        res.append('%8.3f           %s' % (begin, name))
+      else:
+        res.append('%8.3f %8.3f  %s (%.0f ms)' % (begin, end, name,
+                                                   (end - begin) * 1e3))
+    for name, when in milestones:
+      if self.booted is None:
+        res.append('time to %s: %.3f s' % (name, when))
+      else:
+        res.append('time to %s: %.3f s, %.1f s since power-on' % (
+          name, when, self.booted + when))
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    res.append('max RSS %d kB, loaded: %s' % (
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      ' '.join(loaded) or '-'))
+    return res
+
+  def report(self):
+    print 'Startup (s since process start):'
+    for line in self.lines():
+      print line
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+# Debounced button events from raw button bitmask samples.  Kept apart
+# from the plate driver so any input backend can use it without pulling
+# in smbus.
+
+from collections import deque
+from time import time
+
+# ==========================================================================
+# Button input engine
+# ==========================================================================
+
+# Turns raw button bitmask samples (one bus read each, e.g. from
+# buttons()) into debounced press / release / repeat / long-press events.
+# The engine knows nothing about the bus; feed it samples with update(),
+# or call poll() to take one through the sample function.
+
+class ButtonInput(object):
+
+    # Event kinds.  Events are (kind, button bitmask, timestamp) tuples.
+    PRESS     = 0
+    RELEASE   = 1
+    REPEAT    = 2
+    LONGPRESS = 3
+
+    def __init__(self, sample=None, clock=time, debounce=0.02,
+                 repeatMask=0, repeatDelay=0.5, repeatRate=0.2,
+                 repeatMin=0.05, repeatAccel=0.8,
+                 longMask=0, longPress=1.0):
+        self.sample      = sample
+        self.clock       = clock
+        self.debounce    = debounce
+        self.repeatMask  = repeatMask   # Buttons that auto-repeat
+        self.repeatDelay = repeatDelay  # Hold time before first repeat
+        self.repeatRate  = repeatRate   # First repeat interval
+        self.repeatMin   = repeatMin    # Fastest repeat interval
+        self.repeatAccel = repeatAccel  # Interval multiplier per repeat
+        self.longMask    = longMask     # Buttons reporting long presses
+        self.longPress   = longPress    # Hold time for a long press
+        self.queue       = deque()
+        self.raw         = 0   # Last sample
+        self.rawTime     = 0   # When the last sample changed
+        self.state       = 0   # Debounced state
+        self.pressTime   = {}  # Button bit -> debounced press time
+        self.nextRepeat  = {}  # Button bit -> next repeat deadline
+        self.interval    = {}  # Button bit -> current repeat interval
+        self.longDone    = 0   # Buttons that already reported LONGPRESS
+
+
+    def poll(self):
+        """ Take one sample and update state """
+        return self.update(self.sample())
+
+
+    def update(self, mask=None, now=None):
+        """ Feed one raw bitmask sample.  None just advances the timers
+        (e.g. after an interrupt wait timed out with nothing changed).
+        Returns the debounced state. """
+        if now is None: now = self.clock()
+        if mask is not None and mask != self.raw:
+            self.raw, self.rawTime = mask, now
+
+        # Debounce: accept a new state once it has been stable long enough
+        if self.raw != self.state and now - self.rawTime >= self.debounce:
+            changed    = self.raw ^ self.state
+            self.state = self.raw
+            bit = 1
+            while changed >= bit:
+                if changed & bit:
+                    if self.state & bit: self.pressed(bit, now)
+                    else:                self.released(bit, now)
+                bit <<= 1
+
+        # Timers for held buttons
+        for bit, t in self.nextRepeat.items():
+            if now >= t:
+                self.queue.append((self.REPEAT, bit, now))
+                iv = max(self.repeatMin, self.interval[bit] * self.repeatAccel)
+                self.interval[bit]   = iv
+                self.nextRepeat[bit] = t + iv if t + iv > now else now + iv
+        for bit, t in self.pressTime.items():
+            if ((self.longMask & bit) and not (self.longDone & bit) and
+                now - t >= self.longPress):
+                self.longDone |= bit
+                self.queue.append((self.LONGPRESS, bit, now))
+        return self.state
+
+
+    def pressed(self, bit, now):
+        self.pressTime[bit] = now
+        self.longDone      &= ~bit
+        if self.repeatMask & bit:
+            self.interval[bit]   = self.repeatRate
+            self.nextRepeat[bit] = now + self.repeatDelay
+        self.queue.append((self.PRESS, bit, now))
+
+
+    def released(self, bit, now):
+        self.pressTime.pop(bit, None)
+        self.nextRepeat.pop(bit, None)
+        self.interval.pop(bit, None)
+        self.queue.append((self.RELEASE, bit, now))
+
+
+    def events(self):
+        """ Drain and return queued events, oldest first """
+        res = list(self.queue)
+        self.queue.clear()
+        return res
+
+
+    def held(self):
+        """ Debounced bitmask of buttons currently held """
+        return self.state
+
+
+    def heldTime(self, bit, now=None):
+        """ Seconds the button has been held, 0 if not held """
+        if bit not in self.pressTime: return 0
+        if now is None: now = self.clock()
+        return now - self.pressTime[bit]
+
+
+    def settled(self):
+        """ True when nothing is held or waiting to be debounced """
+        return self.state == 0 and self.raw == 0
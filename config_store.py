@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+# Write-behind store for radio.conf.  Changes are applied to memory at
+# once and written to the SD card after a short delay, so a run of
+# volume steps costs one write instead of one per step.  Writes go to a
+# temporary file which is fsynced and renamed over the config, so a
+# power cut leaves either the old or the new file, never a torn one.
+
+#----------------------------------------------------------------------
+
+import json, os, threading
+
+#----------------------------------------------------------------------
+
+KEY_STATION = 'station'
+KEY_VOLUME = 'volume'
+KEY_DEBUG = 'debug'
+KEY_USE_LCD = 'use_lcd'
+CONFIG_FLUSH_DELAY = 5.0
+CONFIG_TMP_SUFFIX = '.tmp'
+DEFAULT_VOLUME = 100
+STR_NEWLINE = '\n'
+STR_NO_STATION = ''
+
+#----------------------------------------------------------------------
+
+class ConfigStore(object):
+  """ In-memory config with delayed, atomic flushes.  The values read on
+  every frame (station, its volume, debug, use_lcd) are kept as plain
+  attributes so reading them costs no dict walks. """
+
+  def __init__(self, path, defaults=None, delay=CONFIG_FLUSH_DELAY,
+               timer=threading.Timer):
+    self.path = path
+    self.data = dict(defaults or { })
+    self.delay = delay
+    self.timer_factory = timer
+    self.timer = None
+    self.lock = threading.RLock()
+    self.write_lock = threading.Lock() # Keeps flushes in order
+    self.dirty = False
+    self.writes = 0
+    self.update_snapshot()
+
+  # --------------------------------------------------------------------
+  # Snapshot
+
+  def update_snapshot(self):
+    data = self.data
+    self.station = data.get(KEY_STATION, STR_NO_STATION)
+    self.debug = data.get(KEY_DEBUG, False)
+    self.use_lcd = data.get(KEY_USE_LCD, False)
+    volumes = data.get(KEY_VOLUME)
+    if self.station != STR_NO_STATION and volumes and self.station in volumes:
+      self.volume = volumes[self.station]
+    else:
+      self.volume = None
+
+  # --------------------------------------------------------------------
+  # Access
+
+  def get(self, prop, defval=False):
+    return self.data[prop] if prop in self.data else defval
+
+  def set(self, prop, val):
+    with self.lock:
+      if prop in self.data and self.data[prop] == val:
+        return
+      self.data[prop] = val
+      self.update_snapshot()
+      self.changed()
+
+  def get_volume(self, defval=DEFAULT_VOLUME):
+    return defval if self.volume is None else self.volume
+
+  def set_volume(self, val):
+    "Stores the volume of the current station"
+    with self.lock:
+      if self.station == STR_NO_STATION or self.volume == val:
+        return
+      volumes = self.data.setdefault(KEY_VOLUME, { })
+      volumes[self.station] = val
+      self.volume = val
+      self.changed()
+
+  # --------------------------------------------------------------------
+  # Persistence
+
+  def load(self):
+    "Reads the file; a missing or unreadable file is rewritten on flush"
+    try:
+      with open(self.path) as infile:
+        data = json.load(infile)
+    except (IOError, OSError, ValueError):
+      with self.lock:
+        self.dirty = True
+      return False
+    with self.lock:
+      self.data = data
+      self.update_snapshot()
+    return True
+
+  # Flushes within delay seconds of the first unsaved change; later
+  # changes ride along instead of pushing the write further out.
+  def changed(self):
+    self.dirty = True
+    if self.timer is None and self.delay is not None:
+      self.timer = self.timer_factory(self.delay, self.flush)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def flush(self):
+    "Writes the config if it changed; safe to call from any thread"
+    with self.write_lock:
+      return self.write()
+
+  def write(self):
+    with self.lock:
+      if self.timer is not None:
+        self.timer.cancel()
+        self.timer = None
+      if not self.dirty:
+        return False
+      text = json.dumps(self.data, indent=4) + STR_NEWLINE
+      self.dirty = False
+    tmp = self.path + CONFIG_TMP_SUFFIX
+    try:
+      with open(tmp, 'w') as outfile:
+        outfile.write(text)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+      os.rename(tmp, self.path)
+      self.sync_dir()
+    except (IOError, OSError):
+      with self.lock:
+        self.dirty = True
+      return False
+    self.writes += 1
+    return True
+
+  # The rename itself only survives a power cut once the directory
+  # entry is on disk.
+  def sync_dir(self):
+    try:
+      fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+    except OSError:
+      return
+    try:
+      os.fsync(fd)
+    except OSError:
+      pass
+    finally:
+      os.close(fd)
+
+  def close(self):
+    self.flush()
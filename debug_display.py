@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+# pygame window that mirrors the LCD when debugging.  Each character is
+# rendered once per background colour and kept as a cell-sized surface;
+# a frame only blits the cells that changed and hands just those rows to
+# display.update().  With SDL's dummy video driver it runs without a
+# screen (CI, ssh) and can dump every frame to PNG.
+#
+#   ./debug_display.py [frames] [dump_dir]   headless benchmark
+
+#----------------------------------------------------------------------
+
+import os, sys, pygame
+from time import time
+
+#----------------------------------------------------------------------
+
+DISPLAY_CAPTION = 'Internet Radio'
+DISPLAY_WIDTH = 500
+DISPLAY_HEIGHT = 100
+FONT_NAME = 'monospace'
+FONT_SIZE = 16
+FOREGROUND = (255, 255, 0)
+BACKGROUND = (0, 0, 0)
+SDL_DUMMY = 'dummy'
+DUMP_FORMAT = 'frame%05d.png'
+STR_SPACE = ' '
+
+#----------------------------------------------------------------------
+
+class DebugDisplay(object):
+
+  def __init__(self, size=(DISPLAY_WIDTH, DISPLAY_HEIGHT),
+               caption=DISPLAY_CAPTION, font_name=FONT_NAME,
+               font_size=FONT_SIZE, headless=None, dump_dir=None):
+    if headless is None:
+      headless = not os.environ.get('DISPLAY')
+    if headless:
+      # Has to be set before the display is initialised
+      os.environ['SDL_VIDEODRIVER'] = SDL_DUMMY
+    # Only what is used: pygame.init() would also open the mixer
+    pygame.display.init()
+    pygame.font.init()
+    self.headless = headless
+    self.screen = pygame.display.set_mode(size)
+    pygame.display.set_caption(caption)
+    self.font = pygame.font.SysFont(font_name, font_size)
+    self.cell_width = self.font.size('M')[0]
+    self.row_height = font_size
+    self.dump_dir = dump_dir
+    self.glyphs = { }     # (char, background) -> cell surface
+    self.cells = [ ]      # Characters on screen, per row
+    self.background = None
+    # Counters
+    self.frames = 0
+    self.glyph_renders = 0
+    self.cells_drawn = 0
+
+  def glyph(self, char, background):
+    key = (char, background)
+    res = self.glyphs.get(key)
+    if res is None:
+      res = pygame.Surface((self.cell_width, self.row_height))
+      res.fill(background)
+      res.blit(self.font.render(char, True, FOREGROUND), (0, 0))
+      res = res.convert()
+      self.glyphs[key] = res
+      self.glyph_renders += 1
+    return res
+
+  def draw(self, lines, background=BACKGROUND):
+    "Shows the lines; returns the rectangles that were updated"
+    screen = self.screen
+    rects = [ ]
+    if background != self.background:
+      screen.fill(background)
+      self.background = background
+      self.cells = [ ]
+      rects.append(screen.get_rect())
+    width, height = self.cell_width, self.row_height
+    for r, text in enumerate(lines):
+      if r >= len(self.cells):
+        self.cells.append([ ])
+      row = self.cells[r]
+      text = list(text)
+      if len(row) > len(text):
+        text += [STR_SPACE] * (len(row) - len(text))
+      first = last = None
+      for c, char in enumerate(text):
+        if c < len(row):
+          if row[c] == char:
+            continue
+          row[c] = char
+        else:
+          row.append(char)
+        screen.blit(self.glyph(char, background), (c * width, r * height))
+        self.cells_drawn += 1
+        if first is None:
+          first = c
+        last = c
+      if first is not None:
+        rects.append(pygame.Rect(first * width, r * height,
+                                 (last + 1 - first) * width, height))
+    if rects:
+      pygame.display.update(rects)
+    self.frames += 1
+    if self.dump_dir:
+      self.dump()
+    return rects
+
+  def dump(self, path=None):
+    "Saves the screen as PNG (by default the next frame file in dump_dir)"
+    if path is None:
+      path = os.path.join(self.dump_dir, DUMP_FORMAT % self.frames)
+    pygame.image.save(self.screen, path)
+    return path
+
+  def close(self):
+    pygame.display.quit()
+
+#----------------------------------------------------------------------
+
+def main(argv):
+  "Headless benchmark: a clock ticking under a fixed station line"
+  frames = int(argv[0]) if argv else 1000
+  dump_dir = argv[1] if len(argv) > 1 else None
+  display = DebugDisplay(headless=True, dump_dir=dump_dir)
+  start = time()
+  for i in range(frames):
+    display.draw(['JoyFM 40        ',
+                  '12:%02d:%02d Jazz   ' % (i // 60 % 60, i % 60)],
+                 (64, 64, 64))
+  elapsed = time() - start
+  print '%d frames, %.3f ms/frame, %d glyph renders, %d cells drawn' % (
+    frames, elapsed * 1e3 / frames, display.glyph_renders,
+    display.cells_drawn)
+  display.close()
+  return 0
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,26 @@
+# Headless emulation of the Adafruit LCD plate (MCP23017 + HD44780) on a
+# modeled I2C bus clock.  The unmodified drivers run against it through
+# fake_smbus, so their output can be checked and their latency measured
+# off a Pi:
+#
+#   import emulator
+#   plate = emulator.install()
+#   from Adafruit_CharLCDPlate import Adafruit_CharLCDPlate
+#   lcd = Adafruit_CharLCDPlate()
+#   t = plate.clock.now; lcd.message('Hello'); print plate.clock.now - t
+#   print plate.text()
+
+from clock import BusClock
+from mcp23017 import MCP23017
+from hd44780 import HD44780
+from plate import LCDPlate, PLATE_ADDRESS
+
+import fake_smbus
+
+def install(address=PLATE_ADDRESS, hz=None, overhead=0.0, strict=True,
+            rdwr=False):
+  """ Replaces smbus with fake_smbus and attaches a fresh plate to it;
+  rdwr lets the drivers use (fake) I2C_RDWR transfers as well """
+  fake_smbus.install(rdwr)
+  clock = BusClock(hz, overhead) if hz else BusClock(overhead=overhead)
+  return LCDPlate(address, clock, strict).attach()
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+# python -m emulator [hz] [polled|deadline] [rdwr]: boot the plate driver
+# on the emulator, draw a frame and step a few updates, printing the
+# screen and the modeled bus time each step took.  rdwr sends combined
+# I2C_RDWR transfers instead of smbus calls.
+
+#----------------------------------------------------------------------
+
+import sys
+import emulator
+
+#----------------------------------------------------------------------
+
+def step(plate, name, func):
+  clock = plate.clock
+  t, tx = clock.now, clock.transactions
+  func()
+  print '%-12s %4d tx %9.0f us' % (name, clock.transactions - tx,
+                                    (clock.now - t) * 1e6)
+  for line in plate.lines():
+    print '  |%s|' % line
+
+#----------------------------------------------------------------------
+
+def main(argv):
+  hz = int(argv[0]) if argv else None
+  deadline = 'deadline' in argv[1:]
+  plate = emulator.install(hz=hz, rdwr='rdwr' in argv[1:])
+  from Adafruit_CharLCDPlate import Adafruit_CharLCDPlate
+  timing = (Adafruit_CharLCDPlate.TIMING_DEADLINE if deadline else
+            Adafruit_CharLCDPlate.TIMING_POLLED)
+
+  lcd = [None]
+  def boot():
+    # Driver waits happen in bus time too
+    lcd[0] = Adafruit_CharLCDPlate(timing=timing, clock=plate.clock,
+                                   sleep=plate.clock.sleep)
+    lcd[0].begin(16, 2)
+  step(plate, 'boot', boot)
+  lcd = lcd[0]
+  step(plate, 'frame', lambda: lcd.render(['JoyFM 40', '12:00:00 Jazz']))
+  step(plate, 'tick', lambda: lcd.render(['JoyFM 40', '12:00:01 Jazz']))
+  step(plate, 'message', lambda: (lcd.clear(), lcd.message('Hello\nworld')))
+  plate.press(1 << lcd.UP)
+  step(plate, 'buttons', lambda: sys.stdout.write(
+    '  buttons 0x%02X\n' % lcd.buttons()))
+  step(plate, 'backlight', lambda: lcd.backlight(lcd.TEAL))
+  print 'backlight 0x%X, ignored writes %d, busy flag reads %d' % (
+    plate.backlight(), plate.lcd.ignored, plate.lcd.busy_reads)
+  print 'polls %d (%d reads), deadline waits %d (%.0f us), passed %d' % (
+    lcd.polls, lcd.pollLoops, lcd.deadlineWaits, lcd.waitTime * 1e6,
+    lcd.deadlinePassed)
+  return 0
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+
+# Modeled I2C bus clock.  Devices advance it bit by bit as a transaction
+# goes over the wire, so everything they see (strobe edges, busy flag
+# deadlines) is stamped with the time it would happen on a real bus.
+
+#----------------------------------------------------------------------
+
+BUS_HZ = 100000
+BITS_PER_BYTE = 9 # 8 data bits + ACK
+
+#----------------------------------------------------------------------
+
+class BusClock(object):
+  """ Virtual time in seconds.  overhead is added per transaction for
+  the driver / ioctl cost between transfers (0 models a perfect host). """
+
+  def __init__(self, hz=BUS_HZ, overhead=0.0):
+    self.hz = hz
+    self.overhead = overhead
+    self.now = 0.0
+    self.transactions = 0
+    self.bits = 0
+
+  def advance(self, bits):
+    self.bits += bits
+    self.now += bits / float(self.hz)
+
+  def start(self):
+    self.transactions += 1
+    self.now += self.overhead
+    self.advance(1)
+
+  def restart(self):
+    self.advance(1)
+
+  def byte(self):
+    self.advance(BITS_PER_BYTE)
+
+  def stop(self):
+    self.advance(1)
+
+  def sleep(self, seconds):
+    if seconds > 0:
+      self.now += seconds
+
+  def time(self):
+    return self.now
+
+  def __call__(self):
+    return self.now
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# python -m emulator.edges: edge detection check for MCP230XX_GPIO on
+# the emulated plate.  Watches a button pin, presses it once and expects
+# exactly one callback, both sampling on an interval and on the INT line
+# (through a fake edge source).  Exits 1 on a miss or a duplicate.
+
+#----------------------------------------------------------------------
+
+import sys, time, threading
+import emulator
+from gpio_edge import FakeEdgeSource
+
+#----------------------------------------------------------------------
+
+PIN = 0        # SELECT button, pulled up, pressing pulls it low
+SETTLE = 0.05  # Seconds for the sampler to catch up
+
+#----------------------------------------------------------------------
+
+def press(plate, delay=0.0):
+  if delay:
+    threading.Timer(delay, press, (plate,)).start()
+  else:
+    plate.press(1 << PIN)
+
+def new_gpio(plate, interval, intsource=None):
+  from Adafruit_MCP230xx import MCP230XX_GPIO
+  gpio = MCP230XX_GPIO(1, plate.address, 16, interval, intsource)
+  gpio.setup(PIN, gpio.IN)
+  gpio.pullup(PIN, True)
+  return gpio
+
+def done(gpio, intsource):
+  "Stops the sampler thread, so none is left at exit"
+  thread = gpio.sampler.thread
+  gpio.cleanup()
+  if intsource is not None:
+    intsource.trigger()
+  if thread is not None:
+    thread.join()
+
+def callbacks(name, interval, intsource=None):
+  "One press, one callback"
+  plate = emulator.install()
+  if intsource is not None:
+    plate.on_interrupt(intsource.trigger)
+  gpio = new_gpio(plate, interval, intsource)
+  got = [ ]
+  gpio.add_event_detect(PIN, gpio.FALLING, got.append)
+  press(plate)
+  time.sleep(SETTLE)
+  done(gpio, intsource)
+  print '%-20s %d callback(s)' % (name, len(got))
+  return got == [PIN]
+
+def waited(name, interval, intsource=None):
+  "An edge soon after wait_for_edge() starts watching is not missed"
+  plate = emulator.install()
+  if intsource is not None:
+    plate.on_interrupt(intsource.trigger)
+  gpio = new_gpio(plate, interval, intsource)
+  press(plate, 0.001)
+  res = gpio.wait_for_edge(PIN, gpio.FALLING, timeout=interval * 2000)
+  done(gpio, intsource)
+  print '%-20s %s' % (name, res)
+  return res == PIN
+
+#----------------------------------------------------------------------
+
+def main(argv):
+  # Long intervals: an edge caught only by a later sample shows up late
+  ok = all([callbacks('polled callback', 0.01),
+            callbacks('int callback', 1.0, FakeEdgeSource()),
+            waited('polled wait', 0.2),
+            waited('int wait', 1.0, FakeEdgeSource())])
+  print 'ok' if ok else 'FAILED'
+  return 0 if ok else 1
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,252 @@
+#!/usr/bin/python
+
+# HD44780 character LCD controller model, wired as on the Adafruit plate:
+# the 4-bit data bus and RS / RW / E hang off MCP23017 PORTB.  Commands
+# and data are latched on the falling edge of E, one nibble at a time
+# once the controller is in 4-bit mode.  Instructions take their
+# datasheet execution time on the bus clock; anything that arrives
+# while the controller is still busy is counted in `ignored` (and
+# dropped, as the real part does, when strict).
+
+#----------------------------------------------------------------------
+
+from clock import BusClock
+
+#----------------------------------------------------------------------
+
+# PORTB pins as wired on the plate.  Data bits D4-D7 are reversed onto
+# PB4-PB1, which is what the driver's flip table undoes.
+PIN_RS = 0x80
+PIN_RW = 0x40
+PIN_E = 0x20
+DATA_PINS = (0x10, 0x08, 0x04, 0x02) # D4, D5, D6, D7
+DATA_MASK = 0x1E
+
+# Execution times at the nominal 270 kHz oscillator
+CLEAR_TIME = 1.52e-3
+HOME_TIME = 1.52e-3
+EXEC_TIME = 37e-6
+WRITE_TIME = 41e-6 # 37 us + t_ADD
+
+DDRAM_SIZE = 0x80
+CGRAM_SIZE = 0x40
+LINE_WIDTH = 40 # DDRAM columns per line in 2-line mode
+LINE2 = 0x40
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+#----------------------------------------------------------------------
+
+def nibble(levels):
+  "4-bit data value on the data pins"
+  res = 0
+  for i, pin in enumerate(DATA_PINS):
+    if levels & pin:
+      res |= 1 << i
+  return res
+
+def levels(value):
+  "Data pin levels for a 4-bit value"
+  res = 0
+  for i, pin in enumerate(DATA_PINS):
+    if value & (1 << i):
+      res |= pin
+  return res
+
+#----------------------------------------------------------------------
+
+class HD44780(object):
+
+  def __init__(self, clock=None, strict=True):
+    self.clock = clock or BusClock()
+    self.strict = strict
+    self.reset()
+
+  def reset(self):
+    "Power-on state: 8-bit interface, 1 line, display off"
+    self.ddram = bytearray(' ' * DDRAM_SIZE)
+    self.cgram = bytearray(CGRAM_SIZE)
+    self.ac = 0
+    self.cgram_mode = False   # Address counter points into CGRAM
+    self.eight_bit = True
+    self.two_lines = False
+    self.increment = True
+    self.entry_shift = False
+    self.display_on = False
+    self.cursor_on = False
+    self.blink_on = False
+    self.shift = 0            # DDRAM column shown leftmost
+    self.pins = 0
+    self.half = None          # First nibble of a 4-bit write
+    self.read_phase = 0       # Nibble being read in a 4-bit read
+    self.read_value = None
+    self.busy_until = 0.0
+    # Counters
+    self.instructions = 0
+    self.writes = 0
+    self.ignored = 0
+    self.busy_reads = 0
+    self.busy_seen = 0
+
+  # --------------------------------------------------------------------
+  # Pin interface (MCP23017 port device)
+
+  def output(self, olat, iodir):
+    "Driven PORTB levels changed; acts on E edges"
+    pins = olat & ~iodir & 0xFF
+    rising = pins & PIN_E and not self.pins & PIN_E
+    falling = self.pins & PIN_E and not pins & PIN_E
+    self.pins = pins
+    if pins & PIN_RW:
+      if rising:
+        self.begin_read()
+      elif falling:
+        self.end_read()
+    elif falling:
+      self.latch(nibble(pins))
+
+  def input(self):
+    "(levels, driven pins): the data bus is driven while reading"
+    if self.pins & PIN_RW and self.pins & PIN_E and self.read_value is not None:
+      if self.eight_bit or self.read_phase == 0:
+        value = self.read_value >> 4
+      else:
+        value = self.read_value & 0x0F
+      return levels(value), DATA_MASK
+    return 0, 0
+
+  def busy(self):
+    return self.clock.now < self.busy_until
+
+  # --------------------------------------------------------------------
+  # Bus cycles
+
+  def latch(self, value):
+    rs = self.pins & PIN_RS
+    if self.eight_bit:
+      # D0-D3 are not connected, they read as 0
+      self.half = None
+      self.execute(value << 4, rs)
+    elif self.half is None:
+      self.half = value
+    else:
+      byte, self.half = (self.half << 4) | value, None
+      self.execute(byte, rs)
+
+  def begin_read(self):
+    if self.read_phase == 0 or self.eight_bit:
+      if self.pins & PIN_RS:
+        self.read_value = self.ram()[self.ac]
+      else:
+        self.busy_reads += 1
+        busy = self.busy()
+        if busy:
+          self.busy_seen += 1
+        self.read_value = (0x80 if busy else 0) | (self.ac & 0x7F)
+
+  def end_read(self):
+    if self.eight_bit or self.read_phase == 1:
+      self.read_phase = 0
+      if self.pins & PIN_RS:
+        self.ac = self.step(self.ac)
+    else:
+      self.read_phase = 1
+
+  # --------------------------------------------------------------------
+  # Execution
+
+  def execute(self, value, rs):
+    now = self.clock.now
+    if now < self.busy_until:
+      self.ignored += 1
+      if self.strict:
+        return
+    if rs:
+      self.writes += 1
+      self.write_data(value)
+      self.busy_until = now + WRITE_TIME
+    else:
+      self.instructions += 1
+      self.busy_until = now + self.instruction(value)
+
+  def instruction(self, value):
+    "Runs an instruction, returns its execution time"
+    if value & 0x80:   # Set DDRAM address
+      self.ac, self.cgram_mode = value & 0x7F, False
+    elif value & 0x40: # Set CGRAM address
+      self.ac, self.cgram_mode = value & 0x3F, True
+    elif value & 0x20: # Function set
+      self.eight_bit = bool(value & 0x10)
+      self.two_lines = bool(value & 0x08)
+      self.half = None
+    elif value & 0x10: # Cursor / display shift
+      if value & 0x08:
+        self.shift_display(-1 if value & 0x04 else 1)
+      else:
+        self.ac = self.step(self.ac, value & 0x04)
+    elif value & 0x08: # Display control
+      self.display_on = bool(value & 0x04)
+      self.cursor_on = bool(value & 0x02)
+      self.blink_on = bool(value & 0x01)
+    elif value & 0x04: # Entry mode set
+      self.increment = bool(value & 0x02)
+      self.entry_shift = bool(value & 0x01)
+    elif value & 0x02: # Return home
+      self.ac, self.cgram_mode, self.shift = 0, False, 0
+      return HOME_TIME
+    elif value & 0x01: # Clear display
+      self.ddram[:] = ' ' * DDRAM_SIZE
+      self.ac, self.cgram_mode, self.shift = 0, False, 0
+      self.increment = True
+      return CLEAR_TIME
+    return EXEC_TIME
+
+  def write_data(self, value):
+    self.ram()[self.ac] = value
+    self.ac = self.step(self.ac)
+    if self.entry_shift and not self.cgram_mode:
+      self.shift_display(1 if self.increment else -1)
+
+  def ram(self):
+    return self.cgram if self.cgram_mode else self.ddram
+
+  def step(self, ac, increment=None):
+    "Address counter after one step"
+    if increment is None:
+      increment = self.increment
+    delta = 1 if increment else -1
+    if self.cgram_mode:
+      return (ac + delta) % CGRAM_SIZE
+    if not self.two_lines:
+      return (ac + delta) % (2 * LINE_WIDTH)
+    line, col = ac & LINE2, (ac & 0x3F) + delta
+    if col < 0 or col >= LINE_WIDTH:
+      # Line 1 runs on into line 2 and back
+      return (line ^ LINE2) | (col % LINE_WIDTH)
+    return line | col
+
+  def shift_display(self, delta):
+    width = LINE_WIDTH if self.two_lines else 2 * LINE_WIDTH
+    self.shift = (self.shift + delta) % width
+
+  # --------------------------------------------------------------------
+  # Inspection
+
+  def row(self, r, cols=16):
+    "Characters currently visible on row r"
+    if not self.display_on:
+      return ' ' * cols
+    if self.two_lines:
+      base, width = ROW_OFFSETS[r] & LINE2, LINE_WIDTH
+      offset = ROW_OFFSETS[r] & 0x3F
+    else:
+      base, width, offset = 0, 2 * LINE_WIDTH, 0
+    return str(bytearray(self.ddram[base + (offset + self.shift + c) % width]
+                         for c in range(cols)))
+
+  def lines(self, cols=16, rows=2):
+    return [self.row(r, cols) for r in range(rows)]
+
+  def glyph(self, location):
+    "5x8 bitmap rows of a CGRAM character"
+    start = (location & 7) << 3
+    return list(self.cgram[start:start + 8])
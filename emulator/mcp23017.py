@@ -0,0 +1,306 @@
+#!/usr/bin/python
+
+# MCP23017 port expander model.  Implements the register file in both
+# IOCON.BANK layouts, sequential / byte mode address pointer handling,
+# pin direction, polarity, pull-ups and interrupt-on-change capture.
+# Each port can have a device connected to its pins; the device gets
+# output(olat, iodir) whenever the driven levels may have changed and
+# answers input() with (levels, driven_mask) for the pins it drives.
+#
+# The object exposes the python-smbus call set, so it can be attached
+# to fake_smbus and driven by the unmodified Adafruit code.
+
+#----------------------------------------------------------------------
+
+from clock import BusClock
+
+#----------------------------------------------------------------------
+
+PORTA = 0
+PORTB = 1
+
+# Register index within a port, as ordered in Bank 1
+IODIR, IPOL, GPINTEN, DEFVAL, INTCON, IOCON, GPPU, INTF, INTCAP, GPIO, OLAT = \
+  range(11)
+REGISTER_NAMES = ('IODIR', 'IPOL', 'GPINTEN', 'DEFVAL', 'INTCON', 'IOCON',
+                  'GPPU', 'INTF', 'INTCAP', 'GPIO', 'OLAT')
+BANK0_SIZE = 0x16
+
+IOCON_BANK = 0x80
+IOCON_MIRROR = 0x40
+IOCON_SEQOP = 0x20 # Set: byte mode, pointer does not increment
+IOCON_INTPOL = 0x02
+
+#----------------------------------------------------------------------
+
+class MCP23017(object):
+
+  # A write of a single byte (smbus write_byte) is on the datasheet a
+  # register address.  The Adafruit plate driver's busy poll uses it as
+  # the E strobe in byte mode, i.e. as data for the current register,
+  # and behaves on real plates as if it were; model it that way.  Set to
+  # False for datasheet behaviour.
+  BARE_WRITE_IS_DATA = True
+
+  def __init__(self, clock=None):
+    self.clock = clock or BusClock()
+    self.devices = [None, None]
+    self.listeners = [ ]
+    self.reset()
+
+  def reset(self):
+    "Power-on state: all pins inputs, Bank 0, sequential mode"
+    self.regs = [[0] * 11, [0] * 11]
+    for port in (PORTA, PORTB):
+      self.regs[port][IODIR] = 0xFF
+    self.pointer = 0
+    self.previous = [self.gpio(PORTA), self.gpio(PORTB)]
+    self.interrupts = 0
+
+  def connect(self, port, device):
+    self.devices[port] = device
+    self.update_outputs(port)
+    self.previous[port] = self.gpio(port)
+
+  def add_listener(self, func):
+    "func(port) is called when an interrupt is raised"
+    self.listeners.append(func)
+
+  # --------------------------------------------------------------------
+  # Addressing
+
+  def bank(self):
+    return 1 if self.regs[PORTA][IOCON] & IOCON_BANK else 0
+
+  def decode(self, addr):
+    "(port, register) for a register address, None if unimplemented"
+    if self.bank():
+      port, reg = addr >> 4, addr & 0x0F
+      if port > PORTB or reg > OLAT:
+        return None
+    else:
+      if addr >= BANK0_SIZE:
+        return None
+      port, reg = addr & 1, addr >> 1
+    return port, reg
+
+  # Same register order in both banks; Bank 0 interleaves the ports
+  def encode(self, port, reg):
+    if self.bank():
+      return (port << 4) | reg
+    return (reg << 1) | port
+
+  def next_address(self, addr):
+    iocon = self.regs[PORTA][IOCON]
+    if iocon & IOCON_SEQOP:
+      # Byte mode: Bank 1 stays put, Bank 0 toggles within the A/B pair
+      return addr if iocon & IOCON_BANK else addr ^ 1
+    if iocon & IOCON_BANK:
+      addr += 1
+      if (addr & 0x0F) > OLAT:
+        addr = (addr & 0xF0) + 0x10
+      return addr if addr <= ((PORTB << 4) | OLAT) else 0
+    return (addr + 1) % BANK0_SIZE
+
+  # --------------------------------------------------------------------
+  # Pins
+
+  def outputs(self, port):
+    "Levels driven by output pins (inputs read as 0)"
+    regs = self.regs[port]
+    return regs[OLAT] & ~regs[IODIR] & 0xFF
+
+  def pins(self, port):
+    regs = self.regs[port]
+    device = self.devices[port]
+    levels, driven = device.input() if device else (0, 0)
+    inputs = regs[IODIR]
+    floating = inputs & ~driven
+    return (self.outputs(port) | (levels & driven & inputs) |
+            (regs[GPPU] & floating)) & 0xFF
+
+  def gpio(self, port):
+    "GPIO register value: pin levels, input pins inverted per IPOL"
+    regs = self.regs[port]
+    return self.pins(port) ^ (regs[IPOL] & regs[IODIR])
+
+  def update_outputs(self, port):
+    device = self.devices[port]
+    if device:
+      regs = self.regs[port]
+      device.output(regs[OLAT], regs[IODIR])
+
+  # --------------------------------------------------------------------
+  # Interrupt-on-change
+
+  def input_changed(self, port):
+    "Called by a device after the levels it drives have changed"
+    regs = self.regs[port]
+    value = self.gpio(port)
+    if regs[INTCON]:
+      reference = (self.previous[port] & ~regs[INTCON]) | \
+                  (regs[DEFVAL] & regs[INTCON])
+    else:
+      reference = self.previous[port]
+    self.previous[port] = value
+    flagged = (value ^ reference) & regs[GPINTEN] & regs[IODIR]
+    if flagged and not regs[INTF]:
+      regs[INTF] = flagged
+      regs[INTCAP] = value
+      self.interrupts += 1
+      for func in self.listeners:
+        func(port)
+
+  def interrupt(self, port=PORTA):
+    "True while the port's INT line is asserted"
+    if self.regs[PORTA][IOCON] & IOCON_MIRROR:
+      return bool(self.regs[PORTA][INTF] or self.regs[PORTB][INTF])
+    return bool(self.regs[port][INTF])
+
+  # --------------------------------------------------------------------
+  # Register access
+
+  def store(self, addr, val):
+    decoded = self.decode(addr)
+    if decoded is None:
+      return
+    port, reg = decoded
+    regs = self.regs[port]
+    if reg == IOCON:
+      # One register, visible at both port addresses
+      self.regs[PORTA][IOCON] = self.regs[PORTB][IOCON] = val & 0xFE
+    elif reg in (INTF, INTCAP):
+      pass # Read-only
+    elif reg in (GPIO, OLAT):
+      regs[OLAT] = val
+      self.update_outputs(port)
+    else:
+      regs[reg] = val
+      if reg == IODIR:
+        self.update_outputs(port)
+      if reg in (IODIR, GPPU):
+        # Pin levels may move, which interrupt-on-change sees too
+        self.input_changed(port)
+
+  def load(self, addr):
+    decoded = self.decode(addr)
+    if decoded is None:
+      return 0
+    port, reg = decoded
+    regs = self.regs[port]
+    if reg == GPIO:
+      regs[INTF] = 0
+      return self.gpio(port)
+    if reg == INTCAP:
+      regs[INTF] = 0
+    return regs[reg]
+
+  def register(self, port, reg):
+    "Register contents by name, without bus access or side effects"
+    if reg == GPIO:
+      return self.gpio(port)
+    return self.regs[port][reg]
+
+  # --------------------------------------------------------------------
+  # Bus transfers, timed byte by byte
+
+  def write_stream(self, reg, vals):
+    clock = self.clock
+    clock.start()
+    clock.byte() # Device address
+    clock.byte() # Register address
+    self.pointer = reg
+    for val in vals:
+      clock.byte()
+      self.store(self.pointer, val)
+      self.pointer = self.next_address(self.pointer)
+    clock.stop()
+
+  def read_stream(self, reg, length):
+    clock = self.clock
+    clock.start()
+    clock.byte()
+    if reg is not None:
+      clock.byte()
+      self.pointer = reg
+      clock.restart()
+      clock.byte()
+    res = [ ]
+    for i in range(length):
+      res.append(self.load(self.pointer))
+      clock.byte()
+      self.pointer = self.next_address(self.pointer)
+    clock.stop()
+    return res
+
+  # I2C_RDWR: parts are (False, bytes) writes, the first byte setting
+  # the pointer, and (True, length) reads from the pointer, all in one
+  # transaction with a repeated start between them.  Returns the values
+  # read per part (None for writes).
+  def transfer(self, parts):
+    clock = self.clock
+    clock.start()
+    res = [ ]
+    for i, (read, data) in enumerate(parts):
+      if i:
+        clock.restart()
+      clock.byte() # Device address
+      if read:
+        vals = [ ]
+        for j in range(data):
+          vals.append(self.load(self.pointer))
+          clock.byte()
+          self.pointer = self.next_address(self.pointer)
+        res.append(vals)
+        continue
+      for j, val in enumerate(data):
+        clock.byte()
+        if j == 0:
+          self.pointer = val
+        else:
+          self.store(self.pointer, val)
+          self.pointer = self.next_address(self.pointer)
+      res.append(None)
+    clock.stop()
+    return res
+
+  # --------------------------------------------------------------------
+  # python-smbus interface
+
+  def write_quick(self):
+    self.clock.start()
+    self.clock.byte()
+    self.clock.stop()
+
+  def read_byte(self):
+    return self.read_stream(None, 1)[0]
+
+  def write_byte(self, val):
+    clock = self.clock
+    clock.start()
+    clock.byte()
+    clock.byte()
+    if self.BARE_WRITE_IS_DATA and self.regs[PORTA][IOCON] & IOCON_SEQOP:
+      self.store(self.pointer, val)
+    else:
+      self.pointer = val
+    clock.stop()
+
+  def read_byte_data(self, reg):
+    return self.read_stream(reg, 1)[0]
+
+  def write_byte_data(self, reg, val):
+    self.write_stream(reg, [val])
+
+  def read_word_data(self, reg):
+    lo, hi = self.read_stream(reg, 2)
+    return lo | (hi << 8)
+
+  def write_word_data(self, reg, val):
+    self.write_stream(reg, [val & 0xFF, (val >> 8) & 0xFF])
+
+  def read_i2c_block_data(self, reg, length=32):
+    return self.read_stream(reg, length)
+
+  def write_i2c_block_data(self, reg, vals):
+    self.write_stream(reg, vals)
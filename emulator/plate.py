@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# The Adafruit RGB LCD plate as a whole: MCP23017 with the five buttons
+# and red / green backlight on PORTA, the HD44780 and blue backlight on
+# PORTB, all sharing one bus clock.
+
+#----------------------------------------------------------------------
+
+import fake_smbus
+from clock import BusClock
+from mcp23017 import MCP23017, PORTA, PORTB, IODIR
+from hd44780 import HD44780
+
+#----------------------------------------------------------------------
+
+PLATE_ADDRESS = 0x20
+BUTTON_MASK = 0x1F
+LED_RED = 0x40   # PORTA, active low
+LED_GREEN = 0x80 # PORTA, active low
+LED_BLUE = 0x01  # PORTB, active low
+
+# Same bits as Adafruit_CharLCDPlate's colour constants
+RED = 0x01
+GREEN = 0x02
+BLUE = 0x04
+
+#----------------------------------------------------------------------
+
+class ButtonPad(object):
+  "PORTA device: pressed buttons short their pin to ground"
+
+  def __init__(self):
+    self.pressed = 0
+
+  def output(self, olat, iodir):
+    pass
+
+  def input(self):
+    return 0, self.pressed
+
+#----------------------------------------------------------------------
+
+class LCDPlate(object):
+
+  def __init__(self, address=PLATE_ADDRESS, clock=None, strict=True,
+               cols=16, rows=2):
+    self.address = address
+    self.clock = clock or BusClock()
+    self.cols = cols
+    self.rows = rows
+    self.mcp = MCP23017(self.clock)
+    self.lcd = HD44780(self.clock, strict)
+    self.pad = ButtonPad()
+    self.mcp.connect(PORTA, self.pad)
+    self.mcp.connect(PORTB, self.lcd)
+
+  def attach(self):
+    "Answers fake_smbus transactions for our address"
+    fake_smbus.attach(self.address, self.mcp)
+    return self
+
+  def detach(self):
+    fake_smbus.detach(self.address)
+
+  # --------------------------------------------------------------------
+  # Buttons
+
+  def set_buttons(self, mask):
+    mask &= BUTTON_MASK
+    if mask != self.pad.pressed:
+      self.pad.pressed = mask
+      self.mcp.input_changed(PORTA)
+
+  def press(self, mask):
+    self.set_buttons(self.pad.pressed | mask)
+
+  def release(self, mask):
+    self.set_buttons(self.pad.pressed & ~mask)
+
+  def on_interrupt(self, func):
+    "func() runs whenever INTA is raised, e.g. an edge source's trigger"
+    self.mcp.add_listener(lambda port: port == PORTA and func())
+
+  # --------------------------------------------------------------------
+  # Display
+
+  def lines(self):
+    return self.lcd.lines(self.cols, self.rows)
+
+  def text(self):
+    return '\n'.join(self.lines())
+
+  def backlight(self):
+    "Colour bits of the LEDs that are lit"
+    mcp = self.mcp
+    lit = [~mcp.outputs(port) & ~mcp.register(port, IODIR)
+           for port in (PORTA, PORTB)]
+    res = 0
+    if lit[PORTA] & LED_RED:
+      res |= RED
+    if lit[PORTA] & LED_GREEN:
+      res |= GREEN
+    if lit[PORTB] & LED_BLUE:
+      res |= BLUE
+    return res
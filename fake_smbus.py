@@ -0,0 +1,285 @@
+#!/usr/bin/python
+
+# Recording stand-in for the python-smbus module.  Every transaction the
+# drivers issue is logged with its size on the wire, so bus cost can be
+# measured without a Pi.  install() puts this module in place of smbus;
+# it has to run before the Adafruit modules are imported.
+#
+# Reads return values from a plain register map, or come from a device
+# model attached with attach() (see the emulator package).  fail() makes
+# the next few smbus calls to an address raise IOError, like a NACK on a
+# noisy bus.
+#
+# install(rdwr=True) also fakes the I2C_RDWR ioctl i2c_rdwr uses, on
+# placeholder device files, so combined transfers are logged and routed
+# the same way; by default the fake adapter refuses it and the drivers
+# stay on smbus (never touching a real /dev/i2c-N).
+
+#----------------------------------------------------------------------
+
+import sys, os, errno, atexit, shutil, tempfile
+
+#----------------------------------------------------------------------
+
+# Bytes after the start condition for each call: address byte(s), the
+# command/register byte and data.  Reads with a register use a repeated
+# start, so they carry a second address byte and an extra start.
+WIRE = {
+  'write_quick':          (1, 1),
+  'read_byte':            (2, 1),
+  'write_byte':           (2, 1),
+  'read_byte_data':       (4, 2),
+  'write_byte_data':      (3, 1),
+  'read_word_data':       (5, 2),
+  'write_word_data':      (4, 1),
+  'read_i2c_block_data':  (3, 2), # + length
+  'write_i2c_block_data': (2, 1)  # + length
+}
+BITS_PER_BYTE = 9 # 8 data bits + ACK
+RDWR_OP = 'i2c_rdwr'
+DEVICE_NAME = 'i2c-%d'
+DEVICE_BUSES = (0, 1)
+
+#----------------------------------------------------------------------
+
+class Transaction(object):
+
+  def __init__(self, op, addr, reg, data, read):
+    self.op = op
+    self.addr = addr
+    self.reg = reg
+    self.data = data
+    self.read = read
+    base, self.starts = WIRE[op]
+    self.payload = len(data) if isinstance(data, list) else (0 if data is None else 1)
+    if op in ('read_i2c_block_data', 'write_i2c_block_data'):
+      self.wire_bytes = base + len(data)
+    else:
+      self.wire_bytes = base
+
+  def wire_bits(self):
+    "Clock periods including start / stop conditions"
+    return self.wire_bytes * BITS_PER_BYTE + self.starts + 1
+
+  def __repr__(self):
+    return '%s(0x%02X, %r, %r)' % (self.op, self.addr, self.reg, self.data)
+
+#----------------------------------------------------------------------
+
+class RDWRTransaction(Transaction):
+  """ Messages to one address in an I2C_RDWR ioctl, joined by repeated
+  starts.  parts are (False, bytes written, register first) or (True,
+  length read). """
+
+  def __init__(self, addr, parts):
+    self.op = RDWR_OP
+    self.addr = addr
+    self.reg = None
+    self.data = parts
+    self.read = any(read for read, data in parts)
+    self.starts = len(parts)
+    self.payload = sum(data if read else max(len(data) - 1, 0)
+                       for read, data in parts)
+    self.wire_bytes = sum(1 + (data if read else len(data))
+                          for read, data in parts)
+
+#----------------------------------------------------------------------
+
+log = [ ]
+registers = { }
+devices = { }
+faults = { } # addr -> [calls left to fail, errno]
+pointers = { } # addr -> register pointer for I2C_RDWR on the register map
+
+def reset():
+  del log[:]
+
+def attach(addr, device):
+  "Routes transactions for addr to a device model"
+  devices[addr] = device
+
+def detach(addr):
+  devices.pop(addr, None)
+
+def fail(addr, count=1, err=errno.EREMOTEIO):
+  "The next count smbus calls to addr raise IOError(err) without effect"
+  faults[addr] = [count, err]
+
+#----------------------------------------------------------------------
+
+def stats(transactions=None, hz=(100000, 400000)):
+  "Totals for a list of transactions (default: the whole log)"
+  if transactions is None:
+    transactions = log
+  bits = sum(t.wire_bits() for t in transactions)
+  res = {
+    'transactions': len(transactions),
+    'syscalls': len(transactions), # one I2C_SMBUS ioctl each
+    'payload_bytes': sum(t.payload for t in transactions),
+    'wire_bytes': sum(t.wire_bytes for t in transactions),
+    'reads': sum(1 for t in transactions if t.read)
+  }
+  for f in hz:
+    res['us_%dk' % (f // 1000)] = bits * 1e6 / f
+  return res
+
+#----------------------------------------------------------------------
+
+class SMBus(object):
+
+  def __init__(self, bus=-1):
+    self.busnum = bus
+    self.last = { } # addr -> register pointer of the last access
+
+  def record(self, op, addr, reg, data, read=False):
+    log.append(Transaction(op, addr, reg, data, read))
+    fault = faults.get(addr)
+    if fault:
+      fault[0] -= 1
+      if fault[0] <= 0:
+        del faults[addr]
+      raise IOError(fault[1], os.strerror(fault[1]))
+    if reg is not None:
+      self.last[addr] = reg
+
+  def forward(self, op, addr, *args):
+    return getattr(devices[addr], op)(*args)
+
+  def value(self, addr, reg):
+    return registers.get((addr, reg), 0)
+
+  def write_quick(self, addr):
+    self.record('write_quick', addr, None, None)
+    if addr in devices:
+      self.forward('write_quick', addr)
+
+  def read_byte(self, addr):
+    self.record('read_byte', addr, None, 0, True)
+    if addr in devices:
+      return self.forward('read_byte', addr)
+    return self.value(addr, self.last.get(addr))
+
+  def write_byte(self, addr, val):
+    self.record('write_byte', addr, None, val)
+    if addr in devices:
+      self.forward('write_byte', addr, val)
+
+  def read_byte_data(self, addr, reg):
+    self.record('read_byte_data', addr, reg, 0, True)
+    if addr in devices:
+      return self.forward('read_byte_data', addr, reg)
+    return self.value(addr, reg)
+
+  def write_byte_data(self, addr, reg, val):
+    self.record('write_byte_data', addr, reg, val)
+    if addr in devices:
+      self.forward('write_byte_data', addr, reg, val)
+    else:
+      registers[(addr, reg)] = val
+
+  def read_word_data(self, addr, reg):
+    self.record('read_word_data', addr, reg, [0, 0], True)
+    if addr in devices:
+      return self.forward('read_word_data', addr, reg)
+    return self.value(addr, reg) | (self.value(addr, reg + 1) << 8)
+
+  def write_word_data(self, addr, reg, val):
+    self.record('write_word_data', addr, reg, [val & 0xFF, val >> 8])
+    if addr in devices:
+      self.forward('write_word_data', addr, reg, val)
+    else:
+      registers[(addr, reg)] = val & 0xFF
+      registers[(addr, reg + 1)] = val >> 8
+
+  def read_i2c_block_data(self, addr, reg, length=32):
+    self.record('read_i2c_block_data', addr, reg, [0] * length, True)
+    if addr in devices:
+      return self.forward('read_i2c_block_data', addr, reg, length)
+    return [self.value(addr, reg + i) for i in range(length)]
+
+  def write_i2c_block_data(self, addr, reg, vals):
+    vals = list(vals)
+    self.record('write_i2c_block_data', addr, reg, vals)
+    if addr in devices:
+      self.forward('write_i2c_block_data', addr, reg, vals)
+    elif vals:
+      # Plain register map: byte mode, the pointer does not advance
+      registers[(addr, reg)] = vals[-1]
+
+  def close(self):
+    pass
+
+#----------------------------------------------------------------------
+
+class FakeI2CDev(object):
+  """ Replaces i2c_rdwr.ioctl.  Without I2C_FUNC_I2C in funcs it acts
+  like an SMBus-only adapter.  Consecutive messages to one address go to
+  the attached device's transfer() as one transaction. """
+
+  def __init__(self, funcs):
+    self.funcs = funcs
+    self.ioctls = 0
+
+  def __call__(self, fd, request, arg):
+    import i2c_rdwr
+    if request == i2c_rdwr.I2C_FUNCS:
+      arg.contents.value = self.funcs
+      return
+    if request != i2c_rdwr.I2C_RDWR or not self.funcs & i2c_rdwr.I2C_FUNC_I2C:
+      raise IOError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+    self.ioctls += 1
+    data = arg.contents
+    groups = [ ]
+    for i in range(data.nmsgs):
+      msg = data.msgs[i]
+      if groups and groups[-1][0] == msg.addr:
+        groups[-1][1].append(msg)
+      else:
+        groups.append((msg.addr, [msg]))
+    for addr, msgs in groups:
+      parts = [ ]
+      for msg in msgs:
+        if msg.flags & i2c_rdwr.I2C_M_RD:
+          parts.append((True, msg.len))
+        else:
+          parts.append((False, [msg.buf[j] for j in range(msg.len)]))
+      log.append(RDWRTransaction(addr, parts))
+      if addr in devices:
+        results = devices[addr].transfer(parts)
+      else:
+        results = self.transfer(addr, parts)
+      for msg, res in zip(msgs, results):
+        if res is not None:
+          for j, val in enumerate(res):
+            msg.buf[j] = val
+
+  def transfer(self, addr, parts):
+    "Plain register map, byte mode like SMBus.write_i2c_block_data"
+    res = [ ]
+    for read, data in parts:
+      if read:
+        res.append([registers.get((addr, pointers.get(addr)), 0)] * data)
+        continue
+      if data:
+        pointers[addr] = data[0]
+      if len(data) > 1:
+        registers[(addr, data[0])] = data[-1]
+      res.append(None)
+    return res
+
+#----------------------------------------------------------------------
+
+device_dir = None
+
+def install(rdwr=False):
+  "Makes `import smbus` return this module, and fakes I2C_RDWR (see top)"
+  global device_dir
+  sys.modules['smbus'] = sys.modules[__name__]
+  import i2c_rdwr
+  if device_dir is None:
+    device_dir = tempfile.mkdtemp(prefix='fake-i2c')
+    atexit.register(shutil.rmtree, device_dir, True)
+    for busnum in DEVICE_BUSES:
+      open(os.path.join(device_dir, DEVICE_NAME % busnum), 'w').close()
+  i2c_rdwr.DEVICE_FORMAT = os.path.join(device_dir, DEVICE_NAME)
+  i2c_rdwr.ioctl = FakeI2CDev(i2c_rdwr.I2C_FUNC_I2C if rdwr else 0)
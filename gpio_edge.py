@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+# Edge sources for interrupt-driven input.  An edge source blocks in
+# wait() until an interrupt line fires or the timeout runs out, so the
+# caller only touches the I2C bus when something actually changed.
+
+#----------------------------------------------------------------------
+
+import os, select, threading
+
+#----------------------------------------------------------------------
+
+SYSFS_GPIO = '/sys/class/gpio'
+EDGE_FALLING = 'falling'
+EDGE_RISING = 'rising'
+EDGE_BOTH = 'both'
+
+#----------------------------------------------------------------------
+
+class GPIOEdgeSource(object):
+  """ Waits for edges on a Raspberry Pi GPIO line through the sysfs
+  interface.  The MCP23017 INT outputs are active low, so by default a
+  falling edge (or a line that is already low) counts as pending.
+  An already open value file descriptor can be passed in as fd. """
+
+  def __init__(self, pin=None, edge=EDGE_FALLING, active_low=True, fd=None):
+    self.active_low = active_low
+    if fd is None:
+      fd = self.open_pin(pin, edge)
+    self.fd = fd
+    self.poller = select.poll()
+    self.poller.register(self.fd, select.POLLPRI | select.POLLERR)
+
+  @staticmethod
+  def open_pin(pin, edge):
+    path = os.path.join(SYSFS_GPIO, 'gpio%d' % pin)
+    if not os.path.exists(path):
+      with open(os.path.join(SYSFS_GPIO, 'export'), 'w') as f:
+        f.write(str(pin))
+    with open(os.path.join(path, 'direction'), 'w') as f:
+      f.write('in')
+    with open(os.path.join(path, 'edge'), 'w') as f:
+      f.write(edge)
+    return os.open(os.path.join(path, 'value'), os.O_RDONLY)
+
+  def level(self):
+    "Reads the line; reading also acknowledges a pending sysfs edge"
+    os.lseek(self.fd, 0, os.SEEK_SET)
+    return os.read(self.fd, 2)[:1] == '1'
+
+  def asserted(self):
+    return self.level() != self.active_low
+
+  # An interrupt that fired before we got here leaves the line asserted
+  # without a new edge, so check the level first.
+  def wait(self, timeout=None):
+    "Blocks until the line is asserted, True if so, False on timeout"
+    if self.asserted():
+      return True
+    ms = -1 if timeout is None else max(0, int(timeout * 1000))
+    if not self.poller.poll(ms):
+      return False
+    return self.asserted()
+
+  def fileno(self):
+    return self.fd
+
+  def close(self):
+    os.close(self.fd)
+
+#----------------------------------------------------------------------
+
+class FakeEdgeSource(object):
+  "Edge source for tests and emulation; trigger() fires the line"
+
+  def __init__(self):
+    self.event = threading.Event()
+    self.count = 0
+
+  def trigger(self):
+    self.count += 1
+    self.event.set()
+
+  def wait(self, timeout=None):
+    res = self.event.wait(timeout)
+    self.event.clear()
+    return bool(res)
+
+  def close(self):
+    pass
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# I2C cost benchmark for the LCD plate driver.  Each scenario runs the
+# real Adafruit_CharLCDPlate code against the recording fake_smbus and
+# reports transactions, bytes, syscalls and estimated wire time at
+# 100 and 400 kHz.
+#
+#   ./i2c_bench.py            print the table
+#   ./i2c_bench.py --save     store results as the baseline
+#   ./i2c_bench.py --check    exit 1 if any scenario got more expensive
+#                             than the baseline by more than --threshold
+#   ./i2c_bench.py --rdwr     the same over (fake) I2C_RDWR transfers
+
+#----------------------------------------------------------------------
+
+import fake_smbus
+fake_smbus.install()
+
+from Adafruit_CharLCDPlate import Adafruit_CharLCDPlate
+import argparse, json, os, sys
+
+#----------------------------------------------------------------------
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'i2c_bench.json')
+THRESHOLD = 0.10
+CHECKED = ('transactions', 'wire_bytes')
+COLS = 16
+ROWS = 2
+STR_SPACE = ' '
+COLUMNS = ('transactions', 'payload_bytes', 'wire_bytes', 'syscalls',
+           'us_100k', 'us_400k')
+
+#----------------------------------------------------------------------
+
+def pad(text, width=COLS):
+  return (text + STR_SPACE * width)[0:width]
+
+#----------------------------------------------------------------------
+
+def frame(station='JoyFM', volume=40, clock='12:00:00 18/10'):
+  "Rows as the radio's idle screen draws them"
+  return [pad(station + STR_SPACE + str(volume)), pad(clock + ' Jazz')]
+
+#----------------------------------------------------------------------
+
+def new_lcd(timing=Adafruit_CharLCDPlate.TIMING_POLLED):
+  lcd = Adafruit_CharLCDPlate(timing=timing, sleep=lambda seconds: None)
+  lcd.begin(COLS, ROWS)
+  return lcd
+
+#----------------------------------------------------------------------
+
+def drawn(rows):
+  "Setup: a plate with rows already on screen"
+  lcd = new_lcd()
+  lcd.render(rows)
+  return lcd
+
+#----------------------------------------------------------------------
+
+def marquee():
+  return [pad('ABCRadioNational 40', 40),
+          pad('12:00:00 18/10 ABC Radio National', 40)]
+
+#----------------------------------------------------------------------
+
+# name, setup() -> lcd or None, run(lcd)
+SCENARIOS = [
+  ('boot', lambda: None,
+   lambda lcd: new_lcd().render(['Welcome', ''])),
+  ('frame_first', new_lcd,
+   lambda lcd: lcd.render(frame())),
+  ('frame_tick', lambda: drawn(frame()),
+   lambda lcd: lcd.render(frame(clock='12:00:01 18/10'))),
+  ('frame_unchanged', lambda: drawn(frame()),
+   lambda lcd: lcd.render(frame())),
+  ('frame_legacy', lambda: drawn(frame()),
+   lambda lcd: (lcd.home(), lcd.message('\n'.join(frame())))),
+  ('clear_polled', lambda: drawn(frame()),
+   lambda lcd: (lcd.clear(), lcd.render(frame()))),
+  ('clear_deadline',
+   lambda: new_lcd(Adafruit_CharLCDPlate.TIMING_DEADLINE),
+   lambda lcd: (lcd.clear(), lcd.render(frame()))),
+  ('station_change', lambda: drawn(frame()),
+   lambda lcd: lcd.render(frame(station='BBCRadio4Extra', volume=70))),
+  ('volume_step', lambda: drawn(frame()),
+   lambda lcd: lcd.render(frame(volume=45))),
+  ('marquee_step', lambda: drawn(marquee()),
+   lambda lcd: lcd.render(marquee(), 1)),
+  ('input', new_lcd,
+   lambda lcd: lcd.buttons()),
+  ('backlight', new_lcd,
+   lambda lcd: lcd.backlight(lcd.RED)),
+  ('idle', lambda: drawn(frame()),
+   lambda lcd: (lcd.backlight(lcd.OFF),
+                lcd.render(frame(clock='12:00:01 18/10'))))
+]
+
+#----------------------------------------------------------------------
+
+def run():
+  results = { }
+  for name, setup, scenario in SCENARIOS:
+    lcd = setup()
+    fake_smbus.reset()
+    scenario(lcd)
+    results[name] = fake_smbus.stats()
+  return results
+
+#----------------------------------------------------------------------
+
+def report(results, baseline=None):
+  print '%-16s' % 'scenario' + ''.join('%14s' % c for c in COLUMNS)
+  for name, setup, scenario in SCENARIOS:
+    res = results[name]
+    line = '%-16s' % name
+    for c in COLUMNS:
+      line += '%14s' % ('%.0f' % res[c])
+    if baseline and name in baseline:
+      base = baseline[name]['transactions']
+      line += '   (baseline %d tx)' % base
+    print line
+
+#----------------------------------------------------------------------
+
+def regressions(results, baseline, threshold):
+  res = [ ]
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    for key in CHECKED:
+      now, base = results[name][key], baseline[name][key]
+      if now > base * (1.0 + threshold):
+        res.append('%s: %s %d > baseline %d' % (name, key, now, base))
+  return res
+
+#----------------------------------------------------------------------
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='LCD plate I2C cost')
+  parser.add_argument('--save', action='store_true',
+                      help='store results as the new baseline')
+  parser.add_argument('--check', action='store_true',
+                      help='fail on regressions against the baseline')
+  parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                      help='allowed relative increase (default %(default)s)')
+  parser.add_argument('--baseline', default=BASELINE_FILE)
+  parser.add_argument('--rdwr', action='store_true',
+                      help='combined I2C_RDWR transfers instead of smbus')
+  args = parser.parse_args(argv)
+  if args.rdwr:
+    fake_smbus.install(True) # Before the first plate opens the bus
+
+  results = run()
+  baseline = None
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as infile:
+      baseline = json.load(infile)
+  report(results, baseline)
+
+  if args.save:
+    with open(args.baseline, 'w') as outfile:
+      outfile.write(json.dumps(results, indent=4, sort_keys=True) + '\n')
+  if args.check:
+    if baseline is None:
+      print 'No baseline in %s' % args.baseline
+      return 1
+    failed = regressions(results, baseline, args.threshold)
+    for f in failed:
+      print 'REGRESSION', f
+    return 1 if failed else 0
+  return 0
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+# Combined I2C transfers through the I2C_RDWR ioctl on /dev/i2c-N.  One
+# ioctl carries a list of read and write messages to the adapter, joined
+# by repeated starts, where smbus needs a syscall (and a stop / start)
+# per register access.  Adapters without plain I2C support (some SMBus
+# only controllers) are refused at open, and callers fall back to smbus;
+# see Adafruit_I2C.I2CBus.
+#
+# The ioctl goes through libc via ctypes so the message pointers are
+# passed at full width.  Tests can swap the module's ioctl for a fake
+# device (fake_smbus.FakeI2CDev) and point DEVICE_FORMAT at a plain file.
+
+#----------------------------------------------------------------------
+
+import os, errno, ctypes
+from ctypes import c_uint8, c_uint16, c_uint32, c_ulong, POINTER
+
+#----------------------------------------------------------------------
+
+DEVICE_FORMAT = '/dev/i2c-%d'
+I2C_FUNCS = 0x0705
+I2C_RDWR = 0x0707
+I2C_FUNC_I2C = 0x00000001
+I2C_M_RD = 0x0001
+RDWR_MAX_MSGS = 42 # I2C_RDWR_IOCTL_MAX_MSGS
+MSG_MAX_LEN = 8192
+
+#----------------------------------------------------------------------
+
+class i2c_msg(ctypes.Structure):
+  _fields_ = [('addr', c_uint16), ('flags', c_uint16), ('len', c_uint16),
+              ('buf', POINTER(c_uint8))]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+  _fields_ = [('msgs', POINTER(i2c_msg)), ('nmsgs', c_uint32)]
+
+#----------------------------------------------------------------------
+
+class Message(object):
+  """ One part of a combined transfer.  Writes carry the register address
+  as their first byte; a read's data is filled in by the transfer. """
+
+  def __init__(self, addr, read, data):
+    self.addr = addr
+    self.read = read
+    self.data = data
+
+  def length(self):
+    return len(self.data)
+
+  def __repr__(self):
+    return '%s(0x%02X, %r)' % ('read' if self.read else 'write', self.addr,
+                               list(self.data))
+
+def write(addr, data):
+  return Message(addr, False, bytearray(data))
+
+def read(addr, length):
+  return Message(addr, True, bytearray(length))
+
+#----------------------------------------------------------------------
+
+libc = None
+
+def libc_ioctl(fd, request, arg):
+  "arg is a ctypes pointer; raises IOError like fcntl.ioctl"
+  global libc
+  if libc is None:
+    libc = ctypes.CDLL(None, use_errno=True)
+  if libc.ioctl(fd, request, arg) < 0:
+    err = ctypes.get_errno()
+    raise IOError(err, os.strerror(err))
+
+ioctl = libc_ioctl
+
+#----------------------------------------------------------------------
+
+class RDWRBus(object):
+
+  def __init__(self, busnum, path=None):
+    self.busnum = busnum
+    self.path = path or DEVICE_FORMAT % busnum
+    self.fd = os.open(self.path, os.O_RDWR)
+    try:
+      funcs = c_ulong(0)
+      ioctl(self.fd, I2C_FUNCS, ctypes.pointer(funcs))
+      if not funcs.value & I2C_FUNC_I2C:
+        raise IOError(errno.EOPNOTSUPP, 'adapter has no plain I2C support')
+    except:
+      os.close(self.fd)
+      raise
+    self.ioctls = 0
+
+  def transfer(self, messages):
+    "Sends the messages, RDWR_MAX_MSGS to an ioctl; fills in the reads"
+    for i in xrange(0, len(messages), RDWR_MAX_MSGS):
+      self.transfer_chunk(messages[i:i + RDWR_MAX_MSGS])
+
+  def transfer_chunk(self, messages):
+    count = len(messages)
+    msgs = (i2c_msg * count)()
+    buffers = [ ] # Keeps the ctypes buffers alive for the ioctl
+    for msg, message in zip(msgs, messages):
+      length = message.length()
+      if length > MSG_MAX_LEN:
+        raise ValueError('I2C message of %d bytes' % length)
+      buf = (c_uint8 * length).from_buffer(message.data)
+      buffers.append(buf)
+      msg.addr = message.addr
+      msg.flags = I2C_M_RD if message.read else 0
+      msg.len = length
+      msg.buf = ctypes.cast(buf, POINTER(c_uint8))
+    data = i2c_rdwr_ioctl_data(ctypes.cast(msgs, POINTER(i2c_msg)), count)
+    ioctl(self.fd, I2C_RDWR, ctypes.pointer(data))
+    self.ioctls += 1
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+
+# In-process counters, gauges and histograms, served in the Prometheus
+# text format over loopback HTTP or a Unix socket:
+#
+#   curl http://127.0.0.1:9101/metrics
+#   curl --unix-socket /run/radio/metrics.sock http://radio/metrics
+#
+# Other plain text pages (the radio's traces) can be served alongside.
+#
+# Recording is an add under an uncontended lock (a bisect as well for
+# histograms); values that are already counted elsewhere (event loop
+# iterations, I2C totals) are registered as functions and only read when
+# scraped, so collection can stay on in production.
+
+#----------------------------------------------------------------------
+
+import os, threading, bisect
+import SocketServer, BaseHTTPServer
+
+#----------------------------------------------------------------------
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9101
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+# Seconds, from a fast I2C frame up to a slow stream start
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STR_NEWLINE = '\n'
+
+#----------------------------------------------------------------------
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
+#----------------------------------------------------------------------
+
+def format_labels(labels, extra=None):
+  pairs = list(labels)
+  if extra is not None:
+    pairs.append(extra)
+  if not pairs:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                        .replace('"', '\\"')
+                                        .replace(STR_NEWLINE, '\\n'))
+                           for k, v in pairs)
+
+#----------------------------------------------------------------------
+
+class Counter(object):
+  "Only goes up.  func, if given, is read at scrape time instead"
+
+  kind = 'counter'
+
+  def __init__(self, func=None):
+    self.func = func
+    self.value = 0
+    self.lock = threading.Lock()
+
+  def inc(self, amount=1):
+    with self.lock:
+      self.value += amount
+
+  def get(self):
+    if self.func is not None:
+      return self.func()
+    return self.value
+
+  def samples(self, name, labels):
+    return [(name + format_labels(labels), self.get())]
+
+#----------------------------------------------------------------------
+
+class Gauge(Counter):
+  "Goes up and down"
+
+  kind = 'gauge'
+
+  def set(self, value):
+    self.value = value
+
+  def dec(self, amount=1):
+    self.inc(-amount)
+
+#----------------------------------------------------------------------
+
+class Histogram(object):
+
+  kind = 'histogram'
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.bounds = sorted(buckets)
+    self.counts = [0] * (len(self.bounds) + 1) # Last one is +Inf
+    self.sum = 0.0
+    self.count = 0
+    self.lock = threading.Lock()
+
+  def observe(self, value):
+    index = bisect.bisect_left(self.bounds, value)
+    with self.lock:
+      self.counts[index] += 1
+      self.sum += value
+      self.count += 1
+
+  def samples(self, name, labels):
+    with self.lock:
+      counts, total, count = list(self.counts), self.sum, self.count
+    res = [ ]
+    cumulative = 0
+    for bound, n in zip(self.bounds + [float('inf')], counts):
+      cumulative += n
+      le = format_labels(labels, ('le', format_value(bound)))
+      res.append((name + '_bucket' + le, cumulative))
+    res.append((name + '_sum' + format_labels(labels), total))
+    res.append((name + '_count' + format_labels(labels), count))
+    return res
+
+#----------------------------------------------------------------------
+
+class Collected(object):
+  """ A family whose label sets are only known when scraped: func
+  returns a list of (labels dict, value) """
+
+  def __init__(self, kind, func):
+    self.kind = kind
+    self.func = func
+
+  def samples(self, name, labels):
+    return [(name + format_labels(sorted(labels.items())), value)
+            for labels, value in self.func()]
+
+#----------------------------------------------------------------------
+
+class Registry(object):
+  """ Metrics by name and label set.  Asking for one that exists returns
+  it, so modules can look theirs up at import time. """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.families = { } # name -> (kind, help, {labels: metric})
+    self.order = [ ]
+
+  def get(self, cls, name, help, labels, *args):
+    key = tuple(sorted((labels or { }).items()))
+    with self.lock:
+      family = self.families.get(name)
+      if family is None:
+        family = (cls.kind, help, { })
+        self.families[name] = family
+        self.order.append(name)
+      elif family[0] != cls.kind:
+        raise ValueError('%s is a %s' % (name, family[0]))
+      metric = family[2].get(key)
+      if metric is None:
+        metric = cls(*args)
+        family[2][key] = metric
+    return metric
+
+  def counter(self, name, help, labels=None, func=None):
+    return self.get(Counter, name, help, labels, func)
+
+  def gauge(self, name, help, labels=None, func=None):
+    return self.get(Gauge, name, help, labels, func)
+
+  def histogram(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+    return self.get(Histogram, name, help, labels, buckets)
+
+  def collect(self, name, help, kind, func):
+    with self.lock:
+      family = self.families.get(name)
+      if family is None:
+        family = (kind, help, {(): Collected(kind, func)})
+        self.families[name] = family
+        self.order.append(name)
+    return family[2].values()[0]
+
+  def render(self):
+    "Everything in the Prometheus text exposition format"
+    with self.lock:
+      families = [(name, self.families[name]) for name in self.order]
+      families = [(name, kind, help, sorted(metrics.items()))
+                  for name, (kind, help, metrics) in families]
+    out = [ ]
+    for name, kind, help, metrics in families:
+      out.append('# HELP %s %s' % (name, help))
+      out.append('# TYPE %s %s' % (name, kind))
+      for labels, metric in metrics:
+        try:
+          samples = metric.samples(name, labels)
+        except Exception:
+          continue # A failing func just leaves its sample out
+        for sample, value in samples:
+          out.append('%s %s' % (sample, format_value(value)))
+    return STR_NEWLINE.join(out) + STR_NEWLINE
+
+#----------------------------------------------------------------------
+
+REGISTRY = Registry()
+
+def counter(name, help, labels=None, func=None):
+  return REGISTRY.counter(name, help, labels, func)
+
+def gauge(name, help, labels=None, func=None):
+  return REGISTRY.gauge(name, help, labels, func)
+
+def histogram(name, help, labels=None, buckets=DEFAULT_BUCKETS):
+  return REGISTRY.histogram(name, help, labels, buckets)
+
+def collect(name, help, kind, func):
+  return REGISTRY.collect(name, help, kind, func)
+
+#----------------------------------------------------------------------
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    path = self.path.split('?')[0]
+    if path in (METRICS_PATH, '/'):
+      body = self.server.registry.render()
+    elif path in self.server.pages:
+      body = self.server.pages[path]()
+    else:
+      self.send_error(404)
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+#----------------------------------------------------------------------
+
+class TCPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn,
+                        SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+#----------------------------------------------------------------------
+
+def parse_address(address):
+  "'/path' for a Unix socket, 'host:port' or 'port' for TCP"
+  if address.startswith('/'):
+    return address
+  host, _, port = address.rpartition(':')
+  return (host or METRICS_HOST, int(port))
+
+#----------------------------------------------------------------------
+
+def serve(address, registry=None, pages=None):
+  """ Serves registry (default: REGISTRY) on a background thread; the
+  address is as for parse_address() or a (host, port) tuple.  pages maps
+  further paths to functions returning plain text. """
+  if isinstance(address, basestring):
+    address = parse_address(address)
+  if isinstance(address, basestring):
+    try:
+      os.unlink(address) # Left over from an earlier run
+    except OSError:
+      pass
+    server = UnixMetricsServer(address, MetricsHandler)
+  else:
+    server = TCPMetricsServer(address, MetricsHandler)
+  server.registry = registry or REGISTRY
+  server.pages = pages or { }
+  thread = threading.Thread(target=server.serve_forever, name='metrics')
+  thread.daemon = True
+  thread.start()
+  return server
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+# Minimal MPD protocol client.  One long-lived socket is kept open to the
+# daemon so a control action costs a single round trip instead of a
+# shell + mpc fork per command.  Commands can be batched with
+# command_list_begin / command_list_end.
+
+#----------------------------------------------------------------------
+
+import socket, threading, os
+from time import sleep
+
+#----------------------------------------------------------------------
+
+MPD_HOST = os.getenv('MPD_HOST', 'localhost')
+MPD_PORT = int(os.getenv('MPD_PORT', '6600'))
+MPD_TIMEOUT = 5.0
+MPD_RETRIES = 1
+MPD_IDLE_SUBSYSTEMS = ('player', 'mixer', 'stored_playlist')
+MPD_WATCH_BACKOFF = 1.0
+MPD_WATCH_BACKOFF_MAX = 30.0
+MPD_HELLO = 'OK MPD '
+MPD_OK = 'OK'
+MPD_LIST_OK = 'list_OK'
+MPD_ACK = 'ACK '
+MPD_SEPARATOR = ': '
+STR_NEWLINE = '\n'
+STR_SPACE = ' '
+
+#----------------------------------------------------------------------
+
+class MPDError(Exception):
+  "Connection or protocol failure talking to MPD"
+  pass
+
+#----------------------------------------------------------------------
+
+class MPDCommandError(MPDError):
+  "MPD answered a command with ACK"
+  pass
+
+#----------------------------------------------------------------------
+
+def quote(arg):
+  "Quotes a single command argument for the MPD protocol"
+  arg = str(arg).replace('\\', '\\\\').replace('"', '\\"')
+  return '"' + arg + '"'
+
+#----------------------------------------------------------------------
+
+def format_command(cmd, args):
+  return STR_SPACE.join([cmd] + [quote(a) for a in args])
+
+#----------------------------------------------------------------------
+
+def pairs_to_dict(pairs):
+  res = { }
+  for key, value in pairs:
+    res[key] = value
+  return res
+
+#----------------------------------------------------------------------
+
+def format_current(song):
+  "Formats a currentsong dict the same way `mpc current` does"
+  name = song.get('Name', '')
+  artist = song.get('Artist', '')
+  title = song.get('Title', '')
+  if artist and title:
+    title = artist + ' - ' + title
+  if name and title:
+    return name + MPD_SEPARATOR + title
+  return name or title or song.get('file', '')
+
+#----------------------------------------------------------------------
+
+class MPDClient(object):
+
+  def __init__(self, host=MPD_HOST, port=MPD_PORT, timeout=MPD_TIMEOUT,
+               retries=MPD_RETRIES):
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+    self.retries = retries
+    self.version = None
+    self.sock = None
+    self.rfile = None
+    self.lock = threading.RLock()
+
+  # --------------------------------------------------------------------
+  # Connection handling
+
+  def connect(self):
+    with self.lock:
+      if self.sock is not None:
+        return
+      try:
+        if self.host.startswith('/'):
+          sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+          sock.settimeout(self.timeout)
+          sock.connect(self.host)
+        else:
+          sock = socket.create_connection((self.host, self.port), self.timeout)
+      except (socket.error, socket.timeout), err:
+        raise MPDError('connect to %s:%s failed: %s' % (self.host, self.port, err))
+      self.sock = sock
+      self.rfile = sock.makefile('rb')
+      hello = self.read_line()
+      if not hello.startswith(MPD_HELLO):
+        self.disconnect()
+        raise MPDError('unexpected greeting: %r' % hello)
+      self.version = hello[len(MPD_HELLO):]
+
+  def disconnect(self):
+    with self.lock:
+      for f in (self.rfile, self.sock):
+        if f is not None:
+          try:
+            f.close()
+          except (socket.error, IOError):
+            pass
+      self.sock = None
+      self.rfile = None
+
+  def connected(self):
+    return self.sock is not None
+
+  # --------------------------------------------------------------------
+  # Wire protocol
+
+  def read_line(self):
+    try:
+      line = self.rfile.readline()
+    except (socket.error, socket.timeout), err:
+      raise MPDError('read failed: %s' % err)
+    if not line.endswith(STR_NEWLINE):
+      raise MPDError('connection closed')
+    return line[:-1]
+
+  def send(self, lines):
+    try:
+      self.sock.sendall(STR_NEWLINE.join(lines) + STR_NEWLINE)
+    except (socket.error, socket.timeout), err:
+      raise MPDError('write failed: %s' % err)
+
+  # Reads key/value pairs up to the terminating OK.  With list_ok set,
+  # list_OK separators split the result into one list per command.
+  def read_response(self, list_ok=False):
+    pairs = [ ]
+    results = [ ]
+    while True:
+      line = self.read_line()
+      if line == MPD_OK:
+        break
+      if line == MPD_LIST_OK and list_ok:
+        results.append(pairs)
+        pairs = [ ]
+        continue
+      if line.startswith(MPD_ACK):
+        raise MPDCommandError(line[len(MPD_ACK):])
+      key, sep, value = line.partition(MPD_SEPARATOR)
+      if not sep:
+        raise MPDError('malformed response: %r' % line)
+      pairs.append((key, value))
+    return results if list_ok else pairs
+
+  # Sends the lines and reads the response, reconnecting and retrying
+  # if the socket went away (MPD drops idle clients after a timeout).
+  def round_trip(self, lines, list_ok=False):
+    with self.lock:
+      tries = self.retries
+      while True:
+        try:
+          self.connect()
+          self.send(lines)
+          return self.read_response(list_ok)
+        except MPDCommandError:
+          raise
+        except MPDError:
+          self.disconnect()
+          if tries <= 0:
+            raise
+          tries -= 1
+
+  # --------------------------------------------------------------------
+  # Commands
+
+  def command(self, cmd, *args):
+    "Runs one command and returns its key/value pairs"
+    return self.round_trip([format_command(cmd, args)])
+
+  def command_list(self, commands):
+    "Runs a list of (cmd, args...) tuples in one round trip"
+    lines = ['command_list_ok_begin']
+    for c in commands:
+      lines.append(format_command(c[0], c[1:]))
+    lines.append('command_list_end')
+    return self.round_trip(lines, True)
+
+  def ping(self):
+    self.command('ping')
+
+  def stop(self):
+    self.command('stop')
+
+  def play(self):
+    self.command('play')
+
+  def clear(self):
+    self.command('clear')
+
+  def load(self, playlist):
+    self.command('load', playlist)
+
+  def setvol(self, volume):
+    self.command('setvol', volume)
+
+  def status(self):
+    return pairs_to_dict(self.command('status'))
+
+  def currentsong(self):
+    return pairs_to_dict(self.command('currentsong'))
+
+  def listplaylists(self):
+    return [v for k, v in self.command('listplaylists') if k == 'playlist']
+
+  def idle(self, *subsystems):
+    "Blocks until one of the subsystems changes, returns the changed ones"
+    return [v for k, v in self.command('idle', *subsystems) if k == 'changed']
+
+  def play_playlist(self, playlist, volume):
+    "Replaces the queue with a stored playlist and starts it, one round trip"
+    self.command_list([
+      ('stop', ),
+      ('clear', ),
+      ('load', playlist),
+      ('play', ),
+      ('setvol', volume)
+    ])
+
+#----------------------------------------------------------------------
+
+class MPDWatcher(object):
+  """ Keeps a cached status / currentsong snapshot up to date from MPD
+  idle notifications on a background thread.  Readers get the latest
+  snapshot with no I/O; listeners are called with the list of changed
+  subsystems after each refresh. """
+
+  def __init__(self, host=MPD_HOST, port=MPD_PORT,
+               subsystems=MPD_IDLE_SUBSYSTEMS):
+    # idle blocks indefinitely, so this connection has no timeout and
+    # reconnects are handled by the watch loop with a backoff
+    self.client = MPDClient(host, port, None, 0)
+    self.subsystems = subsystems
+    self.status = { }
+    self.song = { }
+    self.version = 0
+    self.listeners = [ ]
+    self.running = False
+    self.thread = None
+
+  def add_listener(self, func):
+    self.listeners.append(func)
+
+  def start(self):
+    if self.running:
+      return self
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name='mpd-watcher')
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.running = False
+    sock = self.client.sock
+    if sock is not None:
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+    if self.thread is not None:
+      self.thread.join(1.0)
+
+  def refresh(self):
+    status, song = self.client.command_list([('status', ), ('currentsong', )])
+    # Replace whole dicts so readers on other threads never see a
+    # half-updated snapshot
+    self.status = pairs_to_dict(status)
+    self.song = pairs_to_dict(song)
+    self.version += 1
+
+  def notify(self, changed):
+    for func in self.listeners:
+      try:
+        func(changed)
+      except Exception:
+        pass
+
+  def run(self):
+    backoff = MPD_WATCH_BACKOFF
+    changed = list(self.subsystems)
+    while self.running:
+      try:
+        self.refresh()
+        self.notify(changed)
+        backoff = MPD_WATCH_BACKOFF
+        changed = self.client.idle(*self.subsystems)
+      except MPDError:
+        self.client.disconnect()
+        if not self.running:
+          break
+        # Blank the snapshot while MPD is unreachable
+        if self.song or self.status:
+          self.status, self.song = { }, { }
+          self.version += 1
+        sleep(backoff)
+        backoff = min(backoff * 2, MPD_WATCH_BACKOFF_MAX)
+        changed = list(self.subsystems)
+    self.client.disconnect()
+
+  def current(self):
+    "Now-playing text, formatted like `mpc current`"
+    return format_current(self.song)
+
+  def state(self):
+    return self.status.get('state', '')
+
+  def volume(self):
+    try:
+      return int(self.status.get('volume', -1))
+    except ValueError:
+      return -1
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  client = MPDClient()
+  client.connect()
+  print 'MPD', client.version
+  print format_current(client.currentsong())
+  print client.listplaylists()
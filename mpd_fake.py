@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+# Local stand-in for an MPD server.  It speaks enough of the protocol
+# for mpd_client and radio.py (playback control, volume, stored
+# playlists, status, command lists and idle) so the radio can be run and
+# exercised without a real daemon or audio hardware.
+#
+#   ./mpd_fake.py [port] [playlist dir]
+#   MPD_PORT=<port> ./radio.py
+
+#----------------------------------------------------------------------
+
+import SocketServer, threading, socket, select, os, sys, shlex
+from time import time
+
+#----------------------------------------------------------------------
+
+FAKE_HOST = '127.0.0.1'
+FAKE_VERSION = '0.19.0'
+PLAYLIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'playlists')
+PLAYLIST_EXT = '.m3u'
+STR_NEWLINE = '\n'
+IDLE_POLL = 0.05
+IDLE_SUBSYSTEMS = ('player', 'mixer', 'playlist', 'stored_playlist')
+BUFFERING = 0.3 # Seconds elapsed stays at 0 after play, like a stream filling
+
+#----------------------------------------------------------------------
+
+def load_playlists(path):
+  "Reads *.m3u files from path into a name -> list of urls dict"
+  playlists = { }
+  try:
+    names = os.listdir(path)
+  except OSError:
+    return playlists
+  for name in names:
+    if not name.endswith(PLAYLIST_EXT):
+      continue
+    with open(os.path.join(path, name)) as infile:
+      urls = [l.strip() for l in infile if l.strip() and not l.startswith('#')]
+    playlists[name[:-len(PLAYLIST_EXT)]] = urls
+  return playlists
+
+#----------------------------------------------------------------------
+
+class FakeMPDState(object):
+  "Player state shared by all connections of one FakeMPDServer"
+
+  def __init__(self, playlists):
+    self.lock = threading.Lock()
+    self.cond = threading.Condition(self.lock)
+    self.playlists = playlists
+    self.queue = [ ]
+    self.state = 'stop'
+    self.volume = 100
+    self.song = 0
+    self.title = None
+    self.started = None
+    self.buffering = BUFFERING
+    self.log = [ ]
+    # Change counter per idle subsystem; connections compare against
+    # the counters they last reported
+    self.changes = dict((s, 0) for s in IDLE_SUBSYSTEMS)
+
+  def changed(self, *subsystems):
+    "Records a change and wakes idling connections.  Lock must be held."
+    for s in subsystems:
+      self.changes[s] += 1
+    self.cond.notify_all()
+
+  def set_title(self, title):
+    "Simulates a stream metadata (ICY title) update"
+    with self.lock:
+      self.title = title
+      self.changed('player')
+
+  def set_playlists(self, playlists):
+    "Simulates stored playlists being added or removed"
+    with self.lock:
+      self.playlists = playlists
+      self.changed('stored_playlist')
+
+  def ack(self, cmd, msg, code=5):
+    return 'ACK [%d@0] {%s} %s' % (code, cmd, msg)
+
+  # Runs one command and returns its response lines without the final
+  # OK, or an ACK line (a string) on failure.
+  def execute(self, cmd, args):
+    self.log.append(cmd if not args else cmd + ' ' + ' '.join(args))
+    if cmd == 'ping':
+      return [ ]
+    if cmd == 'stop':
+      self.state = 'stop'
+      self.changed('player')
+      return [ ]
+    if cmd == 'play':
+      if not self.queue:
+        return self.ack(cmd, 'No such song', 50)
+      self.state = 'play'
+      self.title = None
+      self.started = time()
+      self.changed('player')
+      return [ ]
+    if cmd == 'clear':
+      self.queue = [ ]
+      self.state = 'stop'
+      self.changed('player', 'playlist')
+      return [ ]
+    if cmd == 'load':
+      if not args or args[0] not in self.playlists:
+        return self.ack(cmd, 'No such playlist', 50)
+      self.queue.extend(self.playlists[args[0]])
+      self.changed('playlist')
+      return [ ]
+    if cmd == 'setvol':
+      try:
+        self.volume = max(0, min(100, int(args[0])))
+      except (IndexError, ValueError):
+        return self.ack(cmd, 'Integer expected', 2)
+      self.changed('mixer')
+      return [ ]
+    if cmd == 'listplaylists':
+      return ['playlist: ' + n for n in sorted(self.playlists)]
+    if cmd == 'status':
+      res = ['volume: %d' % self.volume,
+             'playlistlength: %d' % len(self.queue),
+             'state: %s' % self.state]
+      if self.queue and self.state != 'stop':
+        res.append('song: %d' % self.song)
+        res.append('elapsed: %.3f' % max(0.0, time() - self.started -
+                                         self.buffering))
+      return res
+    if cmd == 'currentsong':
+      if not self.queue or self.state == 'stop':
+        return [ ]
+      res = ['file: ' + self.queue[self.song],
+             'Name: ' + self.queue[self.song]]
+      if self.title:
+        res.append('Title: ' + self.title)
+      return res
+    return self.ack(cmd, 'unknown command "%s"' % cmd)
+
+#----------------------------------------------------------------------
+
+class FakeMPDHandler(SocketServer.StreamRequestHandler):
+
+  def reply(self, lines):
+    self.wfile.write(''.join(l + STR_NEWLINE for l in lines))
+
+  # Blocks until one of the subsystems changed since this connection
+  # last reported it, or the client sends noidle.  Returns the reply
+  # lines, or None if the client went away.
+  def idle(self, subsystems):
+    state = self.server.mpd
+    subsystems = subsystems or IDLE_SUBSYSTEMS
+    while True:
+      with state.lock:
+        pending = [s for s in subsystems
+                   if state.changes.get(s) != self.seen.get(s)]
+        if pending:
+          for s in pending:
+            self.seen[s] = state.changes[s]
+          return ['changed: ' + s for s in pending] + ['OK']
+        state.cond.wait(IDLE_POLL)
+      if select.select([self.connection], [], [], 0)[0]:
+        line = self.rfile.readline()
+        if not line:
+          return None
+        return ['OK']
+
+  def handle(self):
+    state = self.server.mpd
+    with state.lock:
+      self.seen = dict(state.changes)
+    self.reply(['OK MPD ' + FAKE_VERSION])
+    batch = None
+    list_ok = False
+    while True:
+      try:
+        line = self.rfile.readline()
+      except socket.error:
+        return
+      if not line:
+        return
+      try:
+        words = shlex.split(line)
+      except ValueError:
+        self.reply([state.ack('', 'Invalid quoting')])
+        continue
+      if not words:
+        continue
+      cmd, args = words[0], words[1:]
+      if cmd == 'close':
+        return
+      if cmd == 'idle':
+        out = self.idle(args)
+        if out is None:
+          return
+        self.reply(out)
+        continue
+      if cmd in ('command_list_begin', 'command_list_ok_begin'):
+        batch = [ ]
+        list_ok = cmd == 'command_list_ok_begin'
+        continue
+      if batch is not None and cmd != 'command_list_end':
+        batch.append((cmd, args))
+        continue
+      in_list = cmd == 'command_list_end'
+      if in_list:
+        commands, batch = batch or [ ], None
+      else:
+        commands = [(cmd, args)]
+      out = [ ]
+      with state.lock:
+        for c, a in commands:
+          res = state.execute(c, a)
+          if isinstance(res, str):
+            out.append(res)
+            break
+          out.extend(res)
+          if in_list and list_ok:
+            out.append('list_OK')
+        else:
+          out.append('OK')
+      self.reply(out)
+
+#----------------------------------------------------------------------
+
+class FakeMPDServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  "Threaded fake MPD; port 0 picks a free port, see .port"
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, port=0, playlists=None):
+    SocketServer.TCPServer.__init__(self, (FAKE_HOST, port), FakeMPDHandler)
+    if playlists is None:
+      playlists = load_playlists(PLAYLIST_DIR)
+    self.mpd = FakeMPDState(playlists)
+    self.port = self.server_address[1]
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else 6600
+  path = sys.argv[2] if len(sys.argv) > 2 else PLAYLIST_DIR
+  server = FakeMPDServer(port, load_playlists(path))
+  print 'Fake MPD on %s:%d, %d playlists' % (FAKE_HOST, server.port,
+                                             len(server.mpd.playlists))
+  server.serve_forever()
@@ -2,9 +2,20 @@
 
 #----------------------------------------------------------------------
 
-from Adafruit_CharLCDPlate import Adafruit_CharLCDPlate
-import json, commands, pygame, sys, os
-from time import time, strftime
+from boot_report import BootReport
+from button_input import ButtonInput
+from mpd_client import MPDClient, MPDWatcher, MPDError
+import commands, sys, os, atexit, threading, signal
+import backends, metrics
+from backends import FLAG_SELECT, FLAG_LEFT, FLAG_RIGHT, FLAG_UP, FLAG_DOWN
+from backends import COLOR_ON, COLOR_OFF
+from runtime import EventLoop, Executor, SystemClock
+from config_store import ConfigStore
+from station_catalog import StationCatalog
+from system_status import SystemStatus
+from tracing import Tracer, NULL_TRACE
+from time import time, strftime, sleep
+from functools import partial
 
 #----------------------------------------------------------------------
 
@@ -13,25 +24,17 @@ IS_ROOT = os.getenv('USER') == 'root'
 #----------------------------------------------------------------------
 
 RADIO_CONFIG_FILE = '/etc/radio.conf' if IS_ROOT else '/home/pi/radio/radio.conf'
+PLAYLIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'playlists')
 KEY_STATION = 'station'
 KEY_VOLUME = 'volume'
 KEY_DEBUG = 'debug'
 KEY_USE_LCD = 'use_lcd'
-FLAG_SELECT = 1
-FLAG_LEFT = 2
-FLAG_RIGHT = 4
-FLAG_UP = 8
-FLAG_DOWN = 16
-FILE_READONLY = 'r'
-FILE_WRITE = 'w'
-CMD_MPC_LSPLAYLISTS = 'mpc lsplaylists'
-CMD_MPC_STOP = 'mpc stop'
-CMD_MPC_PLAY = 'mpc play'
-CMD_MPC_CLEAR = 'mpc clear'
-CMD_MPC_LOAD = 'mpc load'
-CMD_MPC_VOLUME = 'mpc volume'
-CMD_MPC_CURRENT = 'mpc current'
-CMD_HOSTNAME = 'hostname -I'
+KEY_INT_GPIO = 'int_gpio'
+KEY_DEBUG_HEADLESS = 'debug_headless'
+KEY_DEBUG_DUMP = 'debug_dump'
+KEY_BACKENDS = 'backends'
+KEY_METRICS = 'metrics'
+KEY_TRACE_FILE = 'trace_file'
 CMD_SHUTDOWN = 'sudo shutdown -h now'
 PYGAME_CAPTION = 'Internet Radio'
 PYGAME_WIDTH = 500
@@ -39,6 +42,11 @@ PYGAME_HEIGHT = 100
 FONT_MONOSPACE = 'monospace'
 FONT_MONOSPACE_SIZE = 16
 SHUTDOWN_COUNTDOWN = 5
+IDLE_TIMEOUT = 5.0
+INPUT_INTERVAL = 0.02
+INPUT_WAIT = 1.0
+FRAME_INTERVAL = 0.5
+FRAME_INTERVAL_FAST = 0.1
 STR_NEWLINE = '\n'
 STR_NO_STATION = ''
 STR_SPACE = ' '
@@ -52,45 +60,129 @@ FORMAT_TIME = '%H:%M:%S %d/%m'
 FORMAT_SHUTDOWN_TIME = '{:.1f}'
 COLS = 16
 ROWS = 2
-
-data = {
+MARQUEE_WIDTH = 40
+SCROLL_RATE = 2.0
+AUDIO_WAIT = 30.0  # Give up timing the first audio after this long
+AUDIO_POLL = 0.1
+METRICS_ADDRESS = '127.0.0.1:9101' # Or a Unix socket path; '' turns it off
+TRACE_FILE = '/tmp/radio-traces.txt' # Written on SIGUSR1
+TRACE_PAGE = '/traces'               # On the metrics endpoint
+AUDIO_BUCKETS = (0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0,
+                 30.0)
+
+config = ConfigStore(RADIO_CONFIG_FILE, {
   KEY_USE_LCD: True,
   KEY_DEBUG: False
-}
+})
 
+boot = BootReport()
+clock = SystemClock()
+event_loop = None
 scroller_time = time()
 last_input_time = time()
-backlight = Adafruit_CharLCDPlate.ON
+shutdown_time = 0
+backlight = COLOR_ON
+displays = [ ] # Open backends
+inputs = [ ]   # The ones with buttons
+mpd = MPDClient()
+watcher = MPDWatcher()
+catalog = StationCatalog(mpd.listplaylists, PLAYLIST_DIR)
+watcher.add_listener(catalog.on_mpd_change)
+status = SystemStatus()
+tracer = Tracer()
+
+#----------------------------------------------------------------------
+
+# Totals the I2C driver keeps, 0 until a backend has loaded it
+def i2c_count(attr):
+  module = sys.modules.get('Adafruit_I2C')
+  return getattr(module.I2CBus, attr) if module else 0
+
+# Per bus and device address
+def i2c_devices(attr):
+  module = sys.modules.get('Adafruit_I2C')
+  if module is None:
+    return [ ]
+  res = [ ]
+  for busnum, bus in module.I2CBus.buses.items():
+    for addr, stats in bus.stats.items():
+      res.append(({'bus': busnum, 'device': '0x%02X' % addr},
+                  getattr(stats, attr)))
+  return res
+
+metrics.counter('radio_loop_iterations_total', 'Event loop iterations',
+                func=lambda: event_loop.iterations if event_loop else 0)
+metrics.counter('radio_i2c_transactions_total', 'I2C transactions',
+                func=lambda: i2c_count('transactions'))
+metrics.counter('radio_i2c_bytes_total', 'I2C data bytes',
+                func=lambda: i2c_count('bytes'))
+metrics.counter('radio_i2c_errors_total', 'I2C transactions that failed',
+                func=lambda: i2c_count('errors'))
+metrics.collect('radio_i2c_device_busy_seconds_total',
+                'Time each device had the bus (rate = utilisation)', 'counter',
+                lambda: i2c_devices('busy'))
+metrics.collect('radio_i2c_device_wait_seconds_total',
+                'Time each device queued for the bus', 'counter',
+                lambda: i2c_devices('wait'))
+metrics.collect('radio_i2c_device_transactions_total',
+                'I2C transactions per device', 'counter',
+                lambda: i2c_devices('transactions'))
+metrics.counter('radio_i2c_recoveries_total', 'I2C bus handles reopened',
+                func=lambda: i2c_count('recoveries'))
+metrics.collect('radio_i2c_device_retries_total',
+                'Register accesses retried after an I2C error', 'counter',
+                lambda: i2c_devices('retries'))
+metrics.collect('radio_i2c_device_failures_total',
+                'Register accesses that failed after all retries', 'counter',
+                lambda: i2c_devices('failures'))
+metrics.collect('radio_i2c_device_stale_reads_total',
+                'Failed reads answered with the last good value', 'counter',
+                lambda: i2c_devices('stale'))
+frame_seconds = metrics.histogram('radio_frame_seconds',
+                                  'Time to draw a frame on all displays')
+shell_spawns = metrics.counter('radio_shell_spawns_total',
+                               'Processes started by shell_command')
+mpd_errors = metrics.counter('radio_mpd_errors_total', 'Failed MPD commands')
+key_to_audio = metrics.histogram('radio_key_to_audio_seconds',
+                                 'Station button press to MPD elapsed > 0',
+                                 buckets=AUDIO_BUCKETS)
+boot_to_audio = metrics.gauge('radio_boot_audio_seconds',
+                              'Process start to first audio')
+
+#----------------------------------------------------------------------
+
+def now():
+  return clock.time()
+
+#----------------------------------------------------------------------
+
+button_input = ButtonInput(clock=now, repeatMask=FLAG_UP | FLAG_DOWN,
+                           longMask=FLAG_SELECT, longPress=SHUTDOWN_COUNTDOWN)
 
 #----------------------------------------------------------------------
 
 def read_data():
-  global data
-  try:
-    with open(RADIO_CONFIG_FILE, FILE_READONLY) as infile:
-      data = json.load(infile)
-  except:
-    pass
+  return config.load()
 
 #----------------------------------------------------------------------
 
 def write_data():
-  with open(RADIO_CONFIG_FILE, FILE_WRITE) as outfile:
-    outfile.write(json.dumps(data, indent=4))
-    outfile.write(STR_NEWLINE)
+  config.flush()
 
 #----------------------------------------------------------------------
 
 def get_data(prop, defval=False):
-  return data[prop] if prop in data else defval
+  return config.get(prop, defval)
 
 #----------------------------------------------------------------------
 
 def set_data(prop, val):
-  if prop in data and data[prop] == val:
-    return
-  data[prop] = val
-  write_data()
+  config.set(prop, val)
+
+#----------------------------------------------------------------------
+
+def scroller_skip(period):
+  return int(((now() - scroller_time)) * SCROLL_RATE) % period
 
 #----------------------------------------------------------------------
 
@@ -98,14 +190,29 @@ def scroller(text):
   if len(text) <= COLS:
     return (text + STR_SPACE*COLS)[0:COLS]
   scroller_text = text + STR_SPACE
-  skip = int(((time() - scroller_time)) * 2.0) % len(scroller_text)
+  skip = scroller_skip(len(scroller_text))
   scroller_text = (scroller_text + scroller_text)[skip:skip+COLS]
   return scroller_text
 
 #----------------------------------------------------------------------
 
+# The LCD can scroll in hardware when every line scrolls (the display
+# shift moves both lines) and fits the 40 column DDRAM line with a gap.
+def marquee_fits(lines):
+  for line in lines:
+    if len(line) <= COLS or len(line) >= MARQUEE_WIDTH:
+      return False
+  return True
+
+#----------------------------------------------------------------------
+
+def marquee(text):
+  return (text + STR_SPACE*MARQUEE_WIDTH)[0:MARQUEE_WIDTH]
+
+#----------------------------------------------------------------------
+
 def get_station():
-  return get_data(KEY_STATION, STR_NO_STATION)
+  return config.station
 
 #----------------------------------------------------------------------
 
@@ -115,42 +222,27 @@ def set_station(station):
 #----------------------------------------------------------------------
 
 def get_volume(defval=100):
-  station = get_station()
-  if station == STR_NO_STATION:
-    return defval
-  if not KEY_VOLUME in data:
-    return defval
-  if not station in data[KEY_VOLUME]:
-    return defval
-  return data[KEY_VOLUME][station]
+  return config.get_volume(defval)
 
 #----------------------------------------------------------------------
 
 def set_volume(val):
-  station = get_station()
-  if station == STR_NO_STATION:
-    return
-  if not KEY_VOLUME in data:
-    data[KEY_VOLUME] = { }
-  if station in data[KEY_VOLUME]:
-    if data[KEY_VOLUME][station] == val:
-      return
-  data[KEY_VOLUME][station] = val
-  write_data()
+  config.set_volume(val)
 
 #----------------------------------------------------------------------
 
 def get_debug():
-  return get_data(KEY_DEBUG)
+  return config.debug
 
 #----------------------------------------------------------------------
 
 def get_use_lcd():
-  return get_data(KEY_USE_LCD)
+  return config.use_lcd
 
 #----------------------------------------------------------------------
 
 def shell_command(cmd):
+  shell_spawns.inc()
   try:
     return commands.getstatusoutput(cmd)[1].rstrip().split(STR_NEWLINE)
   except:
@@ -158,181 +250,191 @@ def shell_command(cmd):
 
 #----------------------------------------------------------------------
 
+def mpd_command(func, *args):
+  start = time()
+  try:
+    return func(*args)
+  except MPDError:
+    mpd_errors.inc()
+    return None
+  finally:
+    metrics.histogram('radio_mpd_command_seconds', 'MPD command latency',
+                      {'command': func.__name__}).observe(time() - start)
+
+#----------------------------------------------------------------------
+
 def mpc_clear():
-  shell_command(CMD_MPC_CLEAR)
+  mpd_command(mpd.clear)
 
 #----------------------------------------------------------------------
 
 def mpc_stop():
-  shell_command(CMD_MPC_STOP)
+  mpd_command(mpd.stop)
 
 #----------------------------------------------------------------------
 
 def mpc_play():
-  shell_command(CMD_MPC_PLAY)
+  mpd_command(mpd.play)
 
 #----------------------------------------------------------------------
 
 def mpc_load(station):
-  shell_command(CMD_MPC_LOAD + STR_SPACE + station)
+  mpd_command(mpd.load, station)
 
 #----------------------------------------------------------------------
 
 def mpc_volume(vol):
-  shell_command(CMD_MPC_VOLUME + STR_SPACE + str(vol))
+  mpd_command(mpd.setvol, vol)
 
 #----------------------------------------------------------------------
 
-def mpc_current():
-  return STR_SPACE.join(shell_command(CMD_MPC_CURRENT))
+def mpc_play_station(station, vol):
+  mpd_command(mpd.play_playlist, station, vol)
 
 #----------------------------------------------------------------------
 
-def mpc_lsplaylists():
-  return shell_command(CMD_MPC_LSPLAYLISTS)
+def mpc_current():
+  return watcher.current()
+
+#----------------------------------------------------------------------
+
+def backend_options():
+  return {
+    'cols': COLS,
+    'rows': ROWS,
+    'int_gpio': get_data(KEY_INT_GPIO, None),
+    'size': (PYGAME_WIDTH, PYGAME_HEIGHT),
+    'caption': PYGAME_CAPTION,
+    'font_name': FONT_MONOSPACE,
+    'font_size': FONT_MONOSPACE_SIZE,
+    # Headless (SDL dummy driver) when there is no X display, unless
+    # the config says otherwise; debug_dump names a directory for PNGs
+    'headless': get_data(KEY_DEBUG_HEADLESS, None),
+    'dump_dir': get_data(KEY_DEBUG_DUMP, None)
+  }
+
+#----------------------------------------------------------------------
+
+# The backends key lists them by name; without it use_lcd and debug pick
+# the plate and the pygame window as before (never pygame when root).
+def selected_backends():
+  names = get_data(KEY_BACKENDS, None)
+  if names is not None:
+    return list(names)
+  res = [ ]
+  if get_use_lcd():
+    res.append(backends.BACKEND_PLATE)
+  # Without the plate the debug window is the display
+  if (get_debug() or not get_use_lcd()) and not IS_ROOT:
+    res.append(backends.BACKEND_PYGAME)
+  return res
 
 #----------------------------------------------------------------------
 
-def debug_init():
-  pygame.init()
-  global screen, font
-  screen = pygame.display.set_mode((PYGAME_WIDTH, PYGAME_HEIGHT))
-  font = pygame.font.SysFont(FONT_MONOSPACE, FONT_MONOSPACE_SIZE)
-  pygame.display.set_caption(PYGAME_CAPTION)
+def open_backend(name, options):
+  with boot.phase('backend ' + name):
+    try:
+      backend = backends.create(name, options)
+      backend.open()
+    except Exception, e:
+      print 'Backend %s: %s' % (name, e)
+      return None
+  return backend
 
 #----------------------------------------------------------------------
 
-def debug_write_lines(lines):
-  global screen, font
-  if backlight == Adafruit_CharLCDPlate.ON:
-    screen.fill((64, 64, 64))
-  elif backlight == Adafruit_CharLCDPlate.RED:
-    screen.fill((64, 0, 0))
-  else:
-    screen.fill((0, 0, 0))
-  i = 0
-  while (i < len(lines)):
-    line = font.render(lines[i], 2, (255, 255, 0))
-    screen.blit(line, (0, FONT_MONOSPACE_SIZE * i))
-    i = i + 1
-  pygame.display.flip()
+# Shows welcome (when given) on each display as soon as it is open
+def init_backends(welcome=None):
+  options = backend_options()
+  names = selected_backends()
+  for name in names:
+    backend = open_backend(name, options)
+    if backend is None:
+      if name == backends.BACKEND_PLATE and get_data(KEY_BACKENDS, None) is None:
+        # No plate: fall back to the debug window
+        set_data(KEY_USE_LCD, False)
+        if not IS_ROOT and backends.BACKEND_PYGAME not in names:
+          names.append(backends.BACKEND_PYGAME)
+      continue
+    displays.append(backend)
+    if backend.has_input:
+      inputs.append(backend)
+    if welcome is not None:
+      write_lines(welcome)
+      if len(displays) == 1:
+        boot.mark('welcome')
 
 #----------------------------------------------------------------------
 
-def lcd_init():
-  global lcd
-  try:
-    lcd = Adafruit_CharLCDPlate()
-    lcd.begin(COLS, ROWS)
-    lcd.clear()
-  except:
-    set_data(KEY_USE_LCD, False)
-
-#----------------------------------------------------------------------
-
-def lcd_write_lines(lines):
-  lcd.home()
-  i = 0
-  while (i < len(lines)):
-    lcd.message(lines[i])
-    i = i + 1
+def close_backends():
+  for display in displays:
+    display.close()
 
 #----------------------------------------------------------------------
 
+# Takes the full text of each line; backends that can scroll in hardware
+# get the marquee when it fits, the others a scrolled window
 def write_lines(lines):
-  if get_debug():
-    debug_write_lines(lines)
-  if get_use_lcd():
-    lcd_write_lines(lines)
+  start = time()
+  scrolled = None
+  for display in displays:
+    if display.hardware_scroll and marquee_fits(lines):
+      display.write([marquee(line) for line in lines],
+                    scroller_skip(MARQUEE_WIDTH))
+    else:
+      if scrolled is None:
+        scrolled = [scroller(line) for line in lines]
+      display.write(scrolled)
+  frame_seconds.observe(time() - start)
 
 #----------------------------------------------------------------------
 
-def debug_get_input():
-  for event in pygame.event.get():
-    if event.type == pygame.QUIT:
-      pygame.quit()
-      sys.exit()
-  pressed = pygame.key.get_pressed()
-  if pressed[pygame.K_q] == 1:
-    sys.exit()
-  res = 0
-  if pressed[pygame.K_SPACE] == 1:
-    res |= FLAG_SELECT
-  if pressed[pygame.K_RETURN] == 1:
-    res |= FLAG_SELECT
-  if pressed[pygame.K_LEFT] == 1:
-    res |= FLAG_LEFT
-  if pressed[pygame.K_RIGHT] == 1:
-    res |= FLAG_RIGHT
-  if pressed[pygame.K_UP] == 1:
-    res |= FLAG_UP
-  if pressed[pygame.K_DOWN] == 1:
-    res |= FLAG_DOWN
-  return res
+# Interrupts are only used when the one input backend supports them
+def use_interrupts():
+  return len(inputs) == 1 and inputs[0].intsource is not None
 
 #----------------------------------------------------------------------
 
-def lcd_get_input():
-  res = 0
-  if lcd.buttonPressed(lcd.SELECT):
-    res |= FLAG_SELECT
-  if lcd.buttonPressed(lcd.LEFT):
-    res |= FLAG_LEFT
-  if lcd.buttonPressed(lcd.RIGHT):
-    res |= FLAG_RIGHT
-  if lcd.buttonPressed(lcd.UP):
-    res |= FLAG_UP
-  if lcd.buttonPressed(lcd.DOWN):
-    res |= FLAG_DOWN
-  return res
+# Buttons latched by the last interrupt.  Interrupts are only waited for
+# while no button is held; held buttons are sampled so releases are seen
+# even if the latched state was a bounce.
+def interrupt_input():
+  return inputs[0].interrupt_input()
 
 #----------------------------------------------------------------------
 
 def get_input():
   res = 0
-  if get_debug():
-    res |= debug_get_input()
-  if get_use_lcd():
-    res |= lcd_get_input()
+  for backend in inputs:
+    res |= backend.get_input()
   return res
 
 #----------------------------------------------------------------------
 
 def get_next_station(dir = 1):
-  stations = sorted(mpc_lsplaylists())
-  count = len(stations)
-  if count == 0:
-    return STR_NO_STATION
-  try:
-    station = get_data(KEY_STATION, STR_NO_STATION)
-    index = stations.index(station)
-    return stations[(index + count + dir) % count]
-  except:
-    return stations[0]
+  return catalog.next(get_station(), dir)
 
 #----------------------------------------------------------------------
 
 def get_shutdown_text():
-  return STR_SHUTDOWN_IN + STR_SPACE + FORMAT_SHUTDOWN_TIME.format(shutdown_time - time())
+  return STR_SHUTDOWN_IN + STR_SPACE + FORMAT_SHUTDOWN_TIME.format(shutdown_time - now())
 
 #----------------------------------------------------------------------
  
-def play_station(station):
-  set_station(station)
-  volume = get_volume()
-  mpc_stop()
-  mpc_clear()
-  mpc_load(station)
-  mpc_play()
-  mpc_volume(volume)
+def play_station(station, trace=NULL_TRACE):
+  with trace.span('set_station'):
+    set_station(station)
+  with trace.span('mpd play'):
+    mpc_play_station(station, get_volume())
 
 #----------------------------------------------------------------------
  
-def play_next_station(dir = 1):
-  station = get_next_station(dir)
+def play_next_station(dir = 1, trace=NULL_TRACE):
+  with trace.span('get_next_station'):
+    station = get_next_station(dir)
   if station == STR_NO_STATION:
     return
-  play_station(station)
+  play_station(station, trace)
   print get_station(), get_volume()
 
 #----------------------------------------------------------------------
@@ -356,109 +458,359 @@ def radio_fix():
 
 #----------------------------------------------------------------------
 
-def lcd_set_backlight(color):
-  lcd.backlight(color)
-
 def set_backlight(color):
   global backlight
   if backlight == color:
     return
-  if get_use_lcd():
-    lcd_set_backlight(color)
+  for display in displays:
+    display.set_backlight(color)
   backlight = color
 
 #----------------------------------------------------------------------
 
 def cancel_idle():
   global last_input_time
-  last_input_time = time()
-  set_backlight(Adafruit_CharLCDPlate.ON)
+  last_input_time = now()
+  set_backlight(COLOR_ON)
 
 #----------------------------------------------------------------------
 
 def start_idle():
-  set_backlight(Adafruit_CharLCDPlate.OFF)
+  set_backlight(COLOR_OFF)
 
 #----------------------------------------------------------------------
 
 def shutdown_now():
   write_lines( [
-    scroller(STR_SHUTTING_DOWN),
-    scroller(STR_SEE_YOU_LATER)
+    STR_SHUTTING_DOWN,
+    STR_SEE_YOU_LATER
   ] );
-  set_backlight(Adafruit_CharLCDPlate.OFF)
+  set_backlight(COLOR_OFF)
+  write_data()
   shell_command(CMD_SHUTDOWN)
   sys.exit()
 
 #----------------------------------------------------------------------
 
-read_data()
-write_data()
-if get_use_lcd():
-  lcd_init()
-if not get_use_lcd():
-  set_data(KEY_DEBUG, True)
-if IS_ROOT:
-  set_data(KEY_DEBUG, False)
-if not get_use_lcd() and not get_debug():
-  sys.exit()
-if get_debug():
-  debug_init()
-write_lines( [
-  scroller(STR_WELCOME),
-  scroller(STR_WELCOME_2)
-] )
-input = 0
-write_lines_time = 0
-shutdown_time = 0
-play_next_station(0)
-while True:
-  lastinput = input
-  input = get_input()
-  if input & FLAG_LEFT:
-    cancel_idle()
-    if not (lastinput & FLAG_LEFT):
-      play_next_station(-1)
-      scroller_time = time()
-      write_lines_time = 0
-  elif input & FLAG_RIGHT:
-    cancel_idle()
-    if not (lastinput & FLAG_RIGHT):
-      play_next_station(1)
-      scroller_time = time()
-      write_lines_time = 0
-  elif input & FLAG_UP:
-    cancel_idle()
-    if not (lastinput & FLAG_UP):
-      adjust_volume(5)
-      write_lines_time = 0
-  elif input & FLAG_DOWN:
-    cancel_idle()
-    if not (lastinput & FLAG_DOWN):
-      adjust_volume(-5)
-      write_lines_time = 0
-  elif input & FLAG_SELECT:
-    cancel_idle()
-    if not (lastinput & FLAG_SELECT):
-      radio_fix()
-      shutdown_time = time() + SHUTDOWN_COUNTDOWN
-    if time() > shutdown_time:
-      shutdown_now()
-    write_lines( [
-      scroller(get_shutdown_text()),
-      scroller(STR_SPACE.join(shell_command(CMD_HOSTNAME)))
-    ] )
-    write_lines_time = 0
+def audio_playing():
+  "MPD is playing and the stream has actually advanced"
+  info = mpd_command(mpd.status)
+  if not info or info.get('state') != 'play':
+    return False
+  try:
+    return float(info.get('elapsed', 0)) > 0
+  except ValueError:
+    return False
+
+#----------------------------------------------------------------------
+
+def wait_for_audio(timeout=AUDIO_WAIT):
+  deadline = time() + timeout
+  while time() < deadline:
+    if audio_playing():
+      return True
+    sleep(AUDIO_POLL)
+  return False
+
+#----------------------------------------------------------------------
+
+# Runs on its own thread from the start of main(), so MPD and the
+# station list are dealt with while the displays initialise.  The report
+# goes out once audio is heard (or not) and the main loop is running.
+def resume_playback(running):
+  with boot.phase('mpd connect'):
+    mpd_command(mpd.connect)
+  with boot.phase('catalog'):
+    catalog.ensure()
+  with boot.phase('resume'):
+    play_next_station(0)
+  with boot.phase('wait audio'):
+    heard = wait_for_audio()
+  if heard:
+    boot_to_audio.set(boot.milestone('audio'))
   else:
-    if lastinput & FLAG_SELECT:
-      write_lines_time = 0
-    if time() > last_input_time + 5.0:
-      if backlight != Adafruit_CharLCDPlate.OFF:
-        start_idle()
-    if time() >= write_lines_time:
-      write_lines_time = time() + 0.5
-      write_lines( [
-        scroller(get_station() + STR_SPACE + str(get_volume())),
-        scroller(strftime(FORMAT_TIME) + STR_SPACE + mpc_current())
-      ] )
+    print 'No audio after %.0f s' % AUDIO_WAIT
+  running.wait(AUDIO_WAIT)
+  boot.report()
+
+#----------------------------------------------------------------------
+
+def start_resume():
+  running = threading.Event()
+  thread = threading.Thread(target=resume_playback, args=(running, ),
+                            name='radio-boot')
+  thread.daemon = True
+  thread.start()
+  return running
+
+#----------------------------------------------------------------------
+
+class RadioApp(object):
+  """ Runs the radio as tasks on an event loop: button sampling, a
+  display compositor with its own frame deadline, MPD status updates and
+  the backlight idle timer.  LCD/button I/O runs on the hw executor and
+  MPD/shell calls on the io executor, so a slow MPD never holds up input
+  or drawing.  Pass a loop with a VirtualClock (and inline executors) to
+  drive it from tests.  resume=False when the last station was already
+  started during boot. """
+
+  def __init__(self, loop=None, hw=None, io=None, edge=None, resume=True):
+    global clock, event_loop
+    self.loop = event_loop = loop or EventLoop()
+    clock = self.loop.clock
+    self.hw = hw or Executor(self.loop, 'radio-hw')     # LCD, buttons, pygame
+    self.io = io or Executor(self.loop, 'radio-io')     # MPD, shell
+    self.edge = edge or Executor(self.loop, 'radio-int') # Interrupt waits
+    self.frame_timer = None
+    self.idle_timer = None
+    self.rendering = False
+    self.exiting = False
+    self.resume = resume
+    self.station_trace = None # Station change waiting for audio
+
+  def start(self):
+    global scroller_time, last_input_time
+    scroller_time = last_input_time = now()
+    watcher.add_listener(self.on_mpd_change)
+    self.loop.call_soon(self.sample_input)
+    self.reset_idle()
+    self.invalidate()
+    if self.resume:
+      self.io.submit(play_next_station, (0, ), self.on_station)
+    return self
+
+  def stop(self):
+    self.loop.stop()
+    for executor in (self.hw, self.io, self.edge):
+      executor.stop()
+
+  def run(self):
+    self.start()
+    try:
+      self.loop.run_forever()
+    finally:
+      self.stop()
+
+  def on_exit(self, result, error):
+    if isinstance(error, SystemExit):
+      self.stop()
+
+  # --------------------------------------------------------------------
+  # Input
+
+  def sample_input(self):
+    if use_interrupts() and button_input.settled():
+      self.edge.submit(inputs[0].intsource.wait, (INPUT_WAIT, ), self.on_edge)
+    else:
+      self.hw.submit(get_input, (), self.on_input)
+
+  def on_edge(self, fired, error):
+    if fired:
+      self.hw.submit(interrupt_input, (), self.on_input)
+    else:
+      self.on_input(None, None)
+
+  def on_input(self, flags, error):
+    if isinstance(error, SystemExit):
+      self.stop()
+      return
+    button_input.update(flags)
+    for kind, flag, when in button_input.events():
+      self.on_button(kind, flag)
+    if self.exiting:
+      return # Nothing may light the display after the goodbye screen
+    if button_input.held():
+      self.activity()
+    if use_interrupts() and button_input.settled():
+      self.loop.call_soon(self.sample_input)
+    else:
+      self.loop.call_later(INPUT_INTERVAL, self.sample_input)
+
+  def on_button(self, kind, flag):
+    global scroller_time, shutdown_time
+    if kind == ButtonInput.RELEASE:
+      self.invalidate()
+      return
+    self.activity()
+    if kind == ButtonInput.LONGPRESS:
+      self.exiting = True
+      self.hw.submit(shutdown_now, (), self.on_exit)
+      return
+    if flag == FLAG_LEFT and kind == ButtonInput.PRESS:
+      self.change_station(-1)
+      scroller_time = now()
+    elif flag == FLAG_RIGHT and kind == ButtonInput.PRESS:
+      self.change_station(1)
+      scroller_time = now()
+    elif flag == FLAG_UP:
+      self.io.submit(adjust_volume, (5, ), self.on_station)
+    elif flag == FLAG_DOWN:
+      self.io.submit(adjust_volume, (-5, ), self.on_station)
+    elif flag == FLAG_SELECT and kind == ButtonInput.PRESS:
+      self.io.submit(radio_fix)
+      status.poke()
+      shutdown_time = now() + SHUTDOWN_COUNTDOWN
+    self.invalidate()
+
+  def on_station(self, result, error):
+    self.invalidate()
+
+  # --------------------------------------------------------------------
+  # Keypress-to-audio: each station change is traced from the press,
+  # through play_next_station on the io executor, to MPD polled until
+  # the new stream plays.  A later press supersedes the one in flight.
+
+  def change_station(self, dir):
+    if self.station_trace is not None:
+      self.station_trace.finish('superseded')
+    trace = self.station_trace = tracer.start('station %+d' % dir)
+    self.io.submit(play_next_station, (dir, trace),
+                   partial(self.on_station_change, trace))
+
+  def on_station_change(self, trace, result, error):
+    self.invalidate()
+    if trace is self.station_trace:
+      self.check_audio(trace)
+
+  def check_audio(self, trace):
+    self.io.submit(audio_playing, (), partial(self.on_audio, trace))
+
+  def on_audio(self, trace, heard, error):
+    if trace is not self.station_trace:
+      return
+    if heard:
+      trace.finish('playing', 'buffering')
+      key_to_audio.observe(trace.elapsed())
+    elif trace.elapsed() >= AUDIO_WAIT:
+      trace.finish('no audio', 'buffering')
+    else:
+      self.loop.call_later(AUDIO_POLL, self.check_audio, trace)
+      return
+    self.station_trace = None
+
+  # --------------------------------------------------------------------
+  # Display
+
+  def invalidate(self):
+    "Redraws as soon as possible"
+    self.schedule_frame(now())
+
+  def schedule_frame(self, when):
+    if self.frame_timer is not None:
+      if self.frame_timer.when <= when:
+        return
+      self.frame_timer.cancel()
+    self.frame_timer = self.loop.call_at(when, self.compose)
+
+  def compose(self):
+    self.frame_timer = None
+    if self.rendering:
+      # Previous frame still going out, don't queue up behind it
+      self.schedule_frame(now() + INPUT_INTERVAL)
+      return
+    if button_input.held() & FLAG_SELECT:
+      status.keep()
+      lines = [
+        get_shutdown_text(),
+        status.addresses_text()
+      ]
+      interval = FRAME_INTERVAL_FAST
+    else:
+      lines = [
+        get_station() + STR_SPACE + str(get_volume()),
+        strftime(FORMAT_TIME) + STR_SPACE + mpc_current()
+      ]
+      interval = FRAME_INTERVAL
+    self.rendering = True
+    self.hw.submit(write_lines, (lines, ), self.on_frame)
+    self.schedule_frame(now() + interval)
+
+  def on_frame(self, result, error):
+    self.rendering = False
+
+  def on_mpd_change(self, changed):
+    # Called on the watcher thread
+    self.loop.call_soon(self.invalidate)
+
+  # --------------------------------------------------------------------
+  # Backlight idle timer
+
+  def activity(self):
+    global last_input_time
+    last_input_time = now()
+    self.reset_idle()
+    if backlight != COLOR_ON:
+      self.hw.submit(cancel_idle)
+
+  def reset_idle(self):
+    if self.idle_timer is not None:
+      self.idle_timer.cancel()
+    self.idle_timer = self.loop.call_later(IDLE_TIMEOUT, self.on_idle)
+
+  def on_idle(self):
+    self.idle_timer = None
+    self.hw.submit(start_idle)
+
+#----------------------------------------------------------------------
+
+def start_metrics():
+  address = get_data(KEY_METRICS, METRICS_ADDRESS)
+  if not address:
+    return None
+  try:
+    return metrics.serve(address, pages={TRACE_PAGE: tracer.text})
+  except (IOError, OSError, ValueError), e:
+    print 'Metrics on %s: %s' % (address, e)
+    return None
+
+#----------------------------------------------------------------------
+
+# kill -USR1 writes the recent traces out
+def dump_traces(signum=None, frame=None):
+  path = get_data(KEY_TRACE_FILE, TRACE_FILE)
+  try:
+    tracer.write(path)
+  except (IOError, OSError), e:
+    print 'Traces to %s: %s' % (path, e)
+
+#----------------------------------------------------------------------
+
+# Service stop (SIGTERM) and hangup exit normally, so atexit still
+# flushes the config store's pending writes and closes the displays
+def terminate(signum=None, frame=None):
+  sys.exit(0)
+
+#----------------------------------------------------------------------
+
+def main():
+  boot.mark('main')
+  with boot.phase('config'):
+    if not read_data():
+      # Only a missing or broken file gets written, off the boot path
+      config.changed()
+  atexit.register(write_data)
+  if IS_ROOT:
+    set_data(KEY_DEBUG, False)
+  start_metrics()
+  signal.signal(signal.SIGUSR1, dump_traces)
+  signal.signal(signal.SIGTERM, terminate)
+  signal.signal(signal.SIGHUP, terminate)
+  # MPD, the station list and the last station in parallel with the
+  # displays, which show the welcome screen as soon as each is up
+  running = start_resume()
+  watcher.start()
+  init_backends( [
+    STR_WELCOME,
+    STR_WELCOME_2
+  ] )
+  if not displays:
+    sys.exit()
+  atexit.register(close_backends)
+  boot.mark('running')
+  running.set()
+  RadioApp(resume=False).run()
+
+#----------------------------------------------------------------------
 
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,267 @@
+#!/usr/bin/python
+
+# Small event loop for the radio.  Callbacks and timers run on the loop
+# thread; blocking work (I2C, MPD, shell) is handed to single-threaded
+# executors whose results are posted back to the loop.  The clock is
+# pluggable so tests can drive the loop with virtual time.  An idle loop
+# sleeps in select() on a pipe that other threads write a byte to, so it
+# wakes at once for them and not at all otherwise (Python 2's timed
+# Condition.wait polls every few milliseconds).
+#
+# (Python 2 has no asyncio; this provides the same call_soon /
+# call_later / run_in_executor shape for the radio's needs.)
+
+#----------------------------------------------------------------------
+
+import os, errno, fcntl, select, threading, heapq, traceback, Queue
+from time import time
+
+#----------------------------------------------------------------------
+
+class SystemClock(object):
+
+  def time(self):
+    return time()
+
+#----------------------------------------------------------------------
+
+class VirtualClock(object):
+  "Clock that only moves when advanced, for tests"
+
+  def __init__(self, start=0.0):
+    self.now = start
+
+  def time(self):
+    return self.now
+
+  def advance(self, seconds):
+    self.now += seconds
+
+#----------------------------------------------------------------------
+
+def set_nonblocking(fd):
+  fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+#----------------------------------------------------------------------
+
+class Timer(object):
+
+  def __init__(self, when, func, args):
+    self.when = when
+    self.func = func
+    self.args = args
+    self.cancelled = False
+
+  def cancel(self):
+    self.cancelled = True
+
+  def __lt__(self, other):
+    return self.when < other.when
+
+#----------------------------------------------------------------------
+
+class EventLoop(object):
+
+  def __init__(self, clock=None):
+    self.clock = clock or SystemClock()
+    self.timers = [ ]
+    self.ready = [ ]
+    self.lock = threading.RLock()
+    self.wakeup_r, self.wakeup_w = os.pipe()
+    for fd in (self.wakeup_r, self.wakeup_w):
+      set_nonblocking(fd)
+    self.waiting = False # In select(), needs a byte on the pipe to wake
+    self.running = False
+    self.stopped = False
+    self.thread = None
+    self.iterations = 0
+
+  def time(self):
+    return self.clock.time()
+
+  # Called with lock held
+  def wake(self):
+    if self.waiting:
+      self.waiting = False
+      try:
+        os.write(self.wakeup_w, '\0')
+      except OSError, err:
+        if err.errno != errno.EAGAIN:
+          raise
+
+  def drain(self):
+    try:
+      while os.read(self.wakeup_r, 512):
+        pass
+    except OSError, err:
+      if err.errno != errno.EAGAIN:
+        raise
+
+  # --------------------------------------------------------------------
+  # Scheduling
+
+  def call_soon(self, func, *args):
+    "Runs func on the loop thread; safe to call from any thread"
+    with self.lock:
+      self.ready.append((func, args))
+      self.wake()
+
+  def call_at(self, when, func, *args):
+    timer = Timer(when, func, args)
+    with self.lock:
+      heapq.heappush(self.timers, timer)
+      self.wake()
+    return timer
+
+  def call_later(self, delay, func, *args):
+    return self.call_at(self.time() + delay, func, *args)
+
+  # --------------------------------------------------------------------
+  # Running
+
+  def next_deadline(self):
+    with self.lock:
+      while self.timers and self.timers[0].cancelled:
+        heapq.heappop(self.timers)
+      return self.timers[0].when if self.timers else None
+
+  # Runs everything that is due.  With block set, waits for the next
+  # timer or a call_soon() first if nothing is ready (real clock only).
+  def run_once(self, block=True):
+    wait = False
+    with self.lock:
+      if block and not self.ready and self.running:
+        deadline = self.next_deadline()
+        timeout = None if deadline is None else deadline - self.time()
+        wait = self.waiting = timeout is None or timeout > 0
+    if wait:
+      try:
+        select.select([self.wakeup_r], [ ], [ ], timeout)
+      except select.error, err:
+        if err.args[0] != errno.EINTR:
+          raise
+      self.drain()
+    with self.lock:
+      self.waiting = False
+      ready, self.ready = self.ready, [ ]
+      now = self.time()
+      while self.timers and self.timers[0].when <= now:
+        timer = heapq.heappop(self.timers)
+        if not timer.cancelled:
+          ready.append((timer.func, timer.args))
+    self.iterations += 1
+    for func, args in ready:
+      if self.stopped:
+        break
+      try:
+        func(*args)
+      except (SystemExit, KeyboardInterrupt):
+        raise
+      except Exception:
+        traceback.print_exc()
+    return len(ready)
+
+  def run_forever(self):
+    self.running = True
+    self.stopped = False
+    self.thread = threading.current_thread()
+    try:
+      while self.running:
+        self.run_once()
+    finally:
+      self.running = False
+
+  def run_until(self, when):
+    """ Runs callbacks up to the given time without blocking, advancing
+    a VirtualClock from timer to timer.  Returns early after stop(). """
+    self.stopped = False
+    while not self.stopped:
+      self.run_once(False)
+      with self.lock:
+        pending = bool(self.ready)
+      if pending:
+        continue
+      deadline = self.next_deadline()
+      if deadline is None or deadline > when:
+        break
+      if deadline > self.time():
+        self.clock.advance(deadline - self.time())
+    if self.stopped:
+      return
+    if when > self.time():
+      self.clock.advance(when - self.time())
+    self.run_once(False)
+
+  def stop(self):
+    with self.lock:
+      self.running = False
+      self.stopped = True
+      self.wake()
+
+#----------------------------------------------------------------------
+
+class Executor(object):
+  """ One worker thread running blocking calls in submission order.
+  callback(result, error) is invoked on the loop thread. """
+
+  def __init__(self, loop, name):
+    self.loop = loop
+    self.queue = Queue.Queue()
+    self.busy = 0
+    self.thread = threading.Thread(target=self.run, name=name)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def submit(self, func, args=(), callback=None):
+    self.busy += 1
+    self.queue.put((func, args, callback))
+
+  def run(self):
+    while True:
+      job = self.queue.get()
+      if job is None:
+        return
+      func, args, callback = job
+      result, error = None, None
+      try:
+        result = func(*args)
+      except BaseException, err:
+        error = err
+        if not isinstance(err, SystemExit):
+          traceback.print_exc()
+      self.loop.call_soon(self.done, callback, result, error)
+
+  def done(self, callback, result, error):
+    self.busy -= 1
+    if callback is not None:
+      callback(result, error)
+
+  def stop(self):
+    self.queue.put(None)
+
+  def join(self, timeout=None):
+    self.thread.join(timeout)
+
+#----------------------------------------------------------------------
+
+class InlineExecutor(object):
+  "Runs submitted calls immediately, for tests driving a virtual clock"
+
+  def __init__(self, loop, name=None):
+    self.loop = loop
+    self.busy = 0
+
+  def submit(self, func, args=(), callback=None):
+    result, error = None, None
+    try:
+      result = func(*args)
+    except BaseException, err:
+      error = err
+    if callback is not None:
+      self.loop.call_soon(callback, result, error)
+
+  def stop(self):
+    pass
+
+  def join(self, timeout=None):
+    pass
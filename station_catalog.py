@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+# Sorted, cached list of stations (MPD stored playlists).  The list is
+# loaded once and reused until MPD reports a stored_playlist change or
+# the playlist directory's mtime moves, so stepping through stations
+# is a dict lookup instead of an lsplaylists round trip.
+
+#----------------------------------------------------------------------
+
+import os, threading
+from time import time
+
+#----------------------------------------------------------------------
+
+CATALOG_CHECK_INTERVAL = 2.0
+STR_NO_STATION = ''
+
+#----------------------------------------------------------------------
+
+class StationCatalog(object):
+
+  def __init__(self, loader, path=None, clock=time,
+               check_interval=CATALOG_CHECK_INTERVAL):
+    self.loader = loader
+    self.path = path
+    self.clock = clock
+    self.check_interval = check_interval
+    self.lock = threading.Lock()
+    self.stations = [ ]
+    self.positions = { }
+    self.valid = False
+    self.mtime = None
+    self.checked = 0
+    self.loads = 0
+
+  def invalidate(self):
+    self.valid = False
+
+  def on_mpd_change(self, changed):
+    "MPDWatcher listener"
+    if 'stored_playlist' in changed:
+      self.invalidate()
+
+  def dir_mtime(self):
+    if self.path is None:
+      return None
+    try:
+      return os.stat(self.path).st_mtime
+    except OSError:
+      return None
+
+  # A stat() at most every check_interval catches playlists added or
+  # removed on disk without MPD being told.
+  def check(self):
+    now = self.clock()
+    if now - self.checked < self.check_interval:
+      return
+    self.checked = now
+    if self.dir_mtime() != self.mtime:
+      self.invalidate()
+
+  def load(self):
+    "Reloads from the loader; on failure keeps the old list for now"
+    mtime = self.dir_mtime()
+    try:
+      stations = sorted(self.loader())
+    except Exception:
+      return False
+    positions = dict((name, i) for i, name in enumerate(stations))
+    with self.lock:
+      self.stations, self.positions = stations, positions
+      self.mtime = mtime
+      self.valid = True
+      self.loads += 1
+    return True
+
+  def ensure(self):
+    self.check()
+    if not self.valid:
+      self.load()
+
+  def names(self):
+    self.ensure()
+    return self.stations
+
+  def next(self, station, dir=1):
+    "Station dir steps from station, or the first one if it is unknown"
+    self.ensure()
+    with self.lock:
+      stations, positions = self.stations, self.positions
+    count = len(stations)
+    if count == 0:
+      return STR_NO_STATION
+    index = positions.get(station)
+    if index is None:
+      return stations[0]
+    return stations[(index + count + dir) % count]
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+# Cheap system status for the display: interface addresses (what
+# `hostname -I` prints), uptime, CPU temperature and load.  Everything is
+# read from /proc, sysfs or an ioctl instead of forking a shell, cached
+# for a TTL and kept fresh by a background thread while a screen showing
+# them is open, so it can render from memory.  The thread only runs
+# after a poke() and stops once nobody has asked for a while.
+
+#----------------------------------------------------------------------
+
+import os, socket, fcntl, struct, threading
+from time import time
+
+#----------------------------------------------------------------------
+
+SYS_NET = '/sys/class/net'
+PROC_IF_INET6 = '/proc/net/if_inet6'
+PROC_UPTIME = '/proc/uptime'
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+SIOCGIFADDR = 0x8915
+IFNAMSIZ = 16
+IPV6_SCOPE_GLOBAL = 0x00
+LOOPBACK = 'lo'
+STATUS_TTL = 5.0
+STATUS_REFRESH = 2.0
+STATUS_LINGER = 10.0 # Seconds of refreshing after the last poke()/keep()
+STR_SPACE = ' '
+
+#----------------------------------------------------------------------
+
+def interface_names():
+  try:
+    return sorted(os.listdir(SYS_NET))
+  except OSError:
+    return [ ]
+
+#----------------------------------------------------------------------
+
+def ipv4_address(sock, name):
+  "Primary IPv4 address of an interface, None if it has none"
+  try:
+    res = fcntl.ioctl(sock.fileno(), SIOCGIFADDR,
+                      struct.pack('256s', name[:IFNAMSIZ - 1]))
+  except IOError:
+    return None
+  return socket.inet_ntoa(res[20:24])
+
+#----------------------------------------------------------------------
+
+def ipv6_addresses():
+  "Global scope IPv6 addresses from /proc"
+  res = [ ]
+  try:
+    with open(PROC_IF_INET6) as infile:
+      for line in infile:
+        fields = line.split()
+        if len(fields) < 6 or int(fields[3], 16) != IPV6_SCOPE_GLOBAL:
+          continue
+        packed = fields[0].decode('hex')
+        if hasattr(socket, 'inet_ntop'):
+          res.append(socket.inet_ntop(socket.AF_INET6, packed))
+        else:
+          res.append(':'.join(fields[0][i:i + 4] for i in range(0, 32, 4)))
+  except (IOError, ValueError):
+    pass
+  return res
+
+#----------------------------------------------------------------------
+
+def read_addresses():
+  "All non-loopback addresses, IPv4 first, like `hostname -I`"
+  res = [ ]
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    for name in interface_names():
+      if name == LOOPBACK:
+        continue
+      addr = ipv4_address(sock, name)
+      if addr is not None:
+        res.append(addr)
+  finally:
+    sock.close()
+  return res + ipv6_addresses()
+
+#----------------------------------------------------------------------
+
+def read_uptime():
+  try:
+    with open(PROC_UPTIME) as infile:
+      return float(infile.read().split()[0])
+  except (IOError, ValueError, IndexError):
+    return None
+
+#----------------------------------------------------------------------
+
+def read_cpu_temp():
+  "CPU temperature in degrees C, None where there is no sensor"
+  try:
+    with open(THERMAL_ZONE) as infile:
+      return int(infile.read()) / 1000.0
+  except (IOError, ValueError):
+    return None
+
+#----------------------------------------------------------------------
+
+def read_load():
+  try:
+    return os.getloadavg()[0]
+  except OSError:
+    return None
+
+#----------------------------------------------------------------------
+
+class SystemStatus(object):
+  """ TTL cache over the readers above.  get() returns the cached value
+  and only reads again once it is older than the TTL; poke() and keep()
+  keep all items fresh from a background thread for a while, so get()
+  doesn't do I/O while a status screen is showing. """
+
+  readers = {
+    'addresses': read_addresses,
+    'uptime': read_uptime,
+    'cpu_temp': read_cpu_temp,
+    'load': read_load
+  }
+
+  def __init__(self, ttl=STATUS_TTL, clock=time, interval=STATUS_REFRESH,
+               linger=STATUS_LINGER):
+    self.ttl = ttl
+    self.clock = clock
+    self.interval = interval
+    self.linger = linger
+    self.values = { }
+    self.stamps = { }
+    self.lock = threading.Lock()
+    self.until = 0 # Refresh in the background up to this time
+    self.stopped = False
+    self.wakeup = threading.Event()
+    self.thread = None
+
+  def refresh(self, name=None):
+    for key in [name] if name else self.readers.keys():
+      self.values[key] = self.readers[key]()
+      self.stamps[key] = self.clock()
+
+  def get(self, name):
+    if self.clock() - self.stamps.get(name, -self.ttl) >= self.ttl:
+      self.refresh(name)
+    return self.values[name]
+
+  def addresses(self):
+    return self.get('addresses')
+
+  def addresses_text(self):
+    return STR_SPACE.join(self.addresses() or [ ])
+
+  def uptime(self):
+    return self.get('uptime')
+
+  def cpu_temp(self):
+    return self.get('cpu_temp')
+
+  def load(self):
+    return self.get('load')
+
+  # --------------------------------------------------------------------
+  # Background refresh
+
+  def keep(self):
+    """ Keep refreshing for linger seconds from now, e.g. every frame;
+    True if that started the thread (which refreshes first thing) """
+    with self.lock:
+      self.until = max(self.until, self.clock() + self.linger)
+      if self.thread is not None or self.stopped:
+        return False
+      self.thread = threading.Thread(target=self.run, name='system-status')
+      self.thread.daemon = True
+      self.thread.start()
+      return True
+
+  def poke(self):
+    "Refresh now and keep refreshing, e.g. when a status screen opens"
+    if not self.keep():
+      self.wakeup.set()
+
+  def run(self):
+    while True:
+      self.refresh()
+      self.wakeup.wait(self.interval)
+      self.wakeup.clear()
+      with self.lock:
+        if self.stopped or self.clock() >= self.until:
+          self.thread = None
+          return
+
+  def stop(self):
+    with self.lock:
+      self.stopped = True
+    self.wakeup.set()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+# Span tracing for one user action at a time, e.g. a station change from
+# the button press until MPD is actually playing.  A trace collects
+# (name, begin, end, thread) spans from whichever threads do the work and
+# is kept, once finished, in a ring buffer of the last few, which can be
+# printed or written to a file on demand.  Recording a span is two clock
+# reads and a list append; code that may or may not be traced takes
+# NULL_TRACE instead of checking for None.
+
+#----------------------------------------------------------------------
+
+import os, sys, threading
+from collections import deque
+from time import time, strftime, localtime
+
+#----------------------------------------------------------------------
+
+TRACE_BUFFER = 64
+OUTCOME_OPEN = 'open'
+FORMAT_START = '%H:%M:%S'
+
+#----------------------------------------------------------------------
+
+class Span(object):
+  "Context manager recording one span of a trace"
+
+  def __init__(self, trace, name):
+    self.trace = trace
+    self.name = name
+
+  def __enter__(self):
+    self.begin = self.trace.clock()
+    return self
+
+  def __exit__(self, *exc):
+    self.trace.add(self.name, self.begin, self.trace.clock())
+    return False
+
+#----------------------------------------------------------------------
+
+class Trace(object):
+
+  def __init__(self, tracer, id, name):
+    self.tracer = tracer
+    self.clock = tracer.clock
+    self.id = id
+    self.name = name
+    self.start = self.clock()
+    self.end = None
+    self.outcome = OUTCOME_OPEN
+    self.spans = [ ]
+
+  def span(self, name):
+    return Span(self, name)
+
+  def add(self, name, begin, end):
+    self.spans.append((name, begin, end, threading.current_thread().name))
+
+  def elapsed(self):
+    return (self.end or self.clock()) - self.start
+
+  # tail names a span from the end of the last one up to now, for time
+  # spent waiting on something that isn't code (MPD buffering)
+  def finish(self, outcome, tail=None):
+    if self.end is not None:
+      return
+    self.end = self.clock()
+    if tail is not None:
+      begin = max([span[2] for span in self.spans] or [self.start])
+      self.add(tail, begin, self.end)
+    self.outcome = outcome
+    self.tracer.finished(self)
+
+  def lines(self):
+    res = ['trace %d %s at %s.%03d: %s after %.1f ms' % (
+      self.id, self.name, strftime(FORMAT_START, localtime(self.start)),
+      int(self.start * 1e3) % 1000, self.outcome, self.elapsed() * 1e3)]
+    for name, begin, end, thread in sorted(self.spans, key=lambda s: s[1]):
+      res.append('  %8.1f %8.1f  %-20s %s' % ((begin - self.start) * 1e3,
+                                              (end - self.start) * 1e3,
+                                              name, thread))
+    return res
+
+#----------------------------------------------------------------------
+
+class NullSpan(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+class NullTrace(object):
+  "Accepts spans and drops them"
+
+  span_manager = NullSpan()
+
+  def span(self, name):
+    return self.span_manager
+
+  def add(self, name, begin, end):
+    pass
+
+  def finish(self, outcome, tail=None):
+    pass
+
+NULL_TRACE = NullTrace()
+
+#----------------------------------------------------------------------
+
+class Tracer(object):
+
+  def __init__(self, size=TRACE_BUFFER, clock=time):
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.traces = deque(maxlen=size) # Finished ones, oldest first
+    self.count = 0
+
+  def start(self, name):
+    with self.lock:
+      self.count += 1
+      id = self.count
+    return Trace(self, id, name)
+
+  def finished(self, trace):
+    with self.lock:
+      self.traces.append(trace)
+
+  def recent(self):
+    with self.lock:
+      return list(self.traces)
+
+  def text(self):
+    res = [ ]
+    for trace in self.recent():
+      res.extend(trace.lines())
+    return ''.join(line + '\n' for line in res)
+
+  def dump(self, outfile=None):
+    (outfile or sys.stdout).write(self.text())
+
+  def write(self, path):
+    "Writes the buffer to path (replacing it in one step)"
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as outfile:
+      self.dump(outfile)
+    os.rename(tmp, path)